@@ -0,0 +1,272 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+import errno
+import fnmatch
+import io
+import os
+import stat
+import tarfile
+
+from core.prefetch import PrefetchedFile, Prefetcher
+
+# GNU tar 1.0 稀疏格式在 ustar 头中记录的 size 上限（八进制 11 位）
+_MAX_USTAR_SIZE = 8 ** 11 - 1
+_COPY_BUFSIZE = 1024 * 1024
+
+@dataclass
+class ArchiveStats:
+    """归档统计"""
+    files: int = 0
+    bytes_read: int = 0
+    sparse_files: int = 0
+    sparse_bytes_skipped: int = 0
+    hardlinks: int = 0
+    hardlink_bytes_skipped: int = 0
+
+    @property
+    def bytes_skipped(self) -> int:
+        return self.sparse_bytes_skipped + self.hardlink_bytes_skipped
+
+def is_excluded(name: str, exclude_patterns: Iterable[str]) -> bool:
+    """name 是否匹配任一排除规则"""
+    return any(fnmatch.fnmatch(name, pattern) for pattern in exclude_patterns)
+
+def iter_tree(source_path: Path, exclude_patterns: Set[str], arc_root: Optional[str] = None,
+              include_dirs: bool = False,
+              onerror: Optional[Callable[[OSError], None]] = None) -> Iterator[Tuple[Path, str]]:
+    """遍历目录，返回 (文件路径, 归档内名称)
+
+    文件按归档内名称匹配排除规则，目录按归档内名称或绝对路径匹配；归档内名称默认以
+    source_path 的目录名开头，指定 arc_root 时以 arc_root 开头。
+    include_dirs 为真时目录本身也作为条目返回（先于其中的文件），用于保留目录的属主和权限。
+    无法列出的目录默认跳过，onerror 含义同 os.walk。
+    """
+    arc_base = Path(arc_root if arc_root is not None else source_path.name)
+    for root, dirs, files in os.walk(source_path, onerror=onerror):
+        # 过滤目录，排除匹配的目录
+        arc_dir = arc_base / Path(root).relative_to(source_path)
+        dirs[:] = [
+            d for d in dirs
+            if not is_excluded(str(Path(root) / d), exclude_patterns)
+            and not is_excluded(str(arc_dir / d), exclude_patterns)
+        ]
+
+        if include_dirs:
+            yield Path(root), str(arc_dir)
+
+        # 添加文件
+        for file in files:
+            file_path = Path(root) / file
+            relative_path = arc_base / file_path.relative_to(source_path)
+
+            # 如果文件不匹配排除的模式，则加入归档
+            if not is_excluded(str(relative_path), exclude_patterns):
+                yield file_path, str(relative_path)
+
+def data_segments(fd: int, size: int) -> Optional[List[Tuple[int, int]]]:
+    """用 SEEK_DATA/SEEK_HOLE 返回文件的数据段 [(offset, length)]
+
+    文件系统不支持空洞探测时返回 None。
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        return None
+
+    segments = []
+    pos = 0
+    try:
+        while pos < size:
+            try:
+                data = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:  # 剩余部分全是空洞
+                    break
+                raise
+            hole = os.lseek(fd, data, os.SEEK_HOLE)
+            segments.append((data, min(hole, size) - data))
+            pos = hole
+    except OSError as e:
+        if e.errno in (errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP):
+            return None
+        raise
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+
+    # 以空洞结尾时追加零长度段，解包时据此恢复文件大小
+    if not segments or sum(segments[-1]) < size:
+        segments.append((size, 0))
+    return segments
+
+class _SparseReader:
+    """按 GNU 1.0 稀疏格式输出成员数据：先是段映射块，然后依次是各数据段"""
+
+    def __init__(self, fileobj, segments: List[Tuple[int, int]]):
+        self.fileobj = fileobj
+        self.segments = list(segments)
+        self.header = self._map_block(segments)
+        self.stored_size = len(self.header) + sum(length for _, length in self.segments)
+        self._segment_index = 0
+        self._segment_left = 0
+
+    @staticmethod
+    def _map_block(segments: List[Tuple[int, int]]) -> bytes:
+        lines = [str(len(segments))]
+        for offset, length in segments:
+            lines.append(str(offset))
+            lines.append(str(length))
+        block = ('\n'.join(lines) + '\n').encode('ascii')
+        remainder = len(block) % tarfile.BLOCKSIZE
+        if remainder:
+            block += tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+        return block
+
+    def read(self, size: int = -1) -> bytes:
+        """读取 size 字节；tarfile 要求除末尾外不能出现短读"""
+        if size < 0:
+            size = self.stored_size
+        parts = []
+        while size > 0:
+            chunk = self._read_some(size)
+            if not chunk:
+                break
+            parts.append(chunk)
+            size -= len(chunk)
+        return b''.join(parts)
+
+    def _read_some(self, size: int) -> bytes:
+        if self.header:
+            chunk, self.header = self.header[:size], self.header[size:]
+            return chunk
+
+        while self._segment_left == 0:
+            if self._segment_index >= len(self.segments):
+                return b''
+            offset, length = self.segments[self._segment_index]
+            self._segment_index += 1
+            self.fileobj.seek(offset)
+            self._segment_left = length
+
+        chunk = self.fileobj.read(min(size, self._segment_left, _COPY_BUFSIZE))
+        self._segment_left -= len(chunk)
+        return chunk
+
+class TreeArchiver:
+    """感知稀疏文件和硬链接的 tar 写入器
+
+    - 稀疏文件以 GNU 1.0 稀疏成员写入（pax 格式），只读取和压缩数据段；
+    - 重复 inode 写为硬链接条目，不再重复存储内容；
+    - 提供 prefetcher 时由读线程池提前打开和读取后续文件，写入顺序不变。
+    """
+
+    def __init__(self, tar: tarfile.TarFile, progress=None, prefetcher: Optional[Prefetcher] = None):
+        if tar.format != tarfile.PAX_FORMAT:
+            raise ValueError("TreeArchiver requires a PAX_FORMAT tar file")
+        self.tar = tar
+        self.progress = progress
+        self.prefetcher = prefetcher
+        self.stats = ArchiveStats()
+        self._sparse_count = 0
+
+    def add_tree(self, source_path: Path, exclude_patterns: Set[str]) -> ArchiveStats:
+        return self.add_files(iter_tree(source_path, exclude_patterns))
+
+    def add_files(self, entries: Iterable[Tuple[Path, str]]) -> ArchiveStats:
+        if self.prefetcher is None:
+            for file_path, arcname in entries:
+                self.add_file(file_path, arcname)
+            return self.stats
+
+        for item in self.prefetcher.iter_files(entries):
+            try:
+                self._add_prefetched(item)
+            finally:
+                item.close()
+                self.prefetcher.release(item)
+        return self.stats
+
+    def add_file(self, path: Path, arcname: str) -> None:
+        st = os.lstat(str(path))
+        if not stat.S_ISREG(st.st_mode):
+            self.tar.addfile(self.tar.gettarinfo(str(path), arcname))
+            self._count(0)
+            return
+
+        with open(str(path), 'rb') as f:
+            tarinfo = self.tar.gettarinfo(str(path), arcname, fileobj=f)
+            self._add_regular(tarinfo, f, st)
+
+    def _add_prefetched(self, item: PrefetchedFile) -> None:
+        if item.error is not None:
+            raise item.error
+        if not stat.S_ISREG(item.st.st_mode):
+            self.tar.addfile(self.tar.gettarinfo(str(item.path), item.arcname))
+            self._count(0)
+            return
+
+        # gettarinfo 在写入线程中调用，硬链接表 tar.inodes 因此按写入顺序更新
+        tarinfo = self.tar.gettarinfo(arcname=item.arcname, fileobj=item.fileobj)
+        if item.data is not None and len(item.data) == tarinfo.size:
+            self.tar.addfile(tarinfo, io.BytesIO(item.data))
+            self._count(tarinfo.size)
+        else:
+            # 预读之后文件大小发生变化时从打开的文件重新读取
+            item.fileobj.seek(0)
+            self._add_regular(tarinfo, item.fileobj, item.st)
+
+    def _add_regular(self, tarinfo: tarfile.TarInfo, f: BinaryIO, st: os.stat_result) -> None:
+        if tarinfo.islnk():
+            self.tar.addfile(tarinfo)
+            self.stats.hardlinks += 1
+            self.stats.hardlink_bytes_skipped += st.st_size
+            self._count(0)
+            return
+
+        segments = None
+        # st_blocks 小于文件大小时才可能存在空洞，避免对普通文件多做 lseek
+        if st.st_size and getattr(st, 'st_blocks', None) is not None \
+                and st.st_blocks * 512 < st.st_size:
+            segments = data_segments(f.fileno(), st.st_size)
+
+        if segments is not None:
+            reader = _SparseReader(f, segments)
+            if reader.stored_size <= _MAX_USTAR_SIZE:
+                self._add_sparse(tarinfo, reader)
+                return
+
+        self.tar.addfile(tarinfo, f)
+        self._count(tarinfo.size)
+
+    def _add_sparse(self, tarinfo: tarfile.TarInfo, reader: _SparseReader) -> None:
+        data_size = reader.stored_size - len(reader.header)
+        real_name = tarinfo.name
+        real_size = tarinfo.size
+
+        # 头部名称使用短占位名，真实名称和大小放在 pax 扩展头中
+        tarinfo.name = f"GNUSparseFile.{self._sparse_count}/sparse"
+        tarinfo.size = reader.stored_size
+        tarinfo.pax_headers = dict(tarinfo.pax_headers)
+        tarinfo.pax_headers.update({
+            'GNU.sparse.major': '1',
+            'GNU.sparse.minor': '0',
+            'GNU.sparse.name': real_name,
+            'GNU.sparse.realsize': str(real_size),
+        })
+        self._sparse_count += 1
+
+        self.tar.addfile(tarinfo, reader)
+        self.stats.sparse_files += 1
+        self.stats.sparse_bytes_skipped += real_size - data_size
+        self._count(data_size)
+
+    def _count(self, nbytes: int) -> None:
+        self.stats.files += 1
+        self.stats.bytes_read += nbytes
+        if self.progress is not None:
+            self.progress.update(1, nbytes)
+
+def extract_all(tar: tarfile.TarFile, target_dir: Path) -> None:
+    """解包到 target_dir，支持时使用 tarfile 的 'tar' 过滤器拒绝越界路径"""
+    if hasattr(tarfile, 'tar_filter'):
+        tar.extractall(str(target_dir), filter='tar')
+    else:
+        tar.extractall(str(target_dir))
@@ -1,14 +1,49 @@
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Union
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import gzip
+import os
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from core.logger import Logger
-from core.config import DatabaseConfig, FolderConfig, VolumeConfig
+from core.config import BackupSettings, DatabaseConfig, FolderConfig, VolumeConfig
+from core.checksum import ChecksumWriter, checksum_path, write_checksum
+from core.crypto import ENCRYPTED_SUFFIX, EncryptingWriter, load_key, open_backup_file
+from core.events import EventBus, TaskProgress
+from core.estimator import (DEFAULT_COMPRESSION_RATIO, DEFAULT_THROUGHPUT, TaskEstimate,
+                            previous_backup_size)
+from core.pipeline import CHUNK_SIZE, threaded_chunks
+from core.snapshot import is_snapshot_dir, remove_snapshot
+
+# 写入中的文件/目录后缀，成功后原子重命名为最终名称
+PARTIAL_SUFFIX = '.partial'
+# backup_root 中的运行锁文件，见 RunLock
+RUN_LOCK_NAME = '.run.lock'
+CLEANUP_LOCK_NAME = '.cleanup.lock'
 
 class BackupPlugin(ABC):
-    def __init__(self, logger: Logger, backup_root: Path):
+    def __init__(self, logger: Logger, backup_root: Path, settings: Optional[BackupSettings] = None):
         self.logger = logger
         self.backup_root = backup_root
+        self.settings = settings
+        self.encryption_key = None
+        # BackupSystem 会换成自己的总线，单独使用插件时也可以直接订阅
+        self.events = EventBus()
+        # BackupSystem 注入的任务历史（TaskHistory），用于按上一次运行的压缩率和速度预估
+        self.history = None
+        # 当前任务的进度按线程保存，同一插件可以在多个线程中同时执行任务
+        self._local = threading.local()
+        encryption = settings.encryption if settings else None
+        if encryption and encryption.enabled:
+            self.encryption_key = load_key(encryption.key_file, encryption.key_env)
 
     @abstractmethod
     def backup(self, task_config: Union[DatabaseConfig, FolderConfig, VolumeConfig]) -> bool:
@@ -20,12 +55,111 @@ class BackupPlugin(ABC):
         """返回插件类型"""
         pass
 
+    @property
+    def task_progress(self) -> Optional[TaskProgress]:
+        return getattr(self._local, 'task_progress', None)
+
+    @task_progress.setter
+    def task_progress(self, progress: Optional[TaskProgress]) -> None:
+        self._local.task_progress = progress
+
+    def run_task(self, task_config: Union[DatabaseConfig, FolderConfig, VolumeConfig],
+                 expected_bytes: Optional[int] = None,
+                 expected_seconds: Optional[float] = None) -> bool:
+        """执行备份并发出 task_started / task_finished 事件，期间的进度更新发往 self.events"""
+        self.task_progress = self.events.start_task(
+            self.task_key(task_config), self.get_type(), expected_bytes, expected_seconds
+        )
+        success = False
+        try:
+            success = self.backup(task_config)
+        finally:
+            self.task_progress.finish(success)
+            self.task_progress = None
+        return success
+
+    def _progress(self, label: str):
+        """创建进度汇总器，更新同时计入当前任务的事件进度"""
+        return self.logger.progress(label, listener=self.task_progress)
+
+    def restore(self, task_config: Union[DatabaseConfig, FolderConfig, VolumeConfig],
+                source: Path, target: Optional[str] = None) -> bool:
+        """把备份流式恢复到目标
+
+        source 为日期目录时恢复其中最新的备份，也可以直接指定备份文件；
+        target 覆盖默认目标（数据库名、目录或卷名）。
+        """
+        self.logger.error("Restore is not supported for %s backups", self.get_type())
+        return False
+
+    def estimate(self, task_config: Union[DatabaseConfig, FolderConfig, VolumeConfig]) -> TaskEstimate:
+        """预估备份大小和耗时，默认使用该任务上一次备份的大小"""
+        previous = previous_backup_size(self.backup_root / self._backup_name(task_config))
+        size = previous or 0
+        return TaskEstimate(
+            task_key=self.task_key(task_config),
+            source_bytes=size,
+            archive_bytes=size,
+            seconds=size / DEFAULT_THROUGHPUT,
+            method='history' if previous is not None else 'unknown'
+        )
+
+    def _estimate_from_size(self, task_config: Union[DatabaseConfig, FolderConfig, VolumeConfig],
+                            data_bytes: int) -> TaskEstimate:
+        """按查询到的数据量预估，不做试导出
+
+        有上一次运行的记录和备份文件时，沿用其压缩率（备份大小/处理字节数）和速度，
+        否则使用默认压缩率和速度。
+        """
+        task_key = self.task_key(task_config)
+        record = self.history.get(task_key) if self.history is not None else None
+        previous = previous_backup_size(self.backup_root / self._backup_name(task_config))
+        if record and record.get('bytes') and previous is not None:
+            ratio = previous / record['bytes']
+            throughput = record['bytes'] / record['seconds'] if record.get('seconds') else DEFAULT_THROUGHPUT
+            method = 'history'
+        else:
+            ratio = DEFAULT_COMPRESSION_RATIO
+            throughput = DEFAULT_THROUGHPUT
+            method = 'query'
+        return TaskEstimate(
+            task_key=task_key,
+            source_bytes=data_bytes,
+            archive_bytes=int(data_bytes * ratio),
+            seconds=data_bytes / throughput,
+            method=method
+        )
+
     def create_folder(self, folder: Path) -> Path:
         """创建文件夹并返回Path对象"""
         folder.mkdir(parents=True, exist_ok=True)
-        self.logger.info(f"Ensured folder exists: {folder}")
+        self.logger.info("Ensured folder exists: %s", folder)
         return folder
 
+    def task_key(self, task_config: Union[DatabaseConfig, FolderConfig, VolumeConfig]) -> str:
+        """返回任务的唯一标识，用于运行日志"""
+        return self._backup_name(task_config)
+
+    def _backup_name(self, task_config: Union[DatabaseConfig, FolderConfig, VolumeConfig]) -> str:
+        """返回备份目录名 {type}_{identifier}"""
+        if isinstance(task_config, DatabaseConfig):
+            identifier = (
+                f"{task_config.docker.container}_{task_config.database}"
+                if task_config.docker.enabled
+                else f"{task_config.host}_{task_config.database}"
+            )
+            return f"{task_config.type}_{identifier}"
+
+        elif isinstance(task_config, FolderConfig):
+            identifier = Path(task_config.path).name
+            return f"folder_{identifier}"
+
+        elif isinstance(task_config, VolumeConfig):
+            return f"volume_{task_config.name}"
+
+        else:
+            raise ValueError(f"Unknown config type: {type(task_config)}")
+
     def _prepare_backup_path(self, task_config: Union[DatabaseConfig, FolderConfig, VolumeConfig]) -> Path:
         """准备备份目录
         
@@ -38,27 +172,212 @@ class BackupPlugin(ABC):
         volume_volumename/20241209
         """
         timestamp = datetime.now().strftime('%Y%m%d')
-        
-        if isinstance(task_config, DatabaseConfig):
-            identifier = (
-                f"{task_config.docker.container}_{task_config.database}"
-                if task_config.docker.enabled
-                else f"{task_config.host}_{task_config.database}"
-            )
-            backup_name = f"{task_config.type}_{identifier}"
-            
-        elif isinstance(task_config, FolderConfig):
-            identifier = Path(task_config.path).name
-            backup_name = f"folder_{identifier}"
-            
-        elif isinstance(task_config, VolumeConfig):
-            backup_name = f"volume_{task_config.name}"
-            
-        else:
-            raise ValueError(f"Unknown config type: {type(task_config)}")
+        backup_name = self._backup_name(task_config)
 
         backup_path = self.backup_root / backup_name / timestamp
         self.create_folder(backup_path)
         
-        self.logger.debug(f"Prepared backup path: {backup_path}")
-        return backup_path
\ No newline at end of file
+        self.logger.debug("Prepared backup path: %s", backup_path)
+        return backup_path
+
+    @contextmanager
+    def _atomic_output(self, target: Path) -> Iterator[Path]:
+        """以临时名称写入，成功后同步到磁盘并原子重命名为 target
+
+        失败（包括异常退出）时删除临时文件，因此备份目录中不会留下截断的归档。
+        临时名称带随机标记，共享 backup_root 的多个运行写同名目标时互不干扰。
+        """
+        partial = target.with_name(f"{target.name}.{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}")
+        try:
+            yield partial
+            if not partial.exists():
+                raise FileNotFoundError(f"Backup file not created: {partial}")
+            _fsync_path(partial)
+            os.replace(str(partial), str(target))
+            _fsync_path(target.parent)
+        except BaseException:
+            _remove_path(partial)
+            raise
+
+    def _output_path(self, target: Path) -> Path:
+        """返回实际写入的文件路径，启用加密时追加 .enc"""
+        if self.encryption_key is None:
+            return target
+        return target.with_name(target.name + ENCRYPTED_SUFFIX)
+
+    @contextmanager
+    def _open_output(self, target: Path,
+                     verify: Optional[Callable[[Path], None]] = None,
+                     encrypt: bool = True) -> Iterator[BinaryIO]:
+        """打开备份输出流
+
+        数据只经过一次：调用方写入的（已压缩）数据在启用加密时按块 AEAD 加密后
+        直接落盘，写入临时文件并在成功后原子重命名为 _output_path(target)。
+        提供 verify 时在重命名之前用它校验临时文件，校验失败的输出不会出现。
+        落盘字节的 sha256 同时记录到 .sha256 文件，供巡检时校验；记录先于数据重命名，
+        因此出现的备份总有对应的校验和。encrypt 为 False 时按明文写入 target，
+        用于分片清单这类无需密钥即可读取的元数据。
+        """
+        encrypt = encrypt and self.encryption_key is not None
+        output_path = self._output_path(target) if encrypt else target
+        sidecar = checksum_path(output_path)
+        try:
+            with self._atomic_output(output_path) as partial:
+                with open(partial, 'wb') as f:
+                    raw = ChecksumWriter(f)
+                    if not encrypt:
+                        yield raw
+                    else:
+                        writer = EncryptingWriter(raw, self.encryption_key)
+                        yield writer
+                        writer.close()
+                if verify is not None:
+                    verify(partial)
+
+                with self._atomic_output(sidecar) as checksum_partial:
+                    write_checksum(checksum_partial, output_path.name, raw.hexdigest())
+        except BaseException:
+            # 数据没有发布时不保留孤立的校验和记录
+            _remove_path(sidecar)
+            raise
+
+    def _open_input(self, path: Path) -> BinaryIO:
+        """打开已存储的备份用于读取，*.enc 文件流式解密并逐块校验"""
+        return open_backup_file(path, self.encryption_key)
+
+    def _select_backup(self, source: Path, suffixes: Tuple[str, ...]) -> Path:
+        """source 为日期目录时选择其中最新的备份文件（文件名含时间戳）"""
+        if not source.is_dir():
+            return source
+        candidates = [
+            path for path in source.iterdir()
+            if _plain_name(path.name).endswith(suffixes) and path.is_file()
+        ]
+        if not candidates:
+            raise FileNotFoundError(f"No backup found in {source}")
+        return max(candidates, key=lambda p: p.name)
+
+    def _read_backup(self, path: Path, decompress: bool) -> Iterator[bytes]:
+        """按块读取备份：解密，并在 decompress 时做 gzip 解压"""
+        with self._open_input(path) as f:
+            source = gzip.GzipFile(fileobj=f, mode='rb') if decompress else f
+            with source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    yield chunk
+
+    def _restore_chunks(self, chunks: Iterable[bytes], progress) -> Iterator[bytes]:
+        """读取（解密、解压）在后台线程进行，当前线程负责加载并统计进度"""
+        for chunk in threaded_chunks(chunks):
+            progress.update(0, len(chunk))
+            yield chunk
+
+
+def _plain_name(name: str) -> str:
+    """去掉加密后缀后的文件名"""
+    return name[:-len(ENCRYPTED_SUFFIX)] if name.endswith(ENCRYPTED_SUFFIX) else name
+
+
+class RunLock:
+    """backup_root 上的运行锁，协调共享同一备份目录的多个运行（如分布式模式的多个工作节点）
+
+    运行期间持有 .run.lock 的共享锁。清理未完成文件和过期备份会删掉其他运行正在写入的
+    内容，只在 exclusive() 能不等待地升级为独占锁（没有其他运行）时进行。flock 的升级会先
+    释放原有的锁，因此升级过程由 .cleanup.lock 串行化。不支持 flock 的平台上总是视为独占。
+    """
+
+    def __init__(self, backup_root: Path):
+        self.backup_root = backup_root
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> 'RunLock':
+        if fcntl is not None:
+            self.backup_root.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(str(self.backup_root / RUN_LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextmanager
+    def exclusive(self) -> Iterator[bool]:
+        """尝试升级为独占锁，产出是否成功；成功时其他运行在退出前无法开始"""
+        if self._fd is None:
+            yield True
+            return
+
+        cleanup_fd = os.open(str(self.backup_root / CLEANUP_LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(cleanup_fd, fcntl.LOCK_EX)
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                fcntl.flock(self._fd, fcntl.LOCK_SH)
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_SH)
+        finally:
+            os.close(cleanup_fd)
+
+
+def cleanup_partial_files(backup_root: Path, logger) -> int:
+    """删除崩溃运行遗留的 *.partial 文件和目录，返回删除数量"""
+    if not backup_root.exists():
+        return 0
+
+    removed = 0
+    for root, dirs, files in os.walk(str(backup_root)):
+        # 已完成的快照中不会有 .partial，不进入其中遍历；.partial 目录整体删除
+        kept = []
+        for name in dirs:
+            path = Path(root) / name
+            if name.endswith(PARTIAL_SUFFIX):
+                _remove_path(path)
+                removed += 1
+                logger.warning("Removed leftover partial backup: %s", path)
+            elif not is_snapshot_dir(path):
+                kept.append(name)
+        dirs[:] = kept
+
+        for name in files:
+            if name.endswith(PARTIAL_SUFFIX):
+                path = Path(root) / name
+                _remove_path(path)
+                removed += 1
+                logger.warning("Removed leftover partial backup: %s", path)
+    return removed
+
+
+def _fsync_path(path: Path) -> None:
+    """将文件（或目录项）同步到磁盘"""
+    if path.is_dir():
+        try:
+            fd = os.open(str(path), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+        return
+
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def _remove_path(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        # 未完成的快照目录可能已带有只读权限
+        try:
+            remove_snapshot(path)
+        except OSError:
+            pass
+    elif os.path.lexists(str(path)):
+        path.unlink()
@@ -0,0 +1,37 @@
+from pathlib import Path
+from typing import BinaryIO
+import hashlib
+
+# 备份文件的 sha256 记录，格式与 sha256sum 一致，可直接用 sha256sum -c 校验
+CHECKSUM_SUFFIX = '.sha256'
+
+class ChecksumWriter:
+    """写入时顺带计算落盘字节的 sha256，不额外读一遍文件"""
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self._digest = hashlib.sha256()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._digest.update(data)
+        return self.raw.write(data)
+
+    def flush(self) -> None:
+        self.raw.flush()
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+def checksum_path(path: Path) -> Path:
+    return path.with_name(path.name + CHECKSUM_SUFFIX)
+
+def write_checksum(path: Path, name: str, digest: str) -> None:
+    with open(path, 'w') as f:
+        f.write(f"{digest}  {name}\n")
+
+def read_checksum(path: Path) -> str:
+    with open(path) as f:
+        return f.read().split()[0]
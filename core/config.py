@@ -1,7 +1,7 @@
 from pathlib import Path
 from typing import Dict, List, Optional, Union
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
 @dataclass
@@ -14,6 +14,11 @@ class AuthConfig:
     username: str
     password: str
 
+@dataclass
+class DeltaConfig:
+    enabled: bool = True
+    full_every: int = 7  # 每隔多少次导出保存一次完整导出
+
 @dataclass
 class DatabaseConfig:
     type: str  # mongodb 或 mysql
@@ -23,20 +28,78 @@ class DatabaseConfig:
     database: str
     auth: Optional[AuthConfig] = None
     exclude: List[str] = None
+    delta: Optional[DeltaConfig] = None  # 仅 MySQL 支持
+
+@dataclass
+class ShardConfig:
+    count: int = 1
+    by: str = 'directory'  # directory 或 size
+    max_size: Optional[int] = None  # 按大小分片时每个分片的字节预算
+    workers: Optional[int] = None
+
+@dataclass
+class PrefetchConfig:
+    workers: int = 8  # 预读线程数
+    memory_limit: int = 64 * 1024 * 1024  # 预读到内存中的数据上限
 
 @dataclass
 class FolderConfig:
     path: Path
     exclude: List[str] = None
+    shards: Optional[ShardConfig] = None
+    prefetch: Optional[PrefetchConfig] = None  # 慢速或网络文件系统上提前读取后续文件
+    mode: str = 'archive'  # archive 或 snapshot
+    snapshot_hash: bool = False  # 快照模式下额外用 sha256 判断文件是否变化
 
 @dataclass
 class VolumeConfig:
     name: str
+    exclude: List[str] = None  # 仅在宿主机直接读取挂载点时生效
+
+@dataclass
+class EncryptionConfig:
+    enabled: bool
+    key_file: Optional[str] = None
+    key_env: Optional[str] = None
+
+@dataclass
+class PreflightConfig:
+    enabled: bool = True
+    on_insufficient: str = 'refuse'  # refuse 或 reorder
+    margin: float = 1.1  # 预估大小的安全系数
+
+@dataclass
+class ScrubConfig:
+    cycle_days: int = 30  # 整个备份库在多少天内巡检一遍
+    workers: int = 2
+    max_rate: Optional[int] = None  # 读取速率上限（字节/秒），None 表示不限
 
 @dataclass
 class BackupSettings:
     backup_root: Path
     backup_keep_days: int
+    encryption: Optional[EncryptionConfig] = None
+    preflight: PreflightConfig = None
+    scrub: ScrubConfig = None
+
+@dataclass
+class DistributedTask:
+    key: str  # 工作节点本地配置中的任务标识，即备份目录名
+    workers: Optional[List[str]] = None  # 可执行该任务的工作节点，None 表示任何配置了该任务的节点
+
+    @property
+    def id(self) -> str:
+        return self.key if self.workers is None else f"{self.key}@{'+'.join(sorted(self.workers))}"
+
+@dataclass
+class CoordinatorConfig:
+    listen: str = '127.0.0.1:8750'  # 监听其他地址时必须设置访问令牌
+    state_dir: Path = Path('.')  # 任务历史和运行结果的保存位置
+    workers: List[str] = field(default_factory=list)  # 等待其注册并执行其本地全部任务的工作节点
+    tasks: List[DistributedTask] = field(default_factory=list)
+    lease_seconds: int = 60  # 工作节点超过此时间没有心跳即视为失联，任务重新分配
+    worker_wait_seconds: int = 600  # 任务等待可用工作节点的最长时间
+    max_attempts: int = 3
 
 class ConfigManager:
     def __init__(self, config_file: str, logger):
@@ -57,7 +120,10 @@ class ConfigManager:
             # 解析基本设置
             self.settings = BackupSettings(
                 backup_root=Path(config['settings']['backup_root']),
-                backup_keep_days=int(config['settings']['backup_keep_days'])
+                backup_keep_days=int(config['settings']['backup_keep_days']),
+                encryption=self._parse_encryption_config(config['settings'].get('encryption')),
+                preflight=self._parse_preflight_config(config['settings'].get('preflight', {})),
+                scrub=self._parse_scrub_config(config['settings'].get('scrub', {}))
             )
 
             # 解析数据库任务
@@ -74,15 +140,48 @@ class ConfigManager:
                 self.volume_tasks.append(self._parse_volume_config(volume))
 
         except json.JSONDecodeError as e:
-            self.logger.error(f"Invalid JSON format in {self.config_file}: {str(e)}")
+            self.logger.error("Invalid JSON format in %s: %s", self.config_file, e)
             raise
         except KeyError as e:
-            self.logger.error(f"Missing required configuration key: {str(e)}")
+            self.logger.error("Missing required configuration key: %s", e)
             raise
         except Exception as e:
-            self.logger.error(f"Failed to load configuration: {str(e)}")
+            self.logger.error("Failed to load configuration: %s", e)
             raise
 
+    def _parse_encryption_config(self, config: Optional[Dict]) -> Optional[EncryptionConfig]:
+        """解析加密配置"""
+        if not config:
+            return None
+        return EncryptionConfig(
+            enabled=bool(config.get('enabled', True)),
+            key_file=config.get('key_file'),
+            key_env=config.get('key_env')
+        )
+
+    def _parse_preflight_config(self, config: Dict) -> PreflightConfig:
+        """解析预检配置"""
+        on_insufficient = config.get('on_insufficient', 'refuse')
+        if on_insufficient not in ('refuse', 'reorder'):
+            raise ValueError(f"Unknown preflight.on_insufficient: {on_insufficient} "
+                             "(expected 'refuse' or 'reorder')")
+        return PreflightConfig(
+            enabled=bool(config.get('enabled', True)),
+            on_insufficient=on_insufficient,
+            margin=float(config.get('margin', 1.1))
+        )
+
+    def _parse_scrub_config(self, config: Dict) -> ScrubConfig:
+        """解析巡检配置"""
+        return ScrubConfig(
+            cycle_days=int(config.get('cycle_days', 30)),
+            workers=int(config.get('workers', 2)),
+            max_rate=(
+                int(float(config['max_rate_mb']) * 1024 * 1024)
+                if config.get('max_rate_mb') else None
+            )
+        )
+
     def _parse_database_config(self, db_type: str, config: Dict) -> DatabaseConfig:
         """解析数据库配置"""
         docker_config = DockerConfig(
@@ -104,19 +203,74 @@ class ConfigManager:
             port=int(config['port']),
             database=config['database'],
             auth=auth_config,
-            exclude=config.get('exclude', [])
+            exclude=config.get('exclude', []),
+            delta=self._parse_delta_config(db_type, config['database'], config.get('delta'))
         )
 
+    def _parse_delta_config(self, db_type: str, database: str,
+                            config: Optional[Dict]) -> Optional[DeltaConfig]:
+        """解析增量导出配置，非 MySQL 任务开启增量直接报错而不是静默忽略"""
+        if not config:
+            return None
+        delta = DeltaConfig(
+            enabled=bool(config.get('enabled', True)),
+            full_every=int(config.get('full_every', 7))
+        )
+        if delta.enabled:
+            if db_type != 'mysql':
+                raise ValueError(f"Delta dumps are only supported for MySQL: {db_type} database {database}")
+            if delta.full_every < 1:
+                raise ValueError(f"delta.full_every must be at least 1 for database {database}")
+        return delta
+
     def _parse_folder_config(self, config: Dict) -> FolderConfig:
         """解析文件夹配置"""
+        shard_config = None
+        if 'shards' in config:
+            by = config['shards'].get('by', 'directory')
+            if by not in ('directory', 'size'):
+                raise ValueError(f"Unknown shard mode for {config['path']}: {by}")
+            if by == 'size' and not config['shards'].get('max_size_mb'):
+                raise ValueError(f"Size sharding requires max_size_mb for {config['path']}")
+            shard_config = ShardConfig(
+                count=int(config['shards'].get('count', 1)),
+                by=by,
+                max_size=(
+                    int(config['shards']['max_size_mb']) * 1024 * 1024
+                    if 'max_size_mb' in config['shards'] else None
+                ),
+                workers=(
+                    int(config['shards']['workers'])
+                    if 'workers' in config['shards'] else None
+                )
+            )
+
         return FolderConfig(
             path=Path(config['path']),
-            exclude=config.get('exclude', [])
+            exclude=config.get('exclude', []),
+            shards=shard_config,
+            prefetch=self._parse_prefetch_config(config.get('prefetch')),
+            mode=config.get('mode', 'archive'),
+            snapshot_hash=bool(config.get('snapshot_hash', False))
+        )
+
+    def _parse_prefetch_config(self, config) -> Optional[PrefetchConfig]:
+        """解析预读配置，true 表示使用默认值"""
+        if not config:
+            return None
+        if config is True:
+            return PrefetchConfig()
+        return PrefetchConfig(
+            workers=int(config.get('workers', 8)),
+            memory_limit=int(float(config.get('memory_mb', 64)) * 1024 * 1024)
         )
 
     def _parse_volume_config(self, config: Dict) -> VolumeConfig:
         """解析卷配置"""
-        return VolumeConfig(name=config['name'])
+        return VolumeConfig(
+            name=config['name'],
+            exclude=config.get('exclude', [])
+        )
 
     @property
     def backup_root(self) -> Path:
@@ -131,13 +285,29 @@ class ConfigManager:
         try:
             # 验证备份根目录
             if not self.backup_root.parent.exists():
-                self.logger.error(f"Backup root parent directory does not exist: {self.backup_root.parent}")
+                self.logger.error("Backup root parent directory does not exist: %s", self.backup_root.parent)
+                return False
+
+            # 验证加密配置
+            encryption = self.settings.encryption
+            if encryption and encryption.enabled:
+                if encryption.key_file and not Path(encryption.key_file).exists():
+                    self.logger.error("Encryption key file does not exist: %s", encryption.key_file)
+                    return False
+                if not encryption.key_file and not encryption.key_env:
+                    self.logger.error("Encryption enabled but neither key_file nor key_env is configured")
+                    return False
+
+            # 验证巡检配置
+            if self.settings.scrub.cycle_days < 1 or self.settings.scrub.workers < 1:
+                self.logger.error("scrub.cycle_days and scrub.workers must be at least 1")
                 return False
 
             # 验证数据库配置
             for db in self.database_tasks:
                 if db.docker.enabled and not db.docker.container:
-                    self.logger.error(f"Docker enabled but no container specified for {db.type} database {db.database}")
+                    self.logger.error("Docker enabled but no container specified for %s database %s",
+                                      db.type, db.database)
                     return False
 
             # 验证文件夹配置
@@ -146,13 +316,38 @@ class ConfigManager:
                     folder.path = Path.cwd() / folder.path
 
                 if not folder.path.exists():
-                    self.logger.error(f"Folder path does not exist: {folder.path}")
+                    self.logger.error("Folder path does not exist: %s", folder.path)
+                    return False
+
+                if folder.mode not in ('archive', 'snapshot'):
+                    self.logger.error("Unknown folder backup mode for %s: %s", folder.path, folder.mode)
+                    return False
+
+                if folder.mode == 'snapshot':
+                    if folder.shards:
+                        self.logger.error("Snapshot mode cannot be combined with shards: %s", folder.path)
+                        return False
+                    if encryption and encryption.enabled:
+                        self.logger.error("Snapshot mode stores plain files and cannot be encrypted: %s",
+                                          folder.path)
+                        return False
+
+                if folder.prefetch and (folder.prefetch.workers < 1 or folder.prefetch.memory_limit < 1):
+                    self.logger.error("Prefetch workers and memory_mb must be positive: %s", folder.path)
                     return False
 
+                if folder.shards:
+                    if folder.shards.by not in ('directory', 'size'):
+                        self.logger.error("Unknown shard mode for %s: %s", folder.path, folder.shards.by)
+                        return False
+                    if folder.shards.by == 'size' and not folder.shards.max_size:
+                        self.logger.error("Size sharding requires max_size_mb for %s", folder.path)
+                        return False
+
             return True
 
         except Exception as e:
-            self.logger.error(f"Configuration validation failed: {str(e)}")
+            self.logger.error("Configuration validation failed: %s", e)
             return False
 
     def get_task_configs(self) -> List[Dict]:
@@ -178,15 +373,31 @@ class ConfigManager:
                 })
             if db.exclude:
                 task['excludeCollection'] = db.exclude
+            if db.delta and db.delta.enabled:
+                task['delta'] = {'full_every': db.delta.full_every}
             tasks.append(task)
 
         # 转换文件夹任务
         for folder in self.folder_tasks:
-            tasks.append({
+            task = {
                 'type': 'folder',
                 'path': str(folder.path),
-                'exclude': folder.exclude
-            })
+                'exclude': folder.exclude,
+                'mode': folder.mode
+            }
+            if folder.shards:
+                task['shards'] = {
+                    'count': folder.shards.count,
+                    'by': folder.shards.by,
+                    'max_size': folder.shards.max_size,
+                    'workers': folder.shards.workers
+                }
+            if folder.prefetch:
+                task['prefetch'] = {
+                    'workers': folder.prefetch.workers,
+                    'memory_limit': folder.prefetch.memory_limit
+                }
+            tasks.append(task)
 
         # 转换卷任务
         for volume in self.volume_tasks:
@@ -195,7 +406,48 @@ class ConfigManager:
                 'docker': {
                     'is-docker': True,
                     'volume_name': volume.name
-                }
+                },
+                'exclude': volume.exclude
             })
 
         return tasks
+
+def load_coordinator_config(config_file: str, logger) -> CoordinatorConfig:
+    """加载协调节点配置
+
+    tasks 中的任务按 key 交给本地配置了该任务的工作节点，可用 workers 限定节点；
+    workers 中列出的节点注册后，其本地其余任务也加入任务表，只在该节点执行。
+    """
+    try:
+        with open(config_file) as f:
+            config = json.load(f)
+
+        coordinator = CoordinatorConfig(
+            listen=config.get('listen', '127.0.0.1:8750'),
+            state_dir=Path(config.get('state_dir', '.')),
+            workers=list(config.get('workers', [])),
+            tasks=[
+                DistributedTask(key=task['key'], workers=task.get('workers'))
+                for task in config.get('tasks', [])
+            ],
+            lease_seconds=int(config.get('lease_seconds', 60)),
+            worker_wait_seconds=int(config.get('worker_wait_seconds', 600)),
+            max_attempts=int(config.get('max_attempts', 3))
+        )
+    except json.JSONDecodeError as e:
+        logger.error("Invalid JSON format in %s: %s", config_file, e)
+        raise
+    except KeyError as e:
+        logger.error("Missing required configuration key: %s", e)
+        raise
+
+    if not coordinator.tasks and not coordinator.workers:
+        raise ValueError("Coordinator configuration needs tasks or workers")
+    ids = [task.id for task in coordinator.tasks]
+    if len(ids) != len(set(ids)):
+        raise ValueError("Duplicate coordinator tasks: the same key needs different workers")
+    if any(task.workers is not None and not task.workers for task in coordinator.tasks):
+        raise ValueError("Coordinator task workers must not be empty")
+    if coordinator.lease_seconds < 1 or coordinator.max_attempts < 1:
+        raise ValueError("lease_seconds and max_attempts must be positive")
+    return coordinator
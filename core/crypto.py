@@ -0,0 +1,198 @@
+from pathlib import Path
+from typing import BinaryIO, Optional
+import base64
+import binascii
+import io
+import os
+import struct
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+except ImportError:  # 仅在启用加密时需要
+    AESGCM = None
+    InvalidTag = Exception
+
+ENCRYPTED_SUFFIX = '.enc'
+
+# 文件格式：
+#   MAGIC | 8 字节随机 nonce 前缀 | 若干数据块
+#   数据块：4 字节大端长度（最高位为结束标志）| AES-256-GCM 密文（含 16 字节标签）
+# 每块 nonce = 前缀 + 4 字节块序号，结束标志作为附加认证数据，
+# 因此块的重排、替换和截断都能在解密时被发现。
+MAGIC = b'BKAEAD1\n'
+CHUNK_SIZE = 1024 * 1024
+_PREFIX_SIZE = 8
+_TAG_SIZE = 16
+_FINAL_FLAG = 0x80000000
+
+class DecryptionError(Exception):
+    pass
+
+def _require_aesgcm():
+    if AESGCM is None:
+        raise RuntimeError("Encryption requires the 'cryptography' package: pip install cryptography")
+
+def parse_key(data: bytes) -> bytes:
+    """解析 32 字节原始密钥，或其十六进制 / base64 文本形式"""
+    if len(data) == 32:
+        return data
+
+    text = data.strip()
+    for decode in (binascii.unhexlify, base64.b64decode):
+        try:
+            key = decode(text)
+        except (binascii.Error, ValueError):
+            continue
+        if len(key) == 32:
+            return key
+    raise ValueError("Encryption key must be 32 bytes (raw, hex or base64)")
+
+def load_key(key_file: Optional[str] = None, key_env: Optional[str] = None) -> bytes:
+    """从文件或环境变量读取密钥"""
+    if key_file:
+        with open(key_file, 'rb') as f:
+            return parse_key(f.read())
+    if key_env:
+        value = os.environ.get(key_env)
+        if not value:
+            raise ValueError(f"Environment variable {key_env} is not set")
+        return parse_key(value.encode())
+    raise ValueError("Encryption enabled but neither key_file nor key_env is configured")
+
+def _nonce(prefix: bytes, counter: int) -> bytes:
+    return prefix + struct.pack('>I', counter)
+
+class EncryptingWriter:
+    """分块 AEAD 加密写入器，内存占用恒定为一个数据块"""
+
+    def __init__(self, raw: BinaryIO, key: bytes, chunk_size: int = CHUNK_SIZE):
+        _require_aesgcm()
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self._aead = AESGCM(key)
+        self._prefix = os.urandom(_PREFIX_SIZE)
+        self._counter = 0
+        self._buffer = bytearray()
+        self.closed = False
+        self.raw.write(MAGIC + self._prefix)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            view = memoryview(self._buffer)
+            offset = 0
+            while len(self._buffer) - offset >= self.chunk_size:
+                self._write_chunk(view[offset:offset + self.chunk_size], final=False)
+                offset += self.chunk_size
+            view.release()
+            del self._buffer[:offset]
+        return len(data)
+
+    def flush(self) -> None:
+        self.raw.flush()
+
+    def close(self) -> None:
+        """写入结束块；不关闭底层文件"""
+        if self.closed:
+            return
+        self._write_chunk(bytes(self._buffer), final=True)
+        self._buffer = bytearray()
+        self.raw.flush()
+        self.closed = True
+
+    def _write_chunk(self, plaintext, final: bool) -> None:
+        flag = b'\x01' if final else b'\x00'
+        ciphertext = self._aead.encrypt(_nonce(self._prefix, self._counter), bytes(plaintext), flag)
+        length = len(ciphertext) | (_FINAL_FLAG if final else 0)
+        self.raw.write(struct.pack('>I', length))
+        self.raw.write(ciphertext)
+        self._counter += 1
+
+class DecryptingReader(io.RawIOBase):
+    """流式解密读取器，每个数据块在返回前都经过认证"""
+
+    def __init__(self, raw: BinaryIO, key: bytes):
+        _require_aesgcm()
+        self.raw = raw
+        self._aead = AESGCM(key)
+        header = raw.read(len(MAGIC) + _PREFIX_SIZE)
+        if header[:len(MAGIC)] != MAGIC:
+            raise DecryptionError("Not an encrypted backup file")
+        self._prefix = header[len(MAGIC):]
+        self._counter = 0
+        self._plain = b''
+        self._offset = 0
+        self._finished = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while self._offset >= len(self._plain):
+            if self._finished:
+                return 0
+            self._plain = self._read_chunk()
+            self._offset = 0
+
+        n = min(len(b), len(self._plain) - self._offset)
+        b[:n] = self._plain[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def _read_chunk(self) -> bytes:
+        length_bytes = self.raw.read(4)
+        if len(length_bytes) < 4:
+            raise DecryptionError("Encrypted backup is truncated (missing final chunk)")
+        length = struct.unpack('>I', length_bytes)[0]
+        final = bool(length & _FINAL_FLAG)
+        length &= ~_FINAL_FLAG
+
+        ciphertext = self.raw.read(length)
+        if len(ciphertext) < length or length < _TAG_SIZE:
+            raise DecryptionError("Encrypted backup is truncated")
+
+        try:
+            plaintext = self._aead.decrypt(
+                _nonce(self._prefix, self._counter), ciphertext, b'\x01' if final else b'\x00'
+            )
+        except InvalidTag:
+            raise DecryptionError(f"Authentication failed at chunk {self._counter}")
+        self._counter += 1
+
+        if final:
+            if self.raw.read(1):
+                raise DecryptionError("Unexpected data after final chunk")
+            self._finished = True
+        return plaintext
+
+def open_backup_file(path: Path, key: Optional[bytes] = None) -> BinaryIO:
+    """打开备份文件用于读取，加密文件（按文件头识别）透明解密"""
+    raw = open(path, 'rb')
+    try:
+        encrypted = raw.read(len(MAGIC)) == MAGIC
+        raw.seek(0)
+        if not encrypted:
+            return raw
+        if key is None:
+            raise ValueError(f"Encryption key required to read {path}")
+        return _ClosingBufferedReader(DecryptingReader(raw, key), raw)
+    except Exception:
+        raw.close()
+        raise
+
+class _ClosingBufferedReader(io.BufferedReader):
+    """关闭时同时关闭底层加密文件"""
+
+    def __init__(self, reader: DecryptingReader, raw: BinaryIO):
+        super().__init__(reader, buffer_size=CHUNK_SIZE)
+        self._raw_file = raw
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self._raw_file.close()
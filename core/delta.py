@@ -0,0 +1,296 @@
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+import gzip
+import hashlib
+import json
+import re
+
+from core.crypto import ENCRYPTED_SUFFIX, open_backup_file
+
+# 完整导出与增量导出的文件后缀（不含 .enc）
+FULL_SUFFIX = '.sql.gz'
+DELTA_SUFFIX = '.sql.delta.gz'
+# 行哈希索引：记录导出（重建后）每一行的哈希，供下一次增量编码使用
+INDEX_SUFFIX = '.lines'
+
+DELTA_MAGIC = b'BKDELTA1'
+DIGEST_SIZE = 16
+# 单个字面量块的最大长度
+_LITERAL_LIMIT = 1024 * 1024
+# 增量编码时在参考导出中向前查找匹配行的窗口（行数），决定编码时的内存上限
+MATCH_WINDOW = 256 * 1024
+
+_DUMP_RE = re.compile(r'-(\d{14})(\.sql\.gz|\.sql\.delta\.gz)(\.enc)?$')
+
+# 增量格式（整体 gzip 压缩）：
+#   BKDELTA1 <参考导出相对任务目录的路径>\n
+#   C <起始行> <行数>\n        从参考导出复制连续的行，起始行单调递增
+#   L <字节数>\n<原始数据>     字面量
+# 复制操作只向前推进，因此重建时可以顺序流式读取参考导出，内存占用恒定。
+
+def line_digest(line: bytes) -> bytes:
+    return hashlib.blake2b(line, digest_size=DIGEST_SIZE).digest()
+
+def is_delta(path: Path) -> bool:
+    name = path.name
+    if name.endswith(ENCRYPTED_SUFFIX):
+        name = name[:-len(ENCRYPTED_SUFFIX)]
+    return name.endswith(DELTA_SUFFIX)
+
+def dump_timestamp(path: Path) -> Optional[str]:
+    match = _DUMP_RE.search(path.name)
+    return match.group(1) if match else None
+
+def list_dumps(task_dir: Path) -> List[Path]:
+    """按时间顺序列出任务目录下所有日期目录中的完整和增量导出"""
+    if not task_dir.is_dir():
+        return []
+    dumps = [
+        path
+        for date_dir in task_dir.iterdir() if date_dir.is_dir()
+        for path in date_dir.iterdir() if path.is_file() and _DUMP_RE.search(path.name)
+    ]
+    return sorted(dumps, key=dump_timestamp)
+
+def index_path_for(dump_path: Path) -> Path:
+    """导出对应的行哈希索引路径（不含 .enc）"""
+    match = _DUMP_RE.search(dump_path.name)
+    return dump_path.with_name(dump_path.name[:match.start(2)] + INDEX_SUFFIX)
+
+class LineSplitter:
+    """把任意分块的字节流切分为以换行结尾的行"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        start = 0
+        while True:
+            newline = data.find(b'\n', start)
+            if newline < 0:
+                self._buffer += data[start:]
+                return
+            if self._buffer:
+                self._buffer += data[start:newline + 1]
+                line = bytes(self._buffer)
+                self._buffer = bytearray()
+                yield line
+            else:
+                yield bytes(data[start:newline + 1])
+            start = newline + 1
+
+    def finish(self) -> Iterator[bytes]:
+        if self._buffer:
+            line = bytes(self._buffer)
+            self._buffer = bytearray()
+            yield line
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    splitter = LineSplitter()
+    for chunk in chunks:
+        for line in splitter.feed(chunk):
+            yield line
+    for line in splitter.finish():
+        yield line
+
+@contextmanager
+def open_index(path: Path, key: Optional[bytes] = None) -> Iterator[Tuple[Dict, Iterator[bytes]]]:
+    """打开行哈希索引，产出 (头信息, 逐个读取的行哈希)，不把整个索引读入内存"""
+    with open_backup_file(path, key) as f:
+        header = json.loads(f.readline().decode())
+
+        def digests() -> Iterator[bytes]:
+            for digest in iter(lambda: f.read(DIGEST_SIZE), b''):
+                if len(digest) != DIGEST_SIZE:
+                    raise ValueError(f"Truncated line index: {path}")
+                yield digest
+
+        yield header, digests()
+
+class DeltaChainError(ValueError):
+    """增量链损坏：参考导出缺失、过短或链中出现循环"""
+
+class DumpWriter:
+    """导出写入 sink：同时写行哈希索引，并在有参考时按行做增量编码
+
+    作为 stream_command/copy_chunks 的 sink 使用，数据只经过一次。参考导出的行哈希
+    按顺序流式读取，只保留当前位置之后 window 行用于查找匹配，内存占用与导出大小无关；
+    参考中连续删除超过 window 行时，其后的内容写为字面量。
+    """
+
+    def __init__(self, out: BinaryIO, index_out: BinaryIO, header: Dict,
+                 reference: Optional[str] = None, reference_digests: Optional[Iterable[bytes]] = None,
+                 window: int = MATCH_WINDOW):
+        self.out = out
+        self.index_out = index_out
+        self.reference = reference
+        self.literal_bytes = 0
+        self.copied_lines = 0
+        self._splitter = LineSplitter()
+        self._ref = iter(reference_digests or ())
+        self._window_size = window
+        # 参考中 [_window_start, _window_start + len(_window)) 的行哈希及其位置
+        self._window: deque = deque()
+        self._window_start = 0
+        self._positions: Dict[bytes, deque] = {}
+        self._ref_pointer = 0
+        self._copy_start = None
+        self._copy_count = 0
+        self._literal = bytearray()
+
+        self.index_out.write(json.dumps(header).encode() + b'\n')
+        if reference is not None:
+            self._fill_window()
+            self.out.write(DELTA_MAGIC + b' ' + reference.encode() + b'\n')
+
+    def write(self, data: bytes) -> int:
+        for line in self._splitter.feed(data):
+            self._add_line(line)
+        return len(data)
+
+    def close(self) -> None:
+        for line in self._splitter.finish():
+            self._add_line(line)
+        self._flush_literal()
+        self._flush_copy()
+
+    def _add_line(self, line: bytes) -> None:
+        digest = line_digest(line)
+        self.index_out.write(digest)
+        if self.reference is None:
+            self.out.write(line)
+            return
+
+        position = self._match(digest)
+        if position is None:
+            self._flush_copy()
+            self._literal += line
+            if len(self._literal) >= _LITERAL_LIMIT:
+                self._flush_literal()
+            return
+
+        self._flush_literal()
+        if self._copy_start is not None and self._copy_start + self._copy_count == position:
+            self._copy_count += 1
+        else:
+            self._flush_copy()
+            self._copy_start = position
+            self._copy_count = 1
+        self._advance(position)
+
+    def _match(self, digest: bytes) -> Optional[int]:
+        """在窗口中查找匹配行：优先顺接当前位置，跳转只接受窗口中唯一的行"""
+        offset = self._ref_pointer - self._window_start
+        if offset < len(self._window) and self._window[offset] == digest:
+            return self._ref_pointer
+        positions = self._positions.get(digest)
+        if positions and len(positions) == 1 and positions[0] >= self._ref_pointer:
+            return positions[0]
+        return None
+
+    def _advance(self, position: int) -> None:
+        """当前位置移到 position 之后，丢弃窗口中已越过的行并补足窗口"""
+        self._ref_pointer = position + 1
+        while self._window_start < self._ref_pointer and self._window:
+            digest = self._window.popleft()
+            positions = self._positions[digest]
+            positions.popleft()
+            if not positions:
+                del self._positions[digest]
+            self._window_start += 1
+        self._fill_window()
+
+    def _fill_window(self) -> None:
+        while len(self._window) < self._window_size:
+            digest = next(self._ref, None)
+            if digest is None:
+                return
+            self._positions.setdefault(digest, deque()).append(self._window_start + len(self._window))
+            self._window.append(digest)
+
+    def _flush_copy(self) -> None:
+        if self._copy_start is None:
+            return
+        self.out.write(f"C {self._copy_start} {self._copy_count}\n".encode())
+        self.copied_lines += self._copy_count
+        self._copy_start = None
+        self._copy_count = 0
+
+    def _flush_literal(self) -> None:
+        if not self._literal:
+            return
+        self.out.write(f"L {len(self._literal)}\n".encode())
+        self.out.write(self._literal)
+        self.literal_bytes += len(self._literal)
+        self._literal = bytearray()
+
+def apply_delta(reference_lines: Iterator[bytes], delta: BinaryIO) -> Iterator[bytes]:
+    """顺序读取参考导出的行和增量指令，流式输出重建后的数据"""
+    position = 0
+    for op in iter(delta.readline, b''):
+        kind, *args = op.split()
+        if kind == b'C':
+            start, count = int(args[0]), int(args[1])
+            if start < position:
+                raise DeltaChainError("Delta copy operations must move forward")
+            try:
+                for _ in range(start - position):
+                    next(reference_lines)
+                for _ in range(count):
+                    yield next(reference_lines)
+            except StopIteration:
+                raise DeltaChainError(
+                    f"Delta chain corrupt: reference ends before line {start + count}"
+                ) from None
+            position = start + count
+        elif kind == b'L':
+            remaining = int(args[0])
+            while remaining:
+                chunk = delta.read(min(remaining, _LITERAL_LIMIT))
+                if not chunk:
+                    raise ValueError("Delta literal is truncated")
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            raise ValueError(f"Unknown delta operation: {op[:20]!r}")
+
+def _read_reference(path: Path, key: Optional[bytes]) -> Path:
+    """读取增量导出头部记录的参考导出路径"""
+    with open_backup_file(path, key) as raw:
+        with gzip.GzipFile(fileobj=raw, mode='rb') as f:
+            header = f.readline().split(b' ', 1)
+    if header[0] != DELTA_MAGIC or len(header) != 2:
+        raise DeltaChainError(f"Not a delta dump: {path}")
+    return path.parent.parent / header[1].strip().decode()
+
+def dump_chain(path: Path, key: Optional[bytes] = None) -> List[Path]:
+    """返回从完整导出到 path 的增量链（按重建顺序）"""
+    chain = [path]
+    while is_delta(chain[-1]):
+        reference = _read_reference(chain[-1], key)
+        if reference in chain:
+            raise DeltaChainError(f"Delta chain corrupt: cycle at {reference}")
+        if not reference.is_file():
+            raise DeltaChainError(f"Delta chain corrupt: missing reference {reference}")
+        chain.append(reference)
+    chain.reverse()
+    return chain
+
+def iter_dump(path: Path, key: Optional[bytes] = None) -> Iterator[bytes]:
+    """流式输出完整的 SQL 导出；增量导出先解析出整条链，再从完整导出起逐级叠加重建"""
+    chain = dump_chain(path, key)
+    with ExitStack() as stack:
+        def open_dump(dump: Path) -> BinaryIO:
+            raw = stack.enter_context(open_backup_file(dump, key))
+            return stack.enter_context(gzip.GzipFile(fileobj=raw, mode='rb'))
+
+        f = open_dump(chain[0])
+        chunks: Iterator[bytes] = iter(lambda: f.read(_LITERAL_LIMIT), b'')
+        for dump in chain[1:]:
+            delta = open_dump(dump)
+            delta.readline()  # 头部已由 dump_chain 校验
+            chunks = apply_delta(iter_lines(chunks), delta)
+        for chunk in chunks:
+            yield chunk
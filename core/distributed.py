@@ -0,0 +1,639 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, List, Optional, Set, Tuple
+import ipaddress
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from core.backup_base import RunLock
+from core.config import CoordinatorConfig
+from core.events import TASK_FINISHED, Event
+
+# 协调节点与工作节点共享的访问令牌，设置后请求必须携带
+TOKEN_ENV = 'BACKUP_COORDINATOR_TOKEN'
+# 协调节点的运行结果文件名，位于 state_dir
+RESULTS_NAME = 'coordinator-results.json'
+# 没有任何历史和预估时假定的任务耗时（秒）
+DEFAULT_TASK_SECONDS = 60.0
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+@dataclass
+class TaskState:
+    id: str
+    key: str  # 工作节点本地的任务标识
+    workers: Optional[List[str]]  # 可执行的节点，None 表示任何配置了 key 的节点
+    state: str = PENDING
+    worker: Optional[str] = None
+    attempts: int = 0
+    started: float = 0.0
+    lease_until: float = 0.0
+    waiting_since: Optional[float] = None
+    seconds: float = 0.0
+    bytes: int = 0
+    files: int = 0
+    error: Optional[str] = None
+    leased_by: List[str] = field(default_factory=list)  # 领取过该任务的节点，只接受它们的成功结果
+
+@dataclass
+class WorkerState:
+    name: str
+    concurrency: int
+    tasks: Dict[str, Optional[float]]  # 本地任务 key -> 本地记录的预期耗时
+    last_seen: float = 0.0
+    running: Set[str] = field(default_factory=set)
+    notified: bool = False  # 已收到运行结束的通知
+
+def plan_lpt(tasks: List[Tuple[str, float, List[str]]], slots: Dict[str, List[float]]) -> Dict[str, str]:
+    """最长处理时间优先（LPT）分配：按预期耗时从长到短，把每个任务交给最早空闲的可用工作槽
+
+    tasks 为 (任务 id, 预期耗时, 可执行节点)，slots 为每个节点各工作槽距离空闲的秒数。
+    返回 任务 id -> 节点；没有可用节点的任务不出现在结果中。
+    """
+    free_at = {worker: list(times) for worker, times in slots.items() if times}
+    plan = {}
+    for task_id, seconds, eligible in sorted(tasks, key=lambda t: (-t[1], t[0])):
+        candidates = [(min(free_at[w]), w) for w in eligible if w in free_at]
+        if not candidates:
+            continue
+        start, worker = min(candidates)
+        times = free_at[worker]
+        times[times.index(start)] = start + seconds
+        plan[task_id] = worker
+    return plan
+
+class Coordinator:
+    """协调节点：保存合并后的任务表，按工作节点并发数和历史耗时分配任务
+
+    工作节点通过 HTTP JSON 接口注册、领取任务、发送心跳和回报结果。租约在
+    lease_seconds 内没有心跳续期时任务重新分配给其他可用节点，超过 max_attempts
+    次后记为失败。所有方法都持锁执行，可在 HTTP 服务的多个线程中调用。
+    """
+
+    def __init__(self, config: CoordinatorConfig, logger, history):
+        self.config = config
+        self.logger = logger
+        self.history = history
+        self.tasks: Dict[str, TaskState] = {
+            task.id: TaskState(id=task.id, key=task.key, workers=task.workers)
+            for task in config.tasks
+        }
+        self.workers: Dict[str, WorkerState] = {}
+        self.started = time.time()
+        self._lock = threading.RLock()
+
+    # ---- 协议处理 ----
+
+    def register(self, payload: Dict) -> Dict:
+        with self._lock:
+            name = payload['name']
+            worker = WorkerState(
+                name=name,
+                concurrency=max(1, int(payload.get('concurrency', 1))),
+                tasks=dict(payload.get('tasks', {})),
+                last_seen=time.time()
+            )
+            previous = self.workers.get(name)
+            self.workers[name] = worker
+            if previous is not None:
+                # 重启后的节点不再执行旧租约中的任务
+                self._release_worker(previous, "worker re-registered")
+            self._discover_tasks(worker)
+            self.logger.info(
+                "Worker %s registered: concurrency %d, %d local tasks",
+                name, worker.concurrency, len(worker.tasks)
+            )
+            return {'lease_seconds': self.config.lease_seconds}
+
+    def lease(self, payload: Dict) -> Dict:
+        """按当前 LPT 计划把分给该节点的任务交给它，最多 slots 个"""
+        with self._lock:
+            worker = self._touch(payload['name'])
+            if worker is None:
+                return {'error': 'unregistered'}
+            if self.finished:
+                worker.notified = True
+                return {'tasks': [], 'done': True}
+
+            slots = max(0, int(payload.get('slots', 0)))
+            now = time.time()
+            plan = self._plan(now)
+            mine = sorted(
+                (task for task in self.tasks.values() if plan.get(task.id) == worker.name),
+                key=lambda task: -self._duration(task)
+            )[:slots]
+
+            leased = []
+            for task in mine:
+                task.state = RUNNING
+                task.worker = worker.name
+                task.attempts += 1
+                task.started = now
+                task.lease_until = now + self.config.lease_seconds
+                task.waiting_since = None
+                if worker.name not in task.leased_by:
+                    task.leased_by.append(worker.name)
+                worker.running.add(task.id)
+                leased.append({'id': task.id, 'key': task.key})
+                self.logger.info(
+                    "Assigned %s to %s (attempt %d, ~%.0fs)",
+                    task.id, worker.name, task.attempts, self._duration(task)
+                )
+            return {'tasks': leased, 'done': False}
+
+    def heartbeat(self, payload: Dict) -> Dict:
+        """续期节点正在执行的任务；返回已不属于该节点的任务，节点可不再回报"""
+        with self._lock:
+            worker = self._touch(payload['name'])
+            if worker is None:
+                return {'error': 'unregistered'}
+            lost = []
+            until = time.time() + self.config.lease_seconds
+            for task_id in payload.get('running', []):
+                task = self.tasks.get(task_id)
+                if task is not None and task.state == RUNNING and task.worker == worker.name:
+                    task.lease_until = until
+                else:
+                    lost.append(task_id)
+            return {'lost': lost}
+
+    def report(self, payload: Dict) -> Dict:
+        """记录任务结果；租约已转给其他节点时仍接受成功结果，失败结果被忽略
+
+        只接受已注册且领取过该任务的节点的结果。持有租约的节点回报失败时
+        按 max_attempts 重新排队，与租约过期的处理相同。
+        """
+        with self._lock:
+            worker = self._touch(payload['name'])
+            if worker is None:
+                return {'error': 'unregistered'}
+            task = self.tasks.get(payload['id'])
+            if task is None:
+                return {'error': 'unknown task'}
+            if worker.name not in task.leased_by:
+                self.logger.warning("Ignoring result for %s from %s, which never leased it",
+                                    task.id, worker.name)
+                return {'accepted': False}
+            worker.running.discard(task.id)
+            if task.state in (DONE, FAILED):
+                return {'accepted': False}
+
+            owner = task.state == RUNNING and task.worker == payload['name']
+            if payload.get('success'):
+                if task.worker != payload['name'] and task.worker in self.workers:
+                    self.workers[task.worker].running.discard(task.id)
+                task.state = DONE
+                task.worker = payload['name']
+                task.seconds = float(payload.get('seconds', 0.0))
+                task.bytes = int(payload.get('bytes', 0))
+                task.files = int(payload.get('files', 0))
+                task.error = None
+                self.history.record(task.id, task.seconds, task.bytes, task.files)
+                self.logger.info("Task %s completed on %s in %.1fs", task.id, task.worker, task.seconds)
+            elif owner:
+                error = payload.get('error') or 'backup failed'
+                self._requeue(task, f"failed on {task.worker}: {error}")
+            else:
+                return {'accepted': False}
+
+            self._log_totals()
+            return {'accepted': True}
+
+    def status(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            return {
+                'finished': self.finished,
+                'elapsed': round(now - self.started, 1),
+                'workers': {
+                    name: {
+                        'alive': self._alive(worker, now),
+                        'concurrency': worker.concurrency,
+                        'running': sorted(worker.running),
+                    }
+                    for name, worker in self.workers.items()
+                },
+                'tasks': [asdict(task) for task in self.tasks.values()],
+            }
+
+    # ---- 调度 ----
+
+    def expire(self) -> None:
+        """回收失联节点的租约，没有可用节点太久的任务记为失败"""
+        with self._lock:
+            now = time.time()
+            for task in self.tasks.values():
+                if task.state == RUNNING and task.lease_until < now:
+                    self.logger.warning("Lease of %s on %s expired", task.id, task.worker)
+                    if task.worker in self.workers:
+                        self.workers[task.worker].running.discard(task.id)
+                    self._requeue(task, f"worker {task.worker} stopped responding")
+
+            for task in self.tasks.values():
+                if task.state != PENDING:
+                    continue
+                if any(self._alive(self.workers[w], now) for w in self._eligible(task)):
+                    task.waiting_since = None
+                elif task.waiting_since is None:
+                    task.waiting_since = now
+                elif now - task.waiting_since > self.config.worker_wait_seconds:
+                    task.state = FAILED
+                    task.error = task.error or 'no worker available'
+                    self.logger.error("Task %s failed: %s", task.id, task.error)
+                    self._log_totals()
+
+    @property
+    def finished(self) -> bool:
+        """任务全部结束，且预期的节点都已注册（或已超过等待时间）"""
+        with self._lock:
+            waiting = time.time() - self.started <= self.config.worker_wait_seconds
+            if waiting and any(name not in self.workers for name in self.config.workers):
+                return False
+            return all(task.state in (DONE, FAILED) for task in self.tasks.values())
+
+    def _plan(self, now: float) -> Dict[str, str]:
+        slots = {}
+        for worker in self.workers.values():
+            if not self._alive(worker, now):
+                continue
+            # 正在执行的任务按预期剩余时间占用工作槽
+            times = [0.0] * worker.concurrency
+            for index, task_id in enumerate(sorted(worker.running)[:worker.concurrency]):
+                task = self.tasks[task_id]
+                times[index] = max(0.0, self._duration(task) - (now - task.started))
+            slots[worker.name] = times
+
+        pending = [
+            (task.id, self._duration(task), self._eligible(task))
+            for task in self.tasks.values() if task.state == PENDING
+        ]
+        plan = plan_lpt(pending, slots)
+        # 只把该节点现在就能开始的任务交给它，其余留待下一次计划
+        for worker in self.workers.values():
+            free = worker.concurrency - len(worker.running)
+            assigned = sorted((tid for tid, w in plan.items() if w == worker.name),
+                              key=lambda tid: -self._duration(self.tasks[tid]))
+            for task_id in assigned[max(0, free):]:
+                del plan[task_id]
+        return plan
+
+    def _duration(self, task: TaskState) -> float:
+        """预期耗时：协调节点的历史记录，其次是工作节点本地的记录，否则取已知耗时的中位数"""
+        history = self.history.get(task.id)
+        if history and history.get('seconds'):
+            return float(history['seconds'])
+        local = [
+            self.workers[w].tasks.get(task.key) for w in self._eligible(task)
+        ]
+        local = [seconds for seconds in local if seconds]
+        if local:
+            return float(max(local))
+        known = [entry['seconds'] for entry in self.history.tasks.values() if entry.get('seconds')]
+        return float(statistics.median(known)) if known else DEFAULT_TASK_SECONDS
+
+    def _eligible(self, task: TaskState) -> List[str]:
+        names = task.workers if task.workers is not None else list(self.workers)
+        return [name for name in names if name in self.workers and task.key in self.workers[name].tasks]
+
+    def _discover_tasks(self, worker: WorkerState) -> None:
+        """把预期节点本地未被任务表覆盖的任务加入任务表，只在该节点执行"""
+        if worker.name not in self.config.workers:
+            return
+        covered = {
+            task.key for task in self.tasks.values()
+            if task.workers is None or worker.name in task.workers
+        }
+        for key in worker.tasks:
+            if key not in covered:
+                task_id = f"{key}@{worker.name}"
+                self.tasks[task_id] = TaskState(id=task_id, key=key, workers=[worker.name])
+
+    def _requeue(self, task: TaskState, reason: str) -> None:
+        if task.attempts >= self.config.max_attempts:
+            task.state = FAILED
+            task.error = f"{reason}, giving up after {task.attempts} attempts"
+            self.logger.error("Task %s failed: %s", task.id, task.error)
+        else:
+            task.state = PENDING
+            task.error = reason
+            self.logger.warning("Reassigning %s: %s", task.id, reason)
+        task.worker = None
+
+    def _release_worker(self, worker: WorkerState, reason: str) -> None:
+        for task_id in list(worker.running):
+            task = self.tasks[task_id]
+            if task.state == RUNNING and task.worker == worker.name:
+                self._requeue(task, reason)
+        worker.running.clear()
+
+    def _touch(self, name: str) -> Optional[WorkerState]:
+        worker = self.workers.get(name)
+        if worker is not None:
+            worker.last_seen = time.time()
+        return worker
+
+    def _alive(self, worker: WorkerState, now: float) -> bool:
+        return now - worker.last_seen <= self.config.lease_seconds
+
+    def _log_totals(self) -> None:
+        counts = {state: 0 for state in (PENDING, RUNNING, DONE, FAILED)}
+        for task in self.tasks.values():
+            counts[task.state] += 1
+        self.logger.info(
+            "Tasks: %d done, %d failed, %d running, %d pending",
+            counts[DONE], counts[FAILED], counts[RUNNING], counts[PENDING]
+        )
+
+    # ---- 服务 ----
+
+    def serve(self, poll_interval: float = 1.0) -> bool:
+        """启动 HTTP 服务直到运行结束，保存结果并返回是否全部成功"""
+        host, _, port = self.config.listen.rpartition(':')
+        token = os.environ.get(TOKEN_ENV)
+        if not token and not _is_loopback(host):
+            raise ValueError(f"Refusing to listen on {self.config.listen} without {TOKEN_ENV}; "
+                             f"set a token or listen on 127.0.0.1")
+        server = _Server((host or '0.0.0.0', int(port)), _Handler)
+        server.coordinator = self
+        server.token = token
+        thread = threading.Thread(target=server.serve_forever, name='coordinator-http', daemon=True)
+        thread.start()
+        self.logger.info("Coordinator listening on %s:%d, %d tasks configured",
+                         host or '0.0.0.0', server.server_address[1], len(self.tasks))
+        try:
+            finished_at = None
+            while True:
+                self.expire()
+                now = time.time()
+                if self.finished:
+                    finished_at = finished_at or now
+                    # 等在线节点都收到结束通知后再退出，最多等一个租约周期
+                    live = [w for w in self.workers.values() if self._alive(w, now)]
+                    if all(w.notified for w in live) or now - finished_at > self.config.lease_seconds:
+                        break
+                time.sleep(poll_interval)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        return self._save_results()
+
+    def _save_results(self) -> bool:
+        status = self.status()
+        status['date'] = datetime.now().strftime('%Y%m%d%H%M%S')
+        self.config.state_dir.mkdir(parents=True, exist_ok=True)
+        path = self.config.state_dir / RESULTS_NAME
+        temp_path = path.with_name(path.name + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(status, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(str(temp_path), str(path))
+
+        failed = [task for task in self.tasks.values() if task.state != DONE]
+        missing = [name for name in self.config.workers if name not in self.workers]
+        self.logger.info(
+            "Distributed run finished in %.0fs: %d succeeded, %d failed; results in %s",
+            status['elapsed'], len(self.tasks) - len(failed), len(failed), path
+        )
+        for task in failed:
+            self.logger.error("Task %s: %s", task.id, task.error or task.state)
+        for name in missing:
+            self.logger.error("Worker %s never registered", name)
+        return not failed and not missing
+
+def _is_loopback(host: str) -> bool:
+    """监听地址是否只接受本机连接"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Handler(BaseHTTPRequestHandler):
+    """协调节点的 HTTP JSON 接口：POST /register /lease /heartbeat /result，GET /status"""
+
+    routes = {
+        '/register': 'register',
+        '/lease': 'lease',
+        '/heartbeat': 'heartbeat',
+        '/result': 'report',
+    }
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path != '/status':
+            return self._reply(404, {'error': 'not found'})
+        self._reply(200, self.server.coordinator.status())
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        method = self.routes.get(self.path)
+        if method is None:
+            return self._reply(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            self._reply(200, getattr(self.server.coordinator, method)(payload))
+        except (KeyError, ValueError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+
+    def _authorized(self) -> bool:
+        token = self.server.token
+        if token and self.headers.get('Authorization') != f"Bearer {token}":
+            self._reply(401, {'error': 'unauthorized'})
+            return False
+        return True
+
+    def _reply(self, code: int, body: Dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        self.server.coordinator.logger.debug("HTTP %s", format % args)
+
+class WorkerAgent:
+    """工作节点：在数据所在主机上用本地配置和插件执行协调节点分配的任务
+
+    system 为加载了本地配置的 BackupSystem。节点按 concurrency 领取任务，
+    后台线程定期发送心跳续期租约；协调节点宣布运行结束且本地任务都完成后，
+    执行本地的过期备份清理并退出。
+    """
+
+    def __init__(self, system, url: str, name: str, concurrency: int = 1,
+                 poll_interval: float = 2.0, retry_seconds: float = 300.0):
+        self.system = system
+        self.logger = system.logger
+        self.url = url.rstrip('/')
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.retry_seconds = retry_seconds
+        self.token = os.environ.get(TOKEN_ENV)
+        self.tasks = {
+            system.plugins[plugin_type].task_key(task): (plugin_type, task)
+            for plugin_type, task in system.collect_tasks() if plugin_type in system.plugins
+        }
+        self._running: Dict[str, str] = {}  # 任务 id -> 本地 key
+        self._lost: Set[str] = set()  # 租约已被收回、仍在本地执行的任务 id
+        self._finished: Dict[str, Event] = {}  # 本地 key -> task_finished 事件
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._lease_seconds = 60
+        system.events.subscribe(self._on_event)
+
+    def run(self) -> bool:
+        """参与一次分布式运行，返回本节点执行的任务是否全部成功
+
+        backup_root 可能与其他节点共享，持有运行锁，只在没有其他运行时清理。
+        """
+        with RunLock(self.system.config.backup_root) as run_lock:
+            self.system.cleanup_partials(run_lock)
+            results = self._participate()
+            self.system.cleanup_expired(run_lock)
+        failed = results.count(False)
+        self.logger.info("Worker finished: %s tasks succeeded, %s failed", len(results) - failed, failed)
+        return not failed
+
+    def _participate(self) -> List[bool]:
+        """注册并领取执行任务，直到协调节点宣布结束，返回各任务是否成功"""
+        advertised = {key: self.system.expected(key)[1] for key in self.tasks}
+        reply = self._call('/register', {
+            'name': self.name, 'concurrency': self.concurrency, 'tasks': advertised
+        })
+        self._lease_seconds = reply.get('lease_seconds', self._lease_seconds)
+        self.logger.info("Registered with %s as %s, %s local tasks", self.url, self.name, len(self.tasks))
+
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='worker-heartbeat', daemon=True)
+        heartbeat.start()
+        results: List[bool] = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while True:
+                    with self._lock:
+                        slots = self.concurrency - len(self._running)
+                    reply = self._call('/lease', {'name': self.name, 'slots': slots})
+                    if reply.get('error') == 'unregistered':
+                        raise RuntimeError("Coordinator no longer knows this worker")
+                    for item in reply.get('tasks', []):
+                        with self._lock:
+                            self._running[item['id']] = item['key']
+                        executor.submit(self._execute, item['id'], item['key'], results)
+                    with self._lock:
+                        idle = not self._running
+                    if reply.get('done') and idle:
+                        break
+                    time.sleep(self.poll_interval)
+        finally:
+            self._stop.set()
+        return results
+
+    def _execute(self, task_id: str, key: str, results: List[bool]) -> None:
+        plugin_type, task = self.tasks.get(key, (None, None))
+        success, error = False, None
+        try:
+            if task is None:
+                error = f"Task {key} is not configured on {self.name}"
+                self.logger.error(error)
+            else:
+                self.logger.info("Running %s for coordinator", task_id)
+                success = self.system.plugins[plugin_type].run_task(task, *self.system.expected(key))
+        except Exception as e:
+            error = str(e)
+            self.logger.error("%s backup failed: %s", plugin_type, error)
+
+        with self._lock:
+            event = self._finished.pop(key, None)
+            lost = task_id in self._lost
+            self._lost.discard(task_id)
+        payload = {
+            'name': self.name,
+            'id': task_id,
+            'success': success,
+            'seconds': event.elapsed if event else 0.0,
+            'bytes': event.bytes if event else 0,
+            'files': event.files if event else 0,
+            'error': error if not success else None,
+        }
+        try:
+            if lost:
+                # 任务已交给其他节点，不再回报，避免覆盖新租约的结果
+                self.logger.warning("Not reporting %s: its lease was taken over by another worker", task_id)
+            else:
+                reply = self._call('/result', payload)
+                if reply.get('error'):
+                    self.logger.error("Coordinator rejected the result of %s: %s", task_id, reply['error'])
+        except Exception as e:
+            self.logger.error("Could not report %s to %s: %s", task_id, self.url, e)
+        finally:
+            with self._lock:
+                self._running.pop(task_id, None)
+            results.append(success)
+
+    def _on_event(self, event: Event) -> None:
+        if event.type == TASK_FINISHED:
+            with self._lock:
+                self._finished[event.task] = event
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(max(1.0, self._lease_seconds / 3)):
+            with self._lock:
+                running = [task_id for task_id in self._running if task_id not in self._lost]
+            try:
+                reply = self._call('/heartbeat', {'name': self.name, 'running': running}, retry=False)
+            except Exception as e:
+                self.logger.warning("Heartbeat to %s failed: %s", self.url, e)
+                continue
+            # 插件任务无法中途取消：继续执行完，但不再续期也不回报结果
+            for task_id in reply.get('lost', []):
+                self.logger.warning("Lease of %s was taken over by another worker", task_id)
+                with self._lock:
+                    if task_id in self._running:
+                        self._lost.add(task_id)
+
+    def _call(self, path: str, payload: Dict, retry: bool = True) -> Dict:
+        """POST JSON；协调节点暂时不可达时重试，最多 retry_seconds 秒"""
+        data = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        deadline = time.monotonic() + self.retry_seconds
+        delay = 1.0
+        while True:
+            request = urllib.request.Request(self.url + path, data=data, headers=headers, method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    return json.loads(response.read() or b'{}')
+            except urllib.error.HTTPError as e:
+                if e.code < 500:
+                    raise RuntimeError(f"Coordinator rejected {path}: HTTP {e.code} {e.read().decode(errors='replace')}")
+                error = e
+            except (OSError, ValueError) as e:
+                error = e
+            if not retry or time.monotonic() + delay > deadline:
+                raise OSError(f"Coordinator {self.url} unreachable: {str(error)}")
+            self.logger.warning("Coordinator %s unreachable, retrying in %.0fs: %s", self.url, delay, error)
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Tuple
+import os
+import re
+import shutil
+import time
+import zlib
+
+from core.archiver import is_excluded
+
+# 没有测量数据时假定的处理速度（字节/秒）
+DEFAULT_THROUGHPUT = 50 * 1024 * 1024
+# 没有样本时假定的压缩率
+DEFAULT_COMPRESSION_RATIO = 0.5
+
+# 预估遍历的文件数量和耗时上限，超过后按已遍历部分外推
+_MAX_WALK_FILES = 50000
+_MAX_WALK_SECONDS = 3.0
+# 试压缩的样本数量和单个样本读取量
+_SAMPLE_FILES = 64
+_SAMPLE_BYTES = 256 * 1024
+
+_TIMESTAMP_RE = re.compile(r'-(\d{14})\.')
+
+@dataclass
+class TaskEstimate:
+    """单个任务的预估结果"""
+    task_key: str
+    source_bytes: int
+    archive_bytes: int
+    seconds: float
+    method: str  # sample / query / history / disk / unknown
+
+class CompressionProbe:
+    """统计写入数据量，并用与归档相同的 gzip 级别试压缩"""
+
+    def __init__(self, level: int = 9):
+        self._compressor = zlib.compressobj(level)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._started = time.monotonic()
+
+    def write(self, data: bytes) -> int:
+        self.bytes_in += len(data)
+        self.bytes_out += len(self._compressor.compress(data))
+        return len(data)
+
+    def finish(self) -> None:
+        self.bytes_out += len(self._compressor.flush())
+        self.elapsed = time.monotonic() - self._started
+
+    @property
+    def ratio(self) -> float:
+        if not self.bytes_in:
+            return DEFAULT_COMPRESSION_RATIO
+        return self.bytes_out / self.bytes_in
+
+    @property
+    def throughput(self) -> float:
+        elapsed = getattr(self, 'elapsed', time.monotonic() - self._started)
+        if not self.bytes_in or elapsed <= 0:
+            return DEFAULT_THROUGHPUT
+        return self.bytes_in / elapsed
+
+def sample_tree(source_path: Path, exclude_patterns: Set[str], arc_root: Optional[str] = None,
+                max_files: int = _MAX_WALK_FILES,
+                max_seconds: float = _MAX_WALK_SECONDS) -> Tuple[int, int, List[Path]]:
+    """抽样遍历目录，返回 (预估总字节数, 预估文件数, 试压缩样本)；排除规则和 arc_root 含义同 iter_tree
+
+    最多遍历 max_files 个文件或 max_seconds 秒。未遍历完时按覆盖比例外推：
+    每个目录的份额平分给其自身文件和各个子目录，已遍历目录的自身文件份额之和即覆盖比例。
+    """
+    arc_base = Path(arc_root if arc_root is not None else source_path.name)
+    deadline = time.monotonic() + max_seconds
+    total = 0
+    count = 0
+    covered = 0.0
+    candidates = []
+    pending = [(source_path, 1.0)]
+    while pending and count < max_files and time.monotonic() < deadline:
+        directory, share = pending.pop()
+        subdirs, files = [], []
+        try:
+            with os.scandir(str(directory)) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        is_dir = False
+                    arcname = str(arc_base / Path(entry.path).relative_to(source_path))
+                    if is_dir:
+                        if not is_excluded(entry.path, exclude_patterns) \
+                                and not is_excluded(arcname, exclude_patterns):
+                            subdirs.append(Path(entry.path))
+                    elif not is_excluded(arcname, exclude_patterns):
+                        files.append(entry)
+        except OSError:
+            pass
+
+        part = share / (len(subdirs) + 1)
+        covered += part
+        pending.extend((d, part) for d in subdirs)
+        for entry in files:
+            count += 1
+            try:
+                size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+            total += size
+            if size:
+                candidates.append(Path(entry.path))
+
+    if pending and covered > 0:
+        total = int(total / covered)
+        count = int(count / covered)
+
+    # 在遍历顺序上均匀选取样本
+    step = max(1, len(candidates) // _SAMPLE_FILES)
+    return total, count, candidates[::step][:_SAMPLE_FILES]
+
+def trial_compress(samples: Iterable[Path]) -> CompressionProbe:
+    """读取样本文件开头的数据并试压缩，得到压缩率和吞吐量"""
+    probe = CompressionProbe()
+    for path in samples:
+        try:
+            with open(str(path), 'rb') as f:
+                probe.write(f.read(_SAMPLE_BYTES))
+        except OSError:
+            continue
+    probe.finish()
+    return probe
+
+def previous_backup_size(task_dir: Path) -> Optional[int]:
+    """返回任务上一次备份的大小（最新日期目录中最新时间戳的文件之和）"""
+    if not task_dir.is_dir():
+        return None
+
+    date_dirs = sorted(
+        (d for d in task_dir.iterdir() if d.is_dir() and d.name.isdigit()),
+        reverse=True
+    )
+    for date_dir in date_dirs:
+        groups = {}
+        for path in date_dir.iterdir():
+            match = _TIMESTAMP_RE.search(path.name)
+            if match and path.is_file():
+                groups.setdefault(match.group(1), []).append(path)
+        if groups:
+            latest = groups[max(groups)]
+            return sum(p.stat().st_size for p in latest)
+    return None
+
+def free_space(path: Path) -> int:
+    """返回 path（或其最近的已存在上级目录）所在文件系统的可用空间"""
+    path = path.absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return shutil.disk_usage(str(path)).free
+
+def plan_tasks(tasks: List[Tuple[object, TaskEstimate]], free_bytes: int,
+               margin: float) -> Tuple[List[Tuple[object, TaskEstimate]], List[Tuple[object, TaskEstimate]]]:
+    """空间不足时按预估大小从小到大重排，返回 (可执行任务, 放不下的任务)"""
+    selected, skipped = [], []
+    used = 0
+    for task, estimate in sorted(tasks, key=lambda item: item[1].archive_bytes):
+        needed = int(estimate.archive_bytes * margin)
+        if used + needed <= free_bytes:
+            selected.append((task, estimate))
+            used += needed
+        else:
+            skipped.append((task, estimate))
+    return selected, skipped
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
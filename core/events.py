@@ -0,0 +1,184 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, TextIO
+import sys
+import threading
+import time
+
+# 事件类型
+TASK_STARTED = 'task_started'
+BYTES_PROCESSED = 'bytes_processed'
+FILES_PROCESSED = 'files_processed'
+TASK_FINISHED = 'task_finished'
+
+@dataclass
+class Event:
+    type: str
+    task: str  # 任务标识，与运行日志中的 task_key 相同
+    plugin: str
+    files: int = 0  # 累计值
+    bytes: int = 0  # 累计值
+    elapsed: float = 0.0
+    expected_bytes: Optional[int] = None  # 预估或上一次运行处理的字节数
+    expected_seconds: Optional[float] = None  # 预估或上一次运行的耗时
+    success: Optional[bool] = None  # 仅 task_finished
+    time: float = field(default_factory=time.time)
+
+    @property
+    def throughput(self) -> float:
+        """字节/秒"""
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """剩余秒数：有预期字节数时按当前速度推算，否则按预期耗时推算"""
+        if self.type == TASK_FINISHED:
+            return 0.0
+        if self.expected_bytes and self.bytes and self.elapsed > 0:
+            return max(0.0, (self.expected_bytes - self.bytes) / self.throughput)
+        if self.expected_seconds:
+            return max(0.0, self.expected_seconds - self.elapsed)
+        return None
+
+Subscriber = Callable[[Event], None]
+
+class EventBus:
+    """进度事件分发
+
+    订阅者在发出事件的线程中同步调用，应尽快返回；订阅者抛出的异常被忽略，
+    不会影响备份。字节和文件事件由 TaskProgress 按 interval 节流。
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._subscribers: List[Subscriber] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Subscriber) -> Callable[[], None]:
+        """订阅所有事件，返回取消订阅的函数"""
+        with self._lock:
+            self._subscribers = self._subscribers + [callback]
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback: Subscriber) -> None:
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not callback]
+
+    def emit(self, event: Event) -> None:
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception:
+                pass
+
+    def start_task(self, task: str, plugin: str, expected_bytes: Optional[int] = None,
+                   expected_seconds: Optional[float] = None) -> 'TaskProgress':
+        progress = TaskProgress(self, task, plugin, expected_bytes, expected_seconds)
+        progress.emit(TASK_STARTED)
+        return progress
+
+class TaskProgress:
+    """单个任务的累计进度；热路径上只做计数，到达节流间隔才发出事件"""
+
+    def __init__(self, bus: EventBus, task: str, plugin: str,
+                 expected_bytes: Optional[int] = None, expected_seconds: Optional[float] = None):
+        self.bus = bus
+        self.task = task
+        self.plugin = plugin
+        self.expected_bytes = expected_bytes
+        self.expected_seconds = expected_seconds
+        self.files = 0
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._next_emit = self._started + bus.interval
+        self._emitted_files = 0
+
+    def update(self, files: int = 0, nbytes: int = 0) -> None:
+        self.files += files
+        self.bytes += nbytes
+        now = time.monotonic()
+        if now >= self._next_emit:
+            self._next_emit = now + self.bus.interval
+            self.emit(BYTES_PROCESSED)
+            if self.files != self._emitted_files:
+                self._emitted_files = self.files
+                self.emit(FILES_PROCESSED)
+
+    def finish(self, success: bool) -> Event:
+        return self.emit(TASK_FINISHED, success=success)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    def emit(self, event_type: str, success: Optional[bool] = None) -> Event:
+        event = Event(
+            type=event_type,
+            task=self.task,
+            plugin=self.plugin,
+            files=self.files,
+            bytes=self.bytes,
+            elapsed=self.elapsed,
+            expected_bytes=self.expected_bytes,
+            expected_seconds=self.expected_seconds,
+            success=success
+        )
+        self.bus.emit(event)
+        return event
+
+def _format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '--:--'
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60:02d}:{rest % 60:02d}"
+
+class TerminalProgressView:
+    """终端进度视图：在一行状态中显示运行中任务的已处理量、速度和预计剩余时间
+
+    任务结束时输出一行汇总；输出不是终端时每 line_interval 秒打印一行，便于重定向到文件。
+    """
+
+    def __init__(self, stream: TextIO = sys.stderr, line_interval: float = 10.0):
+        self.stream = stream
+        self.tty = stream.isatty()
+        self.line_interval = line_interval
+        self._active: Dict[str, Event] = {}
+        self._last_line = 0.0
+        self._lock = threading.Lock()
+
+    def attach(self, bus: EventBus) -> Callable[[], None]:
+        return bus.subscribe(self.handle)
+
+    def handle(self, event: Event) -> None:
+        with self._lock:
+            if event.type == TASK_FINISHED:
+                self._active.pop(event.task, None)
+            else:
+                self._active[event.task] = event
+
+            if not self.tty:
+                if event.type in (TASK_STARTED, TASK_FINISHED) \
+                        or (event.type == BYTES_PROCESSED and event.time - self._last_line >= self.line_interval):
+                    self._last_line = event.time
+                    self.stream.write(self._format(event) + '\n')
+            else:
+                self.stream.write('\r\x1b[K')
+                if event.type == TASK_FINISHED:
+                    self.stream.write(self._format(event) + '\n')
+                self.stream.write(' | '.join(self._format(e) for e in self._active.values()))
+            self.stream.flush()
+
+    def _format(self, event: Event) -> str:
+        done = event.bytes / (1024 * 1024)
+        if event.expected_bytes:
+            amount = f"{done:.1f}/{event.expected_bytes / (1024 * 1024):.1f} MiB"
+            percent = f" {min(100.0, 100.0 * event.bytes / event.expected_bytes):5.1f}%"
+        else:
+            amount, percent = f"{done:.1f} MiB", ''
+
+        if event.type == TASK_FINISHED:
+            status = 'done' if event.success else 'FAILED'
+            return (f"{event.task}: {status} in {_format_duration(event.elapsed)}, {event.files} files, "
+                    f"{done:.1f} MiB, {event.throughput / (1024 * 1024):.1f} MiB/s")
+        return (f"{event.task}:{percent} {amount}, {event.files} files, "
+                f"{event.throughput / (1024 * 1024):.1f} MiB/s, ETA {_format_duration(event.eta)}")
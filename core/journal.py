@@ -0,0 +1,99 @@
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Optional, Set
+import json
+import os
+import threading
+
+
+class RunJournal:
+    """运行日志：记录当天已完成的任务，使中断后的运行可以从第一个未完成任务继续
+
+    日志按天生效，跨天的旧日志会被忽略，所有任务成功后日志被删除。
+    """
+
+    def __init__(self, path: Path, logger):
+        self.path = path
+        self.logger = logger
+        self.date = datetime.now().strftime('%Y%m%d')
+        self.completed: Set[str] = set()
+
+    def load(self) -> None:
+        """读取上一次未完成运行的记录"""
+        if not self.path.exists():
+            return
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning("Ignoring unreadable run journal %s: %s", self.path, e)
+            return
+
+        if data.get('date') != self.date:
+            self.logger.info("Discarding stale run journal from %s", data.get('date'))
+            return
+
+        self.completed = set(data.get('completed', []))
+        if self.completed:
+            self.logger.info("Resuming interrupted run, %s tasks already completed", len(self.completed))
+
+    def is_completed(self, task_key: str) -> bool:
+        return task_key in self.completed
+
+    def mark_completed(self, task_key: str) -> None:
+        """记录任务完成并立即落盘"""
+        self.completed.add(task_key)
+        self._save()
+
+    def finish(self) -> None:
+        """整个运行成功结束后删除日志"""
+        if self.path.exists():
+            self.path.unlink()
+        self.completed.clear()
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump({'date': self.date, 'completed': sorted(self.completed)}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(str(temp_path), str(self.path))
+
+
+class TaskHistory:
+    """每个任务最近一次成功运行的耗时和处理量，用于进度视图的预计剩余时间"""
+
+    def __init__(self, path: Path, logger):
+        self.path = path
+        self.logger = logger
+        self.tasks: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if not path.exists():
+            return
+        try:
+            with open(path) as f:
+                self.tasks = json.load(f).get('tasks', {})
+        except (OSError, ValueError) as e:
+            self.logger.warning("Ignoring unreadable task history %s: %s", self.path, e)
+
+    def get(self, task_key: str) -> Optional[Dict]:
+        return self.tasks.get(task_key)
+
+    def record(self, task_key: str, seconds: float, nbytes: int, files: int) -> None:
+        """记录一次成功运行并立即落盘，可在多个线程中调用"""
+        with self._lock:
+            self.tasks[task_key] = {
+                'seconds': round(seconds, 3),
+                'bytes': nbytes,
+                'files': files,
+                'date': datetime.now().strftime('%Y%m%d'),
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(temp_path, 'w') as f:
+                json.dump({'tasks': self.tasks}, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(str(temp_path), str(self.path))
@@ -1,12 +1,64 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import colorlog
 import sys
+import time
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """只入队不格式化，消息的 % 格式化推迟到后台线程"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """JSON-lines 格式，供日志采集器使用"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
 
 class Logger:
-    def __init__(self, log_file: str = "./script.log"):
+    """备份日志
+
+    调用线程只把日志记录放入队列，由后台 QueueListener 线程负责格式化并写入
+    控制台、./script.log 以及可选的 JSON-lines 文件。低于当前级别的消息不会
+    创建记录，使用 %-风格参数时也不会被格式化。
+
+    同一进程中的实例共享一个后台线程；之后的实例指定了不同的日志文件时，
+    先写完队列中的日志，再换成新的输出。
+    """
+
+    _listener = None
+    _outputs = None  # 当前后台线程使用的 (log_file, json_file)
+    _atexit_registered = False
+
+    def __init__(self, log_file: str = "./script.log", level: int = logging.DEBUG,
+                 json_file: str = None):
         self.logger = logging.getLogger('backup')
-        self.logger.setLevel(logging.DEBUG)
-        
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+
+        outputs = (os.path.abspath(log_file), os.path.abspath(json_file) if json_file else None)
+        if Logger._listener is not None:
+            if Logger._outputs == outputs:
+                return
+            Logger.shutdown()
+        for handler in [h for h in self.logger.handlers if isinstance(h, _DeferredQueueHandler)]:
+            self.logger.removeHandler(handler)
+
         color_formatter = colorlog.ColoredFormatter(
             '%(asctime)s %(log_color)s[%(levelname)s]%(reset)s %(message)s',
             log_colors={
@@ -17,22 +69,98 @@ class Logger:
                 'CRITICAL': 'red,bg_white',
             }
         )
-        
+
         console = logging.StreamHandler()
         console.setFormatter(color_formatter)
-        self.logger.addHandler(console)
-        
+        handlers = [console]
+
         file_handler = logging.FileHandler(log_file)
         file_formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
         file_handler.setFormatter(file_formatter)
-        self.logger.addHandler(file_handler)
+        handlers.append(file_handler)
 
-    def debug(self, msg: str): self.logger.debug(msg)
-    def info(self, msg: str): self.logger.info(msg)
-    def warning(self, msg: str): self.logger.warning(msg)
-    def error(self, msg: str): 
-        self.logger.error(msg)
+        if json_file:
+            json_handler = logging.FileHandler(json_file)
+            json_handler.setFormatter(JsonFormatter())
+            handlers.append(json_handler)
+
+        log_queue = queue.Queue(-1)
+        self.logger.addHandler(_DeferredQueueHandler(log_queue))
+        Logger._listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        Logger._listener.start()
+        Logger._outputs = outputs
+        if not Logger._atexit_registered:
+            atexit.register(Logger.shutdown)
+            Logger._atexit_registered = True
+
+    @staticmethod
+    def shutdown():
+        """等待队列中的日志全部写出，停止后台线程并关闭日志文件"""
+        if Logger._listener is not None:
+            Logger._listener.stop()
+            for handler in Logger._listener.handlers:
+                handler.close()
+            Logger._listener = None
+            Logger._outputs = None
+
+    def is_enabled(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def debug(self, msg: str, *args, **kwargs): self.logger.debug(msg, *args, **kwargs)
+    def info(self, msg: str, *args, **kwargs): self.logger.info(msg, *args, **kwargs)
+    def warning(self, msg: str, *args, **kwargs): self.logger.warning(msg, *args, **kwargs)
+    def error(self, msg: str, *args, **kwargs):
+        """记录错误但不退出进程，其余任务可以继续执行"""
+        self.logger.error(msg, *args, **kwargs)
+    def critical(self, msg: str, *args, **kwargs):
+        self.logger.critical(msg, *args, **kwargs)
+        Logger.shutdown()
         sys.exit(1)
-    def critical(self, msg: str):
-        self.logger.critical(msg)
-        sys.exit(1)
\ No newline at end of file
+
+    def progress(self, label: str, interval: float = 10.0, listener=None) -> 'ProgressLog':
+        """创建一个周期性进度汇总器，listener（如 TaskProgress）同时接收每次更新"""
+        return ProgressLog(self, label, interval, listener)
+
+class ProgressLog:
+    """把逐文件事件汇总为周期性的进度日志，避免热路径上逐条记录"""
+
+    def __init__(self, logger: Logger, label: str, interval: float = 10.0, listener=None):
+        self.logger = logger
+        self.label = label
+        self.interval = interval
+        self.listener = listener
+        self.files = 0
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._last_emit = self._started
+
+    def update(self, files: int = 1, nbytes: int = 0) -> None:
+        self.files += files
+        self.bytes += nbytes
+        if self.listener is not None:
+            self.listener.update(files, nbytes)
+        now = time.monotonic()
+        if now - self._last_emit >= self.interval:
+            self._last_emit = now
+            self._emit("in progress", now)
+
+    def finish(self) -> None:
+        self._emit("finished", time.monotonic())
+
+    def _emit(self, state: str, now: float) -> None:
+        elapsed = max(now - self._started, 1e-6)
+        rate = self.bytes / elapsed / (1024 * 1024)
+        self.logger.info(
+            "%s %s: %d files, %.1f MiB, %.1f MiB/s",
+            self.label, state, self.files, self.bytes / (1024 * 1024), rate,
+            extra={'fields': {
+                'event': 'progress',
+                'task': self.label,
+                'state': state,
+                'files': self.files,
+                'bytes': self.bytes,
+                'elapsed': round(elapsed, 3),
+            }}
+        )
@@ -0,0 +1,163 @@
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+import io
+import queue
+import subprocess
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+
+def copy_chunks(chunks: Iterable[bytes], sink: BinaryIO) -> int:
+    """把数据块依次写入 sink，返回写入的字节数"""
+    total = 0
+    for chunk in chunks:
+        if chunk:
+            sink.write(chunk)
+            total += len(chunk)
+    return total
+
+class ProgressWriter:
+    """写入 sink 的同时把字节数计入进度"""
+
+    def __init__(self, sink: BinaryIO, progress):
+        self.sink = sink
+        self.progress = progress
+
+    def write(self, data) -> int:
+        self.progress.update(0, len(data))
+        return self.sink.write(data)
+
+    def flush(self) -> None:
+        self.sink.flush()
+
+def stream_command(cmd: List[str], sink: BinaryIO, env: Optional[Dict[str, str]] = None,
+                   chunk_size: int = CHUNK_SIZE) -> int:
+    """运行命令并把 stdout 流式写入 sink，返回写入的字节数
+
+    stderr 在后台线程中读取，避免管道写满导致死锁；命令失败时抛出 RuntimeError。
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    stderr_chunks = []
+    stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()))
+    stderr_thread.daemon = True
+    stderr_thread.start()
+
+    try:
+        total = copy_chunks(iter(lambda: process.stdout.read(chunk_size), b''), sink)
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        process.wait()
+        stderr_thread.join()
+
+    if process.returncode != 0:
+        stderr = b''.join(stderr_chunks).decode(errors='replace').strip()
+        raise RuntimeError(f"{cmd[0]} exited with code {process.returncode}: {stderr}")
+    return total
+
+def feed_command(cmd: List[str], chunks: Iterable[bytes], env: Optional[Dict[str, str]] = None) -> int:
+    """运行命令并把 chunks 流式写入其 stdin，返回写入的字节数
+
+    输出在后台线程中读取；命令失败（包括提前退出导致管道断开）时抛出 RuntimeError。
+    """
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, env=env)
+    output_chunks = []
+    output_thread = threading.Thread(target=lambda: output_chunks.append(process.stdout.read()))
+    output_thread.daemon = True
+    output_thread.start()
+
+    total = 0
+    try:
+        try:
+            total = copy_chunks(chunks, process.stdin)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+    except BrokenPipeError:
+        pass  # 命令提前退出，下面按退出码报告
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.wait()
+        output_thread.join()
+        process.stdout.close()
+
+    if process.returncode != 0:
+        output = b''.join(output_chunks).decode(errors='replace').strip()
+        raise RuntimeError(f"{cmd[0]} exited with code {process.returncode}: {output}")
+    return total
+
+def threaded_chunks(chunks: Iterable[bytes], depth: int = 8) -> Iterator[bytes]:
+    """在后台线程中迭代 chunks，经有界队列交给调用方
+
+    读取、解密和解压在后台线程进行，调用方同时加载数据；队列长度限制内存占用。
+    后台线程的异常在调用方重新抛出。
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    iterator = iter(chunks)
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for chunk in iterator:
+                if not put((chunk, None)):
+                    return
+            put((None, None))
+        except BaseException as e:
+            put((None, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            chunk, error = buffer.get()
+            if error is not None:
+                raise error
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        stop.set()
+        producer.join()
+
+class ChunkReader(io.RawIOBase):
+    """把数据块迭代器包装为只读文件对象，供 tarfile 等按流读取"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._chunk = b''
+        self._offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while self._offset >= len(self._chunk):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk, self._offset = chunk, 0
+
+        n = min(len(b), len(self._chunk) - self._offset)
+        b[:n] = self._chunk[self._offset:self._offset + n]
+        self._offset += n
+        return n
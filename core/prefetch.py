@@ -0,0 +1,167 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional, Tuple
+import os
+import queue
+import stat
+import threading
+
+from core.config import PrefetchConfig
+
+# 大文件在打开时提示内核预读的范围
+_WILLNEED_BYTES = 8 * 1024 * 1024
+
+class PrefetchedFile:
+    """预读结果：普通文件保持打开，小文件的内容另外已读入内存"""
+
+    __slots__ = ('path', 'arcname', 'st', 'data', 'fileobj', 'error', 'cost')
+
+    def __init__(self, path: Path, arcname: str):
+        self.path = path
+        self.arcname = arcname
+        self.st: Optional[os.stat_result] = None
+        self.data: Optional[bytes] = None
+        self.fileobj: Optional[BinaryIO] = None
+        self.error: Optional[BaseException] = None
+        self.cost = 0
+
+    def close(self) -> None:
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
+
+def advise(fd: int, size: int) -> None:
+    """提示内核顺序读取并提前读入开头部分；不支持时忽略"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, min(size, _WILLNEED_BYTES), os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+
+class Prefetcher:
+    """有界的预读阶段
+
+    目录遍历在单独的线程中进行，读线程池提前完成后续文件的 lstat/open/read，
+    写入线程按原顺序取用，网络文件系统上的往返延迟因此与压缩重叠。
+    遍历结果和预读结果各最多缓冲 max_ahead 个，
+    读入内存的数据总量不超过 memory_limit；预算不足或文件较大、稀疏、
+    有多个硬链接时只打开文件，由写入线程读取。
+    """
+
+    def __init__(self, workers: int = 8, memory_limit: int = 64 * 1024 * 1024,
+                 max_ahead: Optional[int] = None):
+        self.workers = workers
+        self.memory_limit = memory_limit
+        self.max_ahead = max_ahead or workers * 16
+        # 单个文件最多占用预算的 1/8，避免一个文件占满预算
+        self.small_file_limit = max(1, memory_limit // 8)
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def iter_files(self, entries: Iterable[Tuple[Path, str]]) -> Iterator[PrefetchedFile]:
+        """按 entries 的顺序返回预读结果；调用方处理完每一项后应调用 release"""
+        walked = queue.Queue(maxsize=self.max_ahead)
+        stop = threading.Event()
+        walker = threading.Thread(target=self._walk, args=(entries, walked, stop), daemon=True)
+        walker.start()
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while True:
+                    try:
+                        path, arcname = walked.get_nowait()
+                    except queue.Empty:
+                        # 遍历暂时跟不上时先交出已提交的文件，不让写入线程空等
+                        if pending:
+                            yield pending.popleft().result()
+                            continue
+                        path, arcname = walked.get()
+                    if path is None:
+                        error = arcname
+                        if error is not None:
+                            raise error
+                        break
+                    pending.append(executor.submit(self._load, path, arcname))
+                    if len(pending) >= self.max_ahead:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                stop.set()
+                # 提前结束（如写入出错）时关闭已打开的文件并归还预算
+                for future in pending:
+                    item = future.result()
+                    item.close()
+                    self.release(item)
+                walker.join()
+
+    @staticmethod
+    def _walk(entries: Iterable[Tuple[Path, str]], walked: queue.Queue, stop: threading.Event) -> None:
+        """遍历线程：把条目放入有界队列，结束时放入 (None, 异常或 None)"""
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    walked.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for entry in entries:
+                if not put(entry):
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        put((None, None))
+
+    def release(self, item: PrefetchedFile) -> None:
+        if item.cost:
+            with self._lock:
+                self._used -= item.cost
+            item.cost = 0
+        item.data = None
+
+    def _reserve(self, nbytes: int) -> bool:
+        with self._lock:
+            if self._used + nbytes > self.memory_limit:
+                return False
+            self._used += nbytes
+            return True
+
+    def _load(self, path: Path, arcname: str) -> PrefetchedFile:
+        item = PrefetchedFile(path, arcname)
+        try:
+            st = os.lstat(str(path))
+            item.st = st
+            # 非普通文件（FIFO 等）不能提前打开，由写入线程按原方式处理
+            if not stat.S_ISREG(st.st_mode):
+                return item
+
+            f = open(str(path), 'rb')
+            try:
+                st = item.st = os.fstat(f.fileno())
+                advise(f.fileno(), st.st_size)
+                sparse = getattr(st, 'st_blocks', None) is not None and st.st_blocks * 512 < st.st_size
+                # 文件保持打开，写入线程用它取得 TarInfo；小文件的内容提前读入内存
+                if st.st_nlink == 1 and not sparse and st.st_size <= self.small_file_limit \
+                        and self._reserve(st.st_size):
+                    item.cost = st.st_size
+                    item.data = f.read(st.st_size)
+                item.fileobj = f
+            except BaseException:
+                f.close()
+                raise
+        except OSError as e:
+            item.error = e
+        return item
+
+def make_prefetcher(config: Optional[PrefetchConfig]) -> Optional[Prefetcher]:
+    """按任务配置创建预读器，未配置时返回 None（顺序读取）"""
+    if config is None:
+        return None
+    return Prefetcher(config.workers, config.memory_limit)
@@ -0,0 +1,274 @@
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import stat
+import tarfile
+import threading
+import time
+
+from core.checksum import CHECKSUM_SUFFIX, read_checksum
+from core.crypto import ENCRYPTED_SUFFIX, MAGIC, DecryptingReader
+from core.delta import INDEX_SUFFIX
+from core.pipeline import CHUNK_SIZE
+from core.sharding import MANIFEST_SUFFIX
+from core.snapshot import SNAPSHOT_HASHES, SNAPSHOT_MARKER, is_snapshot_dir, read_snapshot_info
+
+# 巡检进度文件，记录每个备份最后一次校验的时间和结果
+SCRUB_STATE = '.scrub-state.json'
+# 参与巡检的备份文件后缀（去掉 .enc 之后）
+SCRUB_SUFFIXES = ('.gz', '.tar', INDEX_SUFFIX)
+
+@dataclass
+class ScrubResult:
+    path: str  # 相对 backup_root 的路径
+    ok: bool
+    bytes: int = 0
+    checksum: str = 'none'  # match: 与记录一致；none: 没有记录
+    error: Optional[str] = None
+    verified: float = 0.0
+
+class RateLimiter:
+    """令牌桶限速，多个巡检线程共享同一个读取速率上限"""
+
+    def __init__(self, rate: Optional[int]):
+        self.rate = rate
+        self._tokens = float(rate or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> None:
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class _MeteredReader(io.RawIOBase):
+    """读取时计算 sha256 并按限速等待，保证每个字节只从磁盘读一次"""
+
+    def __init__(self, raw: BinaryIO, limiter: RateLimiter):
+        self.raw = raw
+        self.limiter = limiter
+        self.bytes = 0
+        self._digest = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self.raw.readinto(b)
+        if n:
+            self._digest.update(memoryview(b)[:n])
+            self.bytes += n
+            self.limiter.consume(n)
+        return n
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+def _drain(f: BinaryIO) -> None:
+    for _ in iter(lambda: f.read(CHUNK_SIZE), b''):
+        pass
+
+def _plain_name(name: str) -> str:
+    return name[:-len(ENCRYPTED_SUFFIX)] if name.endswith(ENCRYPTED_SUFFIX) else name
+
+def list_scrub_units(backup_root: Path) -> List[Path]:
+    """列出需要巡检的备份：备份文件逐个校验，快照目录作为整体校验"""
+    units = []
+    for root, dirs, files in os.walk(str(backup_root)):
+        for name in list(dirs):
+            if is_snapshot_dir(Path(root) / name):
+                dirs.remove(name)
+                units.append(Path(root) / name)
+        for name in files:
+            if _plain_name(name).endswith(SCRUB_SUFFIXES):
+                units.append(Path(root) / name)
+    return sorted(units)
+
+def unit_size(path: Path) -> int:
+    """巡检单元需要读取的字节数
+
+    快照取标记中记录的复制量：硬链接自上一次快照的文件在同一次巡检中只读一遍，
+    由首次复制它的快照计入，这样估算时也不必遍历快照目录。
+    """
+    if not path.is_dir():
+        return path.stat().st_size
+    try:
+        return int(read_snapshot_info(path)['bytes_copied'])
+    except (OSError, ValueError, KeyError):
+        return sum(
+            os.lstat(os.path.join(root, name)).st_size
+            for root, _, files in os.walk(str(path)) for name in files
+        )
+
+def expected_checksums(directory: Path) -> Dict[str, str]:
+    """收集目录中已记录的校验和：sha256 记录文件以及分片清单中的 sha256"""
+    expected = {}
+    for path in directory.iterdir():
+        if path.name.endswith(CHECKSUM_SUFFIX):
+            expected[path.name[:-len(CHECKSUM_SUFFIX)]] = read_checksum(path)
+        elif path.name.endswith(MANIFEST_SUFFIX):
+            with open(path) as f:
+                manifest = json.load(f)
+            for shard in manifest.get('shards', []):
+                if shard.get('sha256'):
+                    expected[shard['file']] = shard['sha256']
+    return expected
+
+def verify_file(path: Path, key: Optional[bytes], limiter: RateLimiter) -> Tuple[int, str]:
+    """流式解密、解压并读完整个备份，返回 (读取字节数, 落盘字节的 sha256)
+
+    gzip 的 CRC、tar 头校验和以及 AEAD 认证在读取过程中完成，出错时抛出异常。
+    """
+    plain_name = _plain_name(path.name)
+    with open(path, 'rb', buffering=0) as f:
+        metered = _MeteredReader(f, limiter)
+        buffered = io.BufferedReader(metered, CHUNK_SIZE)
+        stream = buffered
+        if buffered.peek(len(MAGIC))[:len(MAGIC)] == MAGIC:
+            if key is None:
+                raise ValueError("Encryption key required to verify this backup")
+            stream = io.BufferedReader(DecryptingReader(buffered, key), CHUNK_SIZE)
+
+        if plain_name.endswith('.tar.gz'):
+            with tarfile.open(fileobj=stream, mode='r|gz') as tar:
+                for _ in tar:
+                    pass
+        elif plain_name.endswith('.tar'):
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                for _ in tar:
+                    pass
+        elif plain_name.endswith('.gz'):
+            with gzip.GzipFile(fileobj=stream, mode='rb') as gz:
+                _drain(gz)
+        _drain(stream)
+        # tar 结束块之后的填充等剩余字节也计入校验和
+        _drain(buffered)
+    return metered.bytes, metered.hexdigest()
+
+def verify_snapshot(path: Path, limiter: RateLimiter,
+                    seen: Optional[Dict[Tuple[int, int], str]] = None) -> Tuple[int, int]:
+    """读完快照中的所有文件，记录了 sha256 时逐个比对，返回 (读取字节数, 比对文件数)
+
+    seen 记录本次巡检已读过的 inode 及其 sha256，多个快照之间的硬链接只读一遍。
+    """
+    if seen is None:
+        seen = {}
+    hashes = {}
+    if (path / SNAPSHOT_HASHES).is_file():
+        with open(path / SNAPSHOT_HASHES) as f:
+            hashes = json.load(f)
+
+    total = compared = 0
+    mismatched = []
+    for root, _, files in os.walk(str(path)):
+        for name in files:
+            file_path = Path(root) / name
+            arcname = file_path.relative_to(path).as_posix()
+            st = os.lstat(str(file_path))
+            if arcname in (SNAPSHOT_MARKER, SNAPSHOT_HASHES) or not stat.S_ISREG(st.st_mode):
+                continue
+            inode = (st.st_dev, st.st_ino)
+            digest = seen.get(inode)
+            if digest is None:
+                with open(file_path, 'rb', buffering=0) as f:
+                    metered = _MeteredReader(f, limiter)
+                    _drain(io.BufferedReader(metered, CHUNK_SIZE))
+                total += metered.bytes
+                digest = metered.hexdigest()
+                if st.st_nlink > 1:
+                    seen[inode] = digest
+            if arcname in hashes:
+                compared += 1
+                if hashes[arcname] != digest:
+                    mismatched.append(arcname)
+
+    if mismatched:
+        raise ValueError(
+            f"{len(mismatched)} files differ from recorded sha256: {', '.join(mismatched[:5])}"
+        )
+    return total, compared
+
+def scrub_unit(backup_root: Path, path: Path, key: Optional[bytes], limiter: RateLimiter,
+               seen: Optional[Dict[Tuple[int, int], str]] = None) -> ScrubResult:
+    """校验一个备份文件或快照；seen 在同一次巡检的各快照之间共享，见 verify_snapshot"""
+    result = ScrubResult(path=path.relative_to(backup_root).as_posix(), ok=False)
+    try:
+        if path.is_dir():
+            result.bytes, compared = verify_snapshot(path, limiter, seen)
+            result.checksum = 'match' if compared else 'none'
+        else:
+            expected = expected_checksums(path.parent).get(path.name)
+            result.bytes, digest = verify_file(path, key, limiter)
+            if expected is not None:
+                if digest != expected:
+                    raise ValueError(f"sha256 mismatch: expected {expected}, got {digest}")
+                result.checksum = 'match'
+        result.ok = True
+    except Exception as e:
+        result.error = str(e) or type(e).__name__
+    result.verified = time.time()
+    return result
+
+class ScrubState:
+    """巡检进度：每个备份最后一次校验的时间和结果，跨运行保存"""
+
+    def __init__(self, path: Path, logger):
+        self.path = path
+        self.logger = logger
+        self.entries: Dict[str, Dict] = {}
+        if not path.exists():
+            return
+        try:
+            with open(path) as f:
+                self.entries = json.load(f).get('entries', {})
+        except (OSError, ValueError, AttributeError) as e:
+            # 进度文件损坏时从头开始，所有备份视为从未校验
+            self.logger.warning("Ignoring unreadable scrub state %s: %s", self.path, e)
+
+    def last_verified(self, rel_path: str) -> float:
+        return self.entries.get(rel_path, {}).get('verified', 0.0)
+
+    def record(self, result: ScrubResult) -> None:
+        self.entries[result.path] = asdict(result)
+
+    def prune(self, existing: List[str]) -> None:
+        """丢弃已被保留策略删除的备份"""
+        keep = set(existing)
+        self.entries = {k: v for k, v in self.entries.items() if k in keep}
+
+    def save(self) -> None:
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'version': 1, 'entries': self.entries}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(str(tmp), str(self.path))
+
+def select_slice(units: List[Tuple[str, int]], state: ScrubState, cycle_days: int) -> List[str]:
+    """选出本次巡检的部分：按最后校验时间从旧到新，直到覆盖总量的 1/cycle_days
+
+    每晚覆盖一份，因此整个备份库在 cycle_days 天内至少校验一遍。
+    """
+    if not units:
+        return []
+    budget = math.ceil(sum(size for _, size in units) / cycle_days)
+    selected, covered = [], 0
+    for rel_path, size in sorted(units, key=lambda u: (state.last_verified(u[0]), u[0])):
+        if selected and covered >= budget:
+            break
+        selected.append(rel_path)
+        covered += size
+    return selected
@@ -0,0 +1,155 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
+import json
+import os
+import tarfile
+
+from core.archiver import TreeArchiver, extract_all, iter_tree
+from core.checksum import ChecksumWriter
+from core.config import PrefetchConfig, ShardConfig
+from core.crypto import EncryptingWriter, open_backup_file
+from core.prefetch import make_prefetcher
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+# (文件路径, 归档内名称, 大小)
+ShardEntry = Tuple[str, str, int]
+
+def plan_shards(source_path: Path, exclude_patterns: Set[str],
+                shard_config: ShardConfig) -> List[List[ShardEntry]]:
+    """把目录中的文件划分为多个分片
+
+    - directory：按顶层条目分组，再用最长处理时间优先（LPT）分配到 count 个分片，
+      使各分片大小接近；
+    - size：按遍历顺序累积文件，超过 max_size 时开始新分片。
+    """
+    entries = []
+    for file_path, arcname in iter_tree(source_path, exclude_patterns):
+        try:
+            size = os.lstat(str(file_path)).st_size
+        except OSError:
+            size = 0
+        entries.append((str(file_path), arcname, size))
+
+    if shard_config.by == 'size':
+        return _plan_by_size(entries, shard_config.max_size)
+    return _plan_by_directory(entries, max(1, shard_config.count))
+
+def _plan_by_size(entries: List[ShardEntry], max_size: int) -> List[List[ShardEntry]]:
+    shards = [[]]
+    current = 0
+    for entry in entries:
+        if shards[-1] and current + entry[2] > max_size:
+            shards.append([])
+            current = 0
+        shards[-1].append(entry)
+        current += entry[2]
+    return [shard for shard in shards if shard]
+
+def _plan_by_directory(entries: List[ShardEntry], count: int) -> List[List[ShardEntry]]:
+    groups: Dict[str, List[ShardEntry]] = {}
+    for entry in entries:
+        parts = Path(entry[1]).parts
+        key = parts[1] if len(parts) > 2 else ''  # 顶层文件归为一组
+        groups.setdefault(key, []).append(entry)
+
+    bins = [[] for _ in range(min(count, len(groups)) or 1)]
+    loads = [0] * len(bins)
+    ordered = sorted(groups.values(), key=lambda g: sum(e[2] for e in g), reverse=True)
+    for group in ordered:
+        index = loads.index(min(loads))
+        bins[index].extend(group)
+        loads[index] += sum(e[2] for e in group)
+    return [shard for shard in bins if shard]
+
+def archive_shard(archive_path: str, entries: List[ShardEntry], key: Optional[bytes] = None,
+                  prefetch: Optional[PrefetchConfig] = None) -> Dict:
+    """在工作进程中写入并校验一个分片，返回统计信息"""
+    with open(archive_path, 'wb') as raw:
+        hashed = ChecksumWriter(raw)
+        out = EncryptingWriter(hashed, key) if key else hashed
+        with tarfile.open(fileobj=out, mode="w:gz", format=tarfile.PAX_FORMAT) as tar:
+            archiver = TreeArchiver(tar, prefetcher=make_prefetcher(prefetch))
+            archiver.add_files((Path(file_path), arcname) for file_path, arcname, _ in entries)
+        if key:
+            out.close()
+
+    with open_backup_file(Path(archive_path), key) as f:
+        with tarfile.open(fileobj=f, mode="r|gz") as tar:
+            for _ in tar:
+                pass
+
+    stats = archiver.stats
+    return {
+        'files': stats.files,
+        'bytes': stats.bytes_read,
+        'bytes_skipped': stats.bytes_skipped,
+        'sha256': hashed.hexdigest(),
+    }
+
+def archive_shards(shard_paths: List[Path], shards: List[List[ShardEntry]],
+                   workers: Optional[int], logger, key: Optional[bytes] = None,
+                   progress=None, prefetch: Optional[PrefetchConfig] = None) -> List[Dict]:
+    """用进程池并行写入所有分片，按分片顺序返回统计信息；每完成一个分片计入 progress
+
+    目录为空或所有文件都被排除时没有分片，返回空列表，清单中不含分片。
+    """
+    if not shards:
+        return []
+    workers = max(1, workers or min(len(shards), os.cpu_count() or 1))
+    results: List[Optional[Dict]] = [None] * len(shards)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(archive_shard, str(path), entries, key, prefetch): index
+            for index, (path, entries) in enumerate(zip(shard_paths, shards))
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            if progress is not None:
+                progress.update(results[index]['files'], results[index]['bytes'])
+            logger.info(
+                "Shard %d/%d archived: %d files, %.1f MiB",
+                index + 1, len(shards), results[index]['files'],
+                results[index]['bytes'] / (1024 * 1024)
+            )
+    return results
+
+def write_manifest(out: BinaryIO, source_path: Path, shard_config: ShardConfig,
+                   shard_names: List[str], results: List[Dict]) -> None:
+    manifest = {
+        'version': 1,
+        'source': str(source_path),
+        'by': shard_config.by,
+        'shards': [
+            dict(file=name, **result)
+            for name, result in zip(shard_names, results)
+        ],
+    }
+    out.write(json.dumps(manifest, indent=2).encode('utf-8'))
+
+def read_manifest(manifest_path: Path) -> Dict:
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def _extract_shard(archive_path: str, target_dir: str, key: Optional[bytes] = None) -> str:
+    with open_backup_file(Path(archive_path), key) as f:
+        with tarfile.open(fileobj=f, mode="r|gz") as tar:
+            extract_all(tar, Path(target_dir))
+    return archive_path
+
+def extract_shards(manifest_path: Path, target_dir: Path, workers: Optional[int] = None,
+                   key: Optional[bytes] = None) -> int:
+    """并行解包清单中的所有分片，返回分片数量"""
+    manifest = read_manifest(manifest_path)
+    archives = [str(manifest_path.parent / shard['file']) for shard in manifest['shards']]
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    if not archives:
+        return 0
+    workers = max(1, workers or min(len(archives), os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(_extract_shard, a, str(target_dir), key) for a in archives]:
+            future.result()
+    return len(archives)
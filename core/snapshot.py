@@ -0,0 +1,260 @@
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+
+from core.archiver import iter_tree
+
+# 快照目录中的标记文件，记录创建时间和统计信息；保留策略据此识别快照
+SNAPSHOT_MARKER = '.snapshot.json'
+# 启用哈希比较时记录每个文件的 sha256
+SNAPSHOT_HASHES = '.snapshot-hashes.json'
+
+_FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+_HASH_BUFSIZE = 1024 * 1024
+
+@dataclass
+class SnapshotStats:
+    files: int = 0
+    linked: int = 0
+    copied: int = 0
+    bytes_linked: int = 0
+    bytes_copied: int = 0
+
+def is_snapshot_dir(path: Path) -> bool:
+    return (path / SNAPSHOT_MARKER).is_file()
+
+def remove_snapshot(path: Path) -> None:
+    """删除快照目录；快照保留了源目录的只读权限，删除前先恢复属主写权限"""
+    def on_error(func, failed_path, exc_info):
+        parent = os.path.dirname(failed_path)
+        os.chmod(parent, os.lstat(parent).st_mode | stat.S_IWUSR | stat.S_IXUSR)
+        func(failed_path)
+
+    shutil.rmtree(str(path), onerror=on_error)
+
+def read_snapshot_info(path: Path) -> Dict:
+    with open(path / SNAPSHOT_MARKER) as f:
+        return json.load(f)
+
+def find_previous_snapshot(task_dir: Path) -> Optional[Path]:
+    """返回任务目录下最新的已完成快照"""
+    if not task_dir.is_dir():
+        return None
+    snapshots = [
+        snapshot
+        for date_dir in task_dir.iterdir() if date_dir.is_dir()
+        for snapshot in date_dir.iterdir() if snapshot.is_dir() and is_snapshot_dir(snapshot)
+    ]
+    if not snapshots:
+        return None
+    return max(snapshots, key=lambda p: read_snapshot_info(p).get('created', ''))
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(str(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_BUFSIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def copy_file(src: Path, dst: Path) -> None:
+    """复制文件内容：优先 reflink，其次 copy_file_range，最后普通复制"""
+    with open(str(src), 'rb') as fsrc, open(str(dst), 'wb') as fdst:
+        if not _reflink(fsrc.fileno(), fdst.fileno()) \
+                and not _copy_file_range(fsrc.fileno(), fdst.fileno()):
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, _HASH_BUFSIZE)
+    shutil.copystat(str(src), str(dst))
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+        return True
+    except (ImportError, OSError):
+        return False
+
+def _copy_file_range(src_fd: int, dst_fd: int) -> bool:
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    try:
+        while os.copy_file_range(src_fd, dst_fd, 1 << 30):
+            pass
+        return True
+    except OSError as e:
+        if e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+            return False
+        raise
+
+def restore_snapshot(snapshot: Path, target_dir: Path, progress=None) -> int:
+    """把快照中的文件复制到 target_dir（优先 reflink），返回文件数"""
+    count = 0
+    for root, dirs, files in os.walk(str(snapshot)):
+        relative = Path(root).relative_to(snapshot)
+        (target_dir / relative).mkdir(parents=True, exist_ok=True)
+        for name in dirs + files:
+            src = Path(root) / name
+            dst = target_dir / relative / name
+            if relative == Path('.') and name in (SNAPSHOT_MARKER, SNAPSHOT_HASHES):
+                continue
+            if src.is_symlink():
+                if os.path.lexists(str(dst)):
+                    dst.unlink()
+                os.symlink(os.readlink(str(src)), str(dst))
+            elif src.is_file():
+                copy_file(src, dst)
+                if progress is not None:
+                    progress.update(1, src.stat().st_size)
+            else:
+                continue
+            count += 1
+    return count
+
+class SnapshotWriter:
+    """以 rsync --link-dest 的方式写入目录快照
+
+    与上一次快照相比大小、mtime、权限和属主（以及可选的 sha256）未变的文件直接硬链接，
+    其余文件才复制，因此每次快照的开销约等于变更量。空目录和目录的权限、mtime 同样保留。
+    """
+
+    def __init__(self, target: Path, previous: Optional[Path] = None,
+                 compare_hash: bool = False, progress=None):
+        self.target = target
+        self.previous = previous
+        self.compare_hash = compare_hash
+        self.progress = progress
+        self.stats = SnapshotStats()
+        self.hashes: Dict[str, str] = {}
+        self._previous_hashes: Dict[str, str] = {}
+        self._inodes: Dict[Tuple[int, int], Path] = {}
+        # 只有 root 能保留属主，否则快照中的文件都属于当前用户，不比较属主
+        self._preserve_owner = hasattr(os, 'geteuid') and os.geteuid() == 0
+
+        if previous is not None and compare_hash and (previous / SNAPSHOT_HASHES).is_file():
+            with open(previous / SNAPSHOT_HASHES) as f:
+                self._previous_hashes = json.load(f)
+
+    def add_tree(self, source_path: Path, exclude_patterns: Set[str]) -> SnapshotStats:
+        self.target.mkdir(parents=True, exist_ok=True)
+        directories = []
+        for path, arcname in iter_tree(source_path, exclude_patterns, include_dirs=True):
+            if path.is_dir() and not path.is_symlink():
+                (self.target / arcname).mkdir(parents=True, exist_ok=True)
+                directories.append((path, arcname))
+            else:
+                self.add_file(path, arcname)
+
+        # 目录写完后再由内向外复制权限和 mtime，避免只读目录阻止写入、写入改动 mtime
+        for path, arcname in reversed(directories):
+            self._copy_dir_stat(path, self.target / arcname)
+        return self.stats
+
+    def add_file(self, path: Path, arcname: str) -> None:
+        st = os.lstat(str(path))
+        dst = self.target / arcname
+        dst.parent.mkdir(parents=True, exist_ok=True)
+
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(str(path)), str(dst))
+            self._count(0)
+            return
+        if not stat.S_ISREG(st.st_mode):
+            return
+
+        # 源目录内部的硬链接在快照中保持为硬链接
+        inode = (st.st_dev, st.st_ino)
+        if st.st_nlink > 1 and inode in self._inodes and self._link(self._inodes[inode], dst):
+            self._count(0)
+            return
+
+        digest = file_hash(path) if self.compare_hash else None
+        if digest:
+            self.hashes[arcname] = digest
+
+        previous = self._unchanged_previous(arcname, st, digest)
+        if previous is not None and self._link(previous, dst):
+            self.stats.linked += 1
+            self.stats.bytes_linked += st.st_size
+            self._count(0)
+        else:
+            copy_file(path, dst)
+            if self._preserve_owner:
+                # chown 会清除 setuid/setgid 位，之后重新设置权限
+                os.chown(str(dst), st.st_uid, st.st_gid)
+                os.chmod(str(dst), stat.S_IMODE(st.st_mode))
+            self.stats.copied += 1
+            self.stats.bytes_copied += st.st_size
+            self._count(st.st_size)
+
+        if st.st_nlink > 1:
+            self._inodes[inode] = dst
+
+    def _copy_dir_stat(self, src: Path, dst: Path) -> None:
+        if self._preserve_owner:
+            st = os.lstat(str(src))
+            os.chown(str(dst), st.st_uid, st.st_gid)
+        shutil.copystat(str(src), str(dst))
+
+    def finish(self, source_path: Path) -> None:
+        """写入哈希索引和快照标记，标记最后写入"""
+        if self.compare_hash:
+            with open(self.target / SNAPSHOT_HASHES, 'w') as f:
+                json.dump(self.hashes, f)
+
+        info = dict(
+            version=1,
+            created=datetime.now().strftime('%Y%m%d%H%M%S'),
+            source=str(source_path),
+            previous=self.previous.name if self.previous else None,
+            **asdict(self.stats)
+        )
+        with open(self.target / SNAPSHOT_MARKER, 'w') as f:
+            json.dump(info, f, indent=2)
+
+    def _unchanged_previous(self, arcname: str, st: os.stat_result,
+                            digest: Optional[str]) -> Optional[Path]:
+        if self.previous is None:
+            return None
+        previous = self.previous / arcname
+        try:
+            previous_st = os.lstat(str(previous))
+        except OSError:
+            return None
+
+        # 硬链接共享 inode，权限或属主变化时必须复制
+        if not stat.S_ISREG(previous_st.st_mode) \
+                or previous_st.st_size != st.st_size \
+                or previous_st.st_mtime_ns != st.st_mtime_ns \
+                or previous_st.st_mode != st.st_mode:
+            return None
+        if self._preserve_owner and (previous_st.st_uid, previous_st.st_gid) != (st.st_uid, st.st_gid):
+            return None
+
+        if digest is not None:
+            previous_digest = self._previous_hashes.get(arcname) or file_hash(previous)
+            if previous_digest != digest:
+                return None
+        return previous
+
+    def _link(self, src: Path, dst: Path) -> bool:
+        try:
+            os.link(str(src), str(dst))
+            return True
+        except OSError as e:
+            # 超过硬链接数上限或跨文件系统时改为复制
+            if e.errno in (errno.EMLINK, errno.EXDEV, errno.EPERM):
+                return False
+            raise
+
+    def _count(self, nbytes: int) -> None:
+        self.stats.files += 1
+        if self.progress is not None:
+            self.progress.update(1, nbytes)
@@ -1,19 +1,51 @@
 import argparse
+import logging
+import multiprocessing
+import os
 import shutil
+import socket
 import sys
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple
 from core.logger import Logger
-from core.config import ConfigManager
+from core.config import ConfigManager, load_coordinator_config
 from utils.warning import WarningHint
 from importlib import import_module
-from core.backup_base import BackupPlugin
+from core.backup_base import BackupPlugin, RunLock, cleanup_partial_files
+from core.journal import RunJournal, TaskHistory
+from core.events import TASK_FINISHED, Event, EventBus, TerminalProgressView
+from core.crypto import ENCRYPTED_SUFFIX, load_key, open_backup_file
+from core.pipeline import CHUNK_SIZE
+from core.estimator import TaskEstimate, format_bytes, free_space, plan_tasks
+from core.sharding import MANIFEST_SUFFIX
+from core.checksum import CHECKSUM_SUFFIX
+from core.scrub import (SCRUB_STATE, RateLimiter, ScrubState, list_scrub_units, scrub_unit,
+                        select_slice, unit_size)
+from core.delta import INDEX_SUFFIX, index_path_for, is_delta, iter_dump, list_dumps
+from core.snapshot import SNAPSHOT_MARKER, is_snapshot_dir, read_snapshot_info, remove_snapshot
+from core.distributed import Coordinator, WorkerAgent
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 运行日志文件名，位于备份根目录
+JOURNAL_NAME = '.run-journal.json'
+# 任务历史耗时文件名，位于备份根目录
+HISTORY_NAME = '.task-history.json'
 
 class BackupSystem:
-    def __init__(self, config_file: str):
-        self.logger = Logger()
+    def __init__(self, config_file: str, resume: bool = True, logger: Optional[Logger] = None,
+                 preflight: bool = True):
+        self.logger = logger or Logger()
         self.config = ConfigManager(config_file, self.logger)
+        if not self.config.validate():
+            raise ValueError(f"Invalid configuration: {config_file}")
+        self.resume = resume
+        self.preflight = preflight
+        # 进度事件：调用方可通过 events.subscribe 订阅，所有插件共用这条总线
+        self.events = EventBus()
+        self.history = TaskHistory(self.config.backup_root / HISTORY_NAME, self.logger)
+        self.events.subscribe(self._record_history)
+        self._estimates: Dict[str, TaskEstimate] = {}
         self._init_python_path()
         self.plugins = self._load_plugins()
 
@@ -22,7 +54,7 @@ class BackupSystem:
         project_root = Path(__file__).parent.absolute()
         if str(project_root) not in sys.path:
             sys.path.insert(0, str(project_root))
-        self.logger.debug(f"Python path: {sys.path}")
+        self.logger.debug("Python path: %s", sys.path)
 
     def _load_plugins(self) -> Dict[str, BackupPlugin]:
         """加载所有备份插件"""
@@ -38,171 +70,544 @@ class BackupSystem:
         for plugin_type, class_name in plugin_classes.items():
             try:
                 module_name = f"plugins.{plugin_type}_backup"
-                self.logger.debug(f"Attempting to import {module_name}")
+                self.logger.debug("Attempting to import %s", module_name)
                 
                 module = import_module(module_name)
-                self.logger.debug(f"Looking for class {class_name}")
+                self.logger.debug("Looking for class %s", class_name)
                 
                 plugin_class = getattr(module, class_name)
-                plugin = plugin_class(self.logger, self.config.backup_root)
+                plugin = plugin_class(self.logger, self.config.backup_root, self.config.settings)
+                plugin.events = self.events
+                plugin.history = self.history
                 plugins[plugin_type] = plugin
                 
-                self.logger.info(f"Successfully loaded plugin: {plugin_type}")
+                self.logger.info("Successfully loaded plugin: %s", plugin_type)
             except Exception as e:
-                self.logger.error(f"Failed to load plugin {plugin_type}: {str(e)}")
+                self.logger.error("Failed to load plugin %s: %s", plugin_type, e)
                 import traceback
-                self.logger.debug(f"Traceback: {traceback.format_exc()}")
+                self.logger.debug("Traceback: %s", traceback.format_exc())
 
         return plugins
             
     def _cleanup_old_backups(self):
         """清理旧备份"""
         try:
-            # 1. 首先删除过期的备份文件
+            # 1. 首先删除过期的备份文件，快照目录作为整体按创建时间删除
             cutoff_time = time.time() - (self.config.backup_keep_days * 24 * 3600)
-            for path in Path(self.config.backup_root).rglob('*'):
-                if path.is_file() and path.suffix in ['.tar.gz', '.tar', '.gz']:
-                    if path.stat().st_mtime < cutoff_time:
-                        path.unlink()
-                        self.logger.debug(f"Deleted old backup: {path}")
+            protected = self._protected_dump_chains(cutoff_time)
+            all_dirs = []
+            for root, dirs, files in os.walk(str(self.config.backup_root)):
+                for name in list(dirs):
+                    path = Path(root) / name
+                    if is_snapshot_dir(path):
+                        dirs.remove(name)  # 不进入快照内部，其中的硬链接文件保留原 mtime
+                        self._cleanup_snapshot(path, cutoff_time)
+                all_dirs.extend(Path(root) / name for name in dirs)
+
+                for name in files:
+                    path = Path(root) / name
+                    if path.suffix in ['.tar.gz', '.tar', '.gz', INDEX_SUFFIX, CHECKSUM_SUFFIX, ENCRYPTED_SUFFIX] \
+                            or path.name.endswith(MANIFEST_SUFFIX):
+                        if path.stat().st_mtime < cutoff_time and path not in protected:
+                            path.unlink()
+                            self.logger.debug("Deleted old backup: %s", path)
 
             # 2. 然后自下而上清理空目录
             empty_dirs = set()
-            for path in sorted(Path(self.config.backup_root).rglob('*'), reverse=True):
+            for path in sorted(all_dirs, reverse=True):
                 if path.is_dir():
                     if not any(path.iterdir()):  # 如果目录为空
                         path.rmdir()
                         empty_dirs.add(path)
-                        self.logger.debug(f"Removed empty directory: {path}")
+                        self.logger.debug("Removed empty directory: %s", path)
 
             if empty_dirs:
-                self.logger.info(f"Cleaned up {len(empty_dirs)} empty directories")
+                self.logger.info("Cleaned up %s empty directories", len(empty_dirs))
             self.logger.info("Cleanup completed successfully")
 
         except Exception as e:
-            self.logger.error(f"Cleanup failed: {str(e)}")
+            self.logger.error("Cleanup failed: %s", e)
 
-    def run(self):
-        """运行备份任务"""
-        WarningHint.countdown()
-        
-        # 执行数据库任务
-        for db_task in self.config.database_tasks:
-            plugin = self.plugins.get(db_task.type)
-            if plugin:
-                try:
-                    plugin.backup(db_task)
-                except Exception as e:
-                    self.logger.error(f"{db_task.type} backup failed: {str(e)}")
-            else:
-                self.logger.error(f"No plugin found for database type: {db_task.type}")
+    def _protected_dump_chains(self, cutoff_time: float) -> Set[Path]:
+        """增量导出依赖之前直到最近一次完整导出的所有导出，仍被保留的增量所依赖的过期导出不能删除"""
+        protected = set()
+        if not self.config.backup_root.is_dir():
+            return protected
+
+        for task_dir in self.config.backup_root.iterdir():
+            if not task_dir.is_dir():
+                continue
+            needed = False
+            for dump in reversed(list_dumps(task_dir)):
+                if needed:
+                    index_path = index_path_for(dump)
+                    for path in (dump, index_path, index_path.with_name(index_path.name + ENCRYPTED_SUFFIX)):
+                        protected.update([path, path.with_name(path.name + CHECKSUM_SUFFIX)])
+                kept = needed or dump.stat().st_mtime >= cutoff_time
+                needed = kept and is_delta(dump)
+        return protected
 
-        # 执行文件夹任务
+    def _cleanup_snapshot(self, path: Path, cutoff_time: float):
+        """快照按标记中的创建时间整体过期"""
+        created = read_snapshot_info(path).get('created')
+        created_time = (
+            time.mktime(time.strptime(created, '%Y%m%d%H%M%S'))
+            if created else (path / SNAPSHOT_MARKER).stat().st_mtime
+        )
+        if created_time < cutoff_time:
+            remove_snapshot(path)
+            self.logger.debug("Deleted old snapshot: %s", path)
+
+    def collect_tasks(self) -> List[Tuple[str, object]]:
+        """按执行顺序返回 (插件类型, 任务配置) 列表"""
+        tasks = []
+        for db_task in self.config.database_tasks:
+            tasks.append((db_task.type, db_task))
         for folder_task in self.config.folder_tasks:
-            if 'folder' in self.plugins:
-                try:
-                    self.plugins['folder'].backup(folder_task)
-                except Exception as e:
-                    self.logger.error(f"Folder backup failed: {str(e)}")
+            tasks.append(('folder', folder_task))
+        for volume_task in self.config.volume_tasks:
+            tasks.append(('volume', volume_task))
+        return tasks
+
+    def estimate_tasks(self, tasks: List[Tuple[str, object]]) -> List[Tuple[Tuple[str, object], TaskEstimate]]:
+        """预估每个任务的归档大小和耗时，预估失败时退回上一次备份的大小"""
+        estimates = []
+        for plugin_type, task in tasks:
+            plugin = self.plugins[plugin_type]
+            try:
+                estimate = plugin.estimate(task)
+            except Exception as e:
+                self.logger.warning("Estimate failed for %s, using previous run: %s", plugin.task_key(task), e)
+                estimate = BackupPlugin.estimate(plugin, task)
+            estimates.append(((plugin_type, task), estimate))
+        return estimates
+
+    def report_estimates(self, estimates: List[Tuple[Tuple[str, object], TaskEstimate]]) -> bool:
+        """输出预估结果，返回是否放得下"""
+        margin = self.config.settings.preflight.margin
+        for _, estimate in estimates:
+            self.logger.info(
+                "Estimate %s: source %s, archive %s, ~%.0fs (%s)",
+                estimate.task_key, format_bytes(estimate.source_bytes),
+                format_bytes(estimate.archive_bytes), estimate.seconds, estimate.method
+            )
+
+        needed = int(sum(e.archive_bytes for _, e in estimates) * margin)
+        free = free_space(self.config.backup_root)
+        total_seconds = sum(e.seconds for _, e in estimates)
+        self.logger.info(
+            "Estimated total: %s needed (x%s), %s free, ~%.0fs",
+            format_bytes(needed), margin, format_bytes(free), total_seconds
+        )
+        return needed <= free
+
+    def _preflight(self, tasks: List[Tuple[str, object]]) -> Optional[List[Tuple[str, object]]]:
+        """返回要执行的任务；空间不足且策略为 refuse 时返回 None"""
+        started = time.monotonic()
+        estimates = self.estimate_tasks(tasks)
+        self._estimates = {estimate.task_key: estimate for _, estimate in estimates}
+        fits = self.report_estimates(estimates)
+        self.logger.debug("Preflight took %.1fs", time.monotonic() - started)
+        if fits:
+            return tasks
+
+        preflight = self.config.settings.preflight
+        if preflight.on_insufficient == 'refuse':
+            self.logger.error("Not enough free space for this run, refusing to start")
+            return None
+
+        selected, skipped = plan_tasks(
+            [(task, estimate) for task, estimate in estimates],
+            free_space(self.config.backup_root), preflight.margin
+        )
+        for _, estimate in skipped:
+            self.logger.error(
+                "Skipping %s: estimated %s does not fit",
+                estimate.task_key, format_bytes(estimate.archive_bytes)
+            )
+        self.logger.warning("Not enough free space, running smallest tasks first")
+        return [task for task, _ in selected]
+
+    def run(self) -> bool:
+        """运行备份任务，全部成功时返回 True"""
+        WarningHint.countdown()
+        with RunLock(self.config.backup_root) as run_lock:
+            self.cleanup_partials(run_lock)
+            all_succeeded = self._run_tasks()
+            self.cleanup_expired(run_lock)
+        return all_succeeded
+
+    def cleanup_partials(self, run_lock: RunLock) -> None:
+        """清理崩溃运行遗留的未完成文件；有其他运行在写入时跳过"""
+        with run_lock.exclusive() as alone:
+            if not alone:
+                self.logger.info("Other runs are active in %s, leaving partial files in place",
+                                 self.config.backup_root)
+                return
+            removed = cleanup_partial_files(self.config.backup_root, self.logger)
+            if removed:
+                self.logger.info("Removed %s leftover partial files", removed)
+
+    def cleanup_expired(self, run_lock: RunLock) -> None:
+        """清理过期备份；有其他运行时跳过，由最后结束的运行清理"""
+        with run_lock.exclusive() as alone:
+            if not alone:
+                self.logger.info("Other runs are active in %s, skipping cleanup", self.config.backup_root)
+                return
+            self._cleanup_old_backups()
+
+    def _run_tasks(self) -> bool:
+        journal = RunJournal(self.config.backup_root / JOURNAL_NAME, self.logger)
+        if self.resume:
+            journal.load()
+
+        all_succeeded = True
+        pending = []
+        for plugin_type, task in self.collect_tasks():
+            plugin = self.plugins.get(plugin_type)
+            if not plugin:
+                self.logger.error("No plugin found for task type: %s", plugin_type)
+                all_succeeded = False
+                continue
+
+            task_key = plugin.task_key(task)
+            if journal.is_completed(task_key):
+                self.logger.info("Skipping task completed in interrupted run: %s", task_key)
+                continue
+            pending.append((plugin_type, task))
+
+        # 预检：预估空间不足时拒绝运行或只运行放得下的任务
+        if self.preflight and self.config.settings.preflight.enabled:
+            planned = self._preflight(pending)
+            if planned is None:
+                return False
+            if len(planned) < len(pending):
+                all_succeeded = False
+            pending = planned
+
+        for plugin_type, task in pending:
+            plugin = self.plugins[plugin_type]
+            task_key = plugin.task_key(task)
+            try:
+                success = plugin.run_task(task, *self.expected(task_key))
+            except Exception as e:
+                self.logger.error("%s backup failed: %s", plugin_type, e)
+                success = False
+
+            if success:
+                journal.mark_completed(task_key)
             else:
-                self.logger.error("Folder backup plugin not found")
+                all_succeeded = False
 
-        # 执行卷任务
-        for volume_task in self.config.volume_tasks:
-            if 'volume' in self.plugins:
-                try:
-                    self.plugins['volume'].backup(volume_task)
-                except Exception as e:
-                    self.logger.error(f"Volume backup failed: {str(e)}")
+        if all_succeeded:
+            journal.finish()
+        return all_succeeded
+
+    def expected(self, task_key: str) -> Tuple[Optional[int], Optional[float]]:
+        """任务预期的处理字节数和耗时：优先使用上一次成功运行，其次使用本次预估"""
+        history = self.history.get(task_key)
+        if history:
+            return history.get('bytes') or None, history.get('seconds')
+        estimate = self._estimates.get(task_key)
+        if estimate:
+            return estimate.source_bytes or None, estimate.seconds
+        return None, None
+
+    def _record_history(self, event: Event) -> None:
+        if event.type == TASK_FINISHED and event.success:
+            self.history.record(event.task, event.elapsed, event.bytes, event.files)
+
+    def scrub(self, full: bool = False) -> bool:
+        """巡检已存储的备份：流式解密解压并与记录的 sha256 比对，返回是否全部完好
+
+        默认只校验本周期的一份（最久未校验的优先），full 时校验全部。
+        """
+        scrub_config = self.config.settings.scrub
+        backup_root = self.config.backup_root
+        if not backup_root.is_dir():
+            self.logger.info("Nothing to scrub in %s", backup_root)
+            return True
+
+        encryption = self.config.settings.encryption
+        key = load_key(encryption.key_file, encryption.key_env) \
+            if encryption and encryption.enabled else None
+
+        state = ScrubState(backup_root / SCRUB_STATE, self.logger)
+        units = {path.relative_to(backup_root).as_posix(): path for path in list_scrub_units(backup_root)}
+        state.prune(list(units))
+        sizes = [(rel_path, unit_size(path)) for rel_path, path in units.items()]
+        selected = list(units) if full else select_slice(sizes, state, scrub_config.cycle_days)
+        selected_bytes = sum(size for rel_path, size in sizes if rel_path in set(selected))
+        self.logger.info(
+            "Scrubbing %d of %d backups (%s) with %d workers%s",
+            len(selected), len(units), format_bytes(selected_bytes), scrub_config.workers,
+            f", capped at {format_bytes(scrub_config.max_rate)}/s" if scrub_config.max_rate else ""
+        )
+
+        limiter = RateLimiter(scrub_config.max_rate)
+        # 快照之间硬链接的文件只读一遍
+        seen_inodes = {}
+        progress = self.logger.progress("Scrubbing")
+        failed = []
+        try:
+            with ThreadPoolExecutor(max_workers=scrub_config.workers) as executor:
+                futures = [
+                    executor.submit(scrub_unit, backup_root, units[rel_path], key, limiter, seen_inodes)
+                    for rel_path in selected
+                ]
+                for future in as_completed(futures):
+                    result = future.result()
+                    state.record(result)
+                    progress.update(1, result.bytes)
+                    if result.ok:
+                        self.logger.debug("Verified %s (checksum: %s)", result.path, result.checksum)
+                    else:
+                        failed.append(result)
+                        self.logger.error("Corrupt or unreadable backup: %s: %s", result.path, result.error)
+        finally:
+            progress.finish()
+            state.save()
+
+        self.logger.info("Scrub finished: %d ok, %d corrupt or unreadable",
+                         len(selected) - len(failed), len(failed))
+        return not failed
+
+    def restore(self, specs: List[str], parallel: int = 1) -> bool:
+        """恢复一个或多个备份，返回是否全部成功
+
+        每项为 NAME[/DATE[/FILE]][=TARGET]，NAME 即 {type}_{identifier} 备份目录名；
+        省略 DATE 时使用最新日期，TARGET 覆盖默认的目标数据库或卷；目录备份必须指定 TARGET。
+        """
+        tasks = {
+            self.plugins[plugin_type]._backup_name(task): (plugin_type, task)
+            for plugin_type, task in self.collect_tasks() if plugin_type in self.plugins
+        }
+
+        jobs = []
+        for spec in specs:
+            location, _, target = spec.partition('=')
+            name, _, rest = location.strip('/').partition('/')
+            if name not in tasks:
+                self.logger.error("No configured task matches backup %s", name)
+                return False
+
+            task_dir = self.config.backup_root / name
+            if rest:
+                source = task_dir / rest
             else:
-                self.logger.error("Volume backup plugin not found")
+                dates = sorted(p for p in task_dir.iterdir() if p.is_dir()) if task_dir.is_dir() else []
+                if not dates:
+                    self.logger.error("No backups found for %s", name)
+                    return False
+                source = dates[-1]
+            if not source.exists():
+                self.logger.error("Backup not found: %s", source)
+                return False
+            jobs.append((tasks[name], source, target or None))
+
+        # 每个恢复内部读取与加载已分属两个线程，这里再让多个恢复并行
+        with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+            futures = [
+                executor.submit(self.plugins[plugin_type].restore, task, source, target)
+                for (plugin_type, task), source, target in jobs
+            ]
+            results = [future.result() for future in futures]
 
-        # 执行清理
-        self._cleanup_old_backups()
+        failed = results.count(False)
+        self.logger.info("Restore finished: %s succeeded, %s failed", len(results) - failed, failed)
+        return not failed
 
 def check_dependencies(config: ConfigManager):
-    """根据配置文件检查必要的命令行工具"""
+    """根据配置文件检查必要的命令行工具，可选工具缺失时只给出警告"""
+    # 名称 -> 可选命令，其中任一存在即可
     required_commands = {
-        'tar': 'tar command',
-        'docker': 'Docker command line'
+        'tar command': ('tar',),
+        'Docker command line': ('docker',)
     }
+    # 只用于预估的工具，缺失时预估退回上一次备份的大小
+    optional_commands = {}
     
     # 检查数据库任务的依赖
     for task in config.database_tasks:
         if not task.docker.enabled:  # 只有非docker任务才需要检查数据库工具
             if task.type == 'mongodb':
-                required_commands['mongodump'] = 'MongoDB tools'
+                required_commands['MongoDB tools'] = ('mongodump',)
+                optional_commands['MongoDB shell'] = ('mongosh', 'mongo')
             elif task.type == 'mysql':
-                required_commands['mysqldump'] = 'MySQL client'
+                required_commands['MySQL client'] = ('mysqldump',)
+                optional_commands['MySQL command line client'] = ('mysql',)
     
     # 检查依赖是否存在
     missing = []
-    for cmd, name in required_commands.items():
-        if shutil.which(cmd) is None:
+    for name, commands in required_commands.items():
+        if not any(shutil.which(cmd) for cmd in commands):
             missing.append(name)
     
     if missing:
         print(f"Missing required dependencies: {', '.join(missing)}")
         sys.exit(1)
 
+    unavailable = [
+        name for name, commands in optional_commands.items()
+        if not any(shutil.which(cmd) for cmd in commands)
+    ]
+    if unavailable:
+        print(f"Optional tools not found: {', '.join(unavailable)}; "
+              "preflight estimates fall back to the previous backup size")
+
+def decrypt_to_stdout(path: Path, key: bytes):
+    """流式解密备份并写到标准输出，认证失败时中止"""
+    with open_backup_file(path, key) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sys.stdout.buffer.write(chunk)
+    sys.stdout.buffer.flush()
+
+def export_dump_to_stdout(path: Path, key: Optional[bytes]):
+    """把 SQL 导出（沿增量链重建）以明文 SQL 写到标准输出"""
+    for chunk in iter_dump(path, key):
+        sys.stdout.buffer.write(chunk)
+    sys.stdout.buffer.flush()
+
 def main():
     parser = argparse.ArgumentParser(description='Modular Backup System')
     parser.add_argument('-f', '--file', help='Specify the configuration file and run tasks')
     parser.add_argument('-t', '--test', help='Test the configuration file')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='Ignore the run journal and run all tasks again')
+    parser.add_argument('-e', '--estimate', metavar='CONFIG',
+                        help='Estimate archive size and duration per task and check free space')
+    parser.add_argument('--no-preflight', action='store_true',
+                        help='Skip the free space estimate before running tasks')
+    parser.add_argument('--progress', action='store_true',
+                        help='Show per-task progress, throughput and ETA on stderr')
+    parser.add_argument('--decrypt', metavar='BACKUP',
+                        help='Decrypt BACKUP to stdout using the key from the -f configuration')
+    parser.add_argument('--scrub', metavar='CONFIG',
+                        help="Re-verify this cycle's share of stored backups and report corrupt ones")
+    parser.add_argument('--scrub-all', action='store_true',
+                        help='With --scrub, verify every stored backup instead of one slice')
+    parser.add_argument('--restore', metavar='BACKUP', action='append',
+                        help='Restore NAME[/DATE[/FILE]][=TARGET] using the -f configuration; repeatable')
+    parser.add_argument('--parallel', type=int, default=1,
+                        help='Number of restores to run at once (default: 1)')
+    parser.add_argument('--export-dump', metavar='DUMP',
+                        help='Rebuild a MySQL dump (following its delta chain) and write plain SQL to stdout')
+    parser.add_argument('--coordinator', metavar='CONFIG',
+                        help='Run as coordinator: hand out the combined task list to workers and collect results')
+    parser.add_argument('--worker', metavar='URL',
+                        help='Run as worker of the coordinator at URL, executing tasks from the -f configuration')
+    parser.add_argument('--name', default=socket.gethostname(),
+                        help='Worker name used by the coordinator (default: host name)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Number of tasks the worker runs at once (default: 1)')
+    parser.add_argument('--log-level', default='DEBUG',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Minimum log level (default: DEBUG)')
+    parser.add_argument('--log-json', metavar='PATH',
+                        help='Also write logs as JSON lines to PATH')
     args = parser.parse_args()
 
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(0)
 
-    logger = Logger()
+    logger = Logger(level=getattr(logging, args.log_level), json_file=args.log_json)
 
     try:
-        if args.file:
+        if args.decrypt:
+            config = ConfigManager(args.file, logger) if args.file else None
+            encryption = config.settings.encryption if config else None
+            if not encryption or not encryption.enabled:
+                logger.critical("--decrypt needs -f with an enabled encryption configuration")
+            decrypt_to_stdout(Path(args.decrypt), load_key(encryption.key_file, encryption.key_env))
+        elif args.restore:
+            if not args.file:
+                logger.critical("--restore needs -f with the configuration the backups were made with")
+            backup_system = BackupSystem(args.file, logger=logger)
+            if not backup_system.restore(args.restore, args.parallel):
+                sys.exit(1)
+        elif args.coordinator:
+            coordinator_config = load_coordinator_config(args.coordinator, logger)
+            history = TaskHistory(coordinator_config.state_dir / HISTORY_NAME, logger)
+            if not Coordinator(coordinator_config, logger, history).serve():
+                sys.exit(1)
+        elif args.worker:
+            if not args.file:
+                logger.critical("--worker needs -f with the local configuration of this host")
+            backup_system = BackupSystem(args.file, logger=logger)
+            if args.progress:
+                TerminalProgressView().attach(backup_system.events)
+            agent = WorkerAgent(backup_system, args.worker, args.name, args.concurrency)
+            if not agent.run():
+                sys.exit(1)
+        elif args.export_dump:
+            config = ConfigManager(args.file, logger) if args.file else None
+            encryption = config.settings.encryption if config else None
+            key = load_key(encryption.key_file, encryption.key_env) \
+                if encryption and encryption.enabled else None
+            export_dump_to_stdout(Path(args.export_dump), key)
+        elif args.file:
             config = ConfigManager(args.file, logger)
             check_dependencies(config)
-            logger.info(f"Using config file: {args.file}")
-            logger.info(f"Backup root: {config.backup_root}")
-            logger.info(f"Backup keep days: {config.backup_keep_days}")
+            logger.info("Using config file: %s", args.file)
+            logger.info("Backup root: %s", config.backup_root)
+            logger.info("Backup keep days: %s", config.backup_keep_days)
             
             total_tasks = (
                 len(config.database_tasks) + 
                 len(config.folder_tasks) + 
                 len(config.volume_tasks)
             )
-            logger.info(f"Found {total_tasks} tasks")
+            logger.info("Found %s tasks", total_tasks)
             
-            backup_system = BackupSystem(args.file)
-            backup_system.run()
+            backup_system = BackupSystem(args.file, resume=not args.no_resume, logger=logger,
+                                         preflight=not args.no_preflight)
+            if args.progress:
+                TerminalProgressView().attach(backup_system.events)
+            if not backup_system.run():
+                sys.exit(1)
+        elif args.scrub:
+            backup_system = BackupSystem(args.scrub, logger=logger)
+            if not backup_system.scrub(full=args.scrub_all):
+                sys.exit(1)
+        elif args.estimate:
+            backup_system = BackupSystem(args.estimate, logger=logger)
+            tasks = [t for t in backup_system.collect_tasks() if t[0] in backup_system.plugins]
+            if not backup_system.report_estimates(backup_system.estimate_tasks(tasks)):
+                logger.error("Not enough free space for this run")
+                sys.exit(1)
         elif args.test:
             config = ConfigManager(args.test, logger)
+            if not config.validate():
+                sys.exit(1)
             check_dependencies(config)
-            logger.info(f"Config file validated successfully: {args.test}")
-            logger.info(f"Backup root: {config.backup_root}")
-            logger.info(f"Backup keep days: {config.backup_keep_days}")
+            logger.info("Config file validated successfully: %s", args.test)
+            logger.info("Backup root: %s", config.backup_root)
+            logger.info("Backup keep days: %s", config.backup_keep_days)
             
             # 显示数据库任务信息
             for task in config.database_tasks:
                 logger.info(
-                    f"Database task: type={task.type}, "
-                    f"database={task.database}, "
-                    f"docker={'enabled' if task.docker.enabled else 'disabled'}"
+                    "Database task: type=%s, database=%s, docker=%s",
+                    task.type, task.database, 'enabled' if task.docker.enabled else 'disabled'
                 )
             
             # 显示文件夹任务信息
             for task in config.folder_tasks:
                 logger.info(
-                    f"Folder task: path={task.path}, "
-                    f"exclude_count={len(task.exclude) if task.exclude else 0}"
+                    "Folder task: path=%s, exclude_count=%d",
+                    task.path, len(task.exclude) if task.exclude else 0
                 )
             
             # 显示卷任务信息
             for task in config.volume_tasks:
-                logger.info(f"Volume task: name={task.name}")
+                logger.info("Volume task: name=%s", task.name)
             
     except Exception as e:
-        logger.error(f"Error: {str(e)}")
+        logger.error("Error: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":
+    # PyInstaller 打包后进程池需要
+    multiprocessing.freeze_support()
     main()
@@ -1,19 +1,29 @@
 from datetime import datetime
 from pathlib import Path
-from typing import Set
-import tarfile
-import fnmatch
+from contextlib import ExitStack
+from typing import BinaryIO, Optional, Set
 import os
+import tarfile
 
+from core.archiver import TreeArchiver, extract_all
 from core.backup_base import BackupPlugin
-from core.config import FolderConfig
+from core.checksum import checksum_path, write_checksum
+from core.config import FolderConfig, PrefetchConfig
+from core.crypto import ENCRYPTED_SUFFIX
+from core.estimator import DEFAULT_THROUGHPUT, TaskEstimate, sample_tree, trial_compress
+from core.pipeline import ChunkReader
+from core.prefetch import make_prefetcher
+from core.snapshot import (SnapshotWriter, find_previous_snapshot, is_snapshot_dir,
+                           read_snapshot_info, restore_snapshot)
+from core.sharding import (MANIFEST_SUFFIX, archive_shards, extract_shards, plan_shards,
+                           read_manifest, write_manifest)
 
 class FolderBackup(BackupPlugin):
     def get_type(self) -> str:
         return "folder"
 
     def backup(self, task_config: FolderConfig) -> bool:
-        self.logger.info(f"Starting folder backup: {task_config.path}")
+        self.logger.info("Starting folder backup: %s", task_config.path)
 
         try:
             if not task_config.path.exists():
@@ -23,53 +33,213 @@ class FolderBackup(BackupPlugin):
             exclude_patterns = set(task_config.exclude or [])
 
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            archive_path = backup_path / f"{task_config.path.name}-{timestamp}.tar.gz"
+            base_name = f"{task_config.path.name}-{timestamp}"
+
+            if task_config.mode == 'snapshot':
+                archive_path = self._create_snapshot(task_config, backup_path / base_name, exclude_patterns)
+            elif task_config.shards and (task_config.shards.count > 1 or task_config.shards.by == 'size'):
+                archive_path = backup_path / f"{base_name}{MANIFEST_SUFFIX}"
+                self._create_sharded_archives(task_config, archive_path, exclude_patterns)
+            else:
+                archive_path = self._create_backup_archive(
+                    task_config.path, backup_path / f"{base_name}.tar.gz", exclude_patterns,
+                    task_config.prefetch
+                )
+
+            self.logger.info("Folder backup completed: %s", archive_path)
+            return True
 
-            self._create_backup_archive(task_config.path, archive_path, exclude_patterns)
+        except Exception as e:
+            self.logger.error("Folder backup failed: %s", e)
+            return False
 
-            self.logger.info(f"Folder backup completed: {archive_path}")
+    def restore(self, task_config: FolderConfig, source: Path, target: Optional[str] = None) -> bool:
+        """解包到目标目录（归档内路径以源目录名开头）
+
+        必须显式指定目标：默认解包到源目录的上级会覆盖正在使用的源目录。
+        """
+        if not target:
+            self.logger.error(
+                "Folder restore needs an explicit target directory (NAME[/DATE]=TARGET); "
+                "restoring over %s is not done by default", task_config.path
+            )
+            return False
+        target_dir = Path(target)
+        try:
+            backup = self._select_folder_backup(source)
+            self.logger.info("Restoring folder backup %s into %s", backup, target_dir)
+            target_dir.mkdir(parents=True, exist_ok=True)
+
+            progress = self._progress(f"Restoring {backup.name}")
+            if backup.is_dir():
+                restore_snapshot(backup, target_dir, progress)
+            elif backup.name.endswith(MANIFEST_SUFFIX):
+                extract_shards(backup, target_dir,
+                               task_config.shards.workers if task_config.shards else None,
+                               self.encryption_key)
+                shards = read_manifest(backup)['shards']
+                progress.update(sum(s['files'] for s in shards), sum(s['bytes'] for s in shards))
+            else:
+                # 解密和解压在后台线程，当前线程解析 tar 并写入文件
+                chunks = self._restore_chunks(self._read_backup(backup, decompress=True), progress)
+                with tarfile.open(fileobj=ChunkReader(chunks), mode="r|") as tar:
+                    extract_all(tar, target_dir)
+            progress.finish()
+
+            self.logger.info("Folder restore completed: %s", target_dir)
             return True
 
         except Exception as e:
-            self.logger.error(f"Folder backup failed: {str(e)}")
+            self.logger.error("Folder restore failed: %s", e)
             return False
 
+    def _select_folder_backup(self, source: Path) -> Path:
+        """日期目录中最新的归档、分片清单或快照；分片文件通过清单恢复"""
+        if not source.is_dir() or is_snapshot_dir(source):
+            return source
+
+        manifests = [p for p in source.iterdir() if p.name.endswith(MANIFEST_SUFFIX)]
+        shard_files = {shard['file'] for m in manifests for shard in read_manifest(m)['shards']}
+        candidates = manifests + [
+            p for p in source.iterdir()
+            if (p.is_dir() and is_snapshot_dir(p))
+            or (p.is_file() and p.name not in shard_files
+                and (p.name.endswith('.tar.gz') or p.name.endswith('.tar.gz' + ENCRYPTED_SUFFIX)))
+        ]
+        if not candidates:
+            raise FileNotFoundError(f"No folder backup found in {source}")
+        return max(candidates, key=lambda p: p.name)
+
+    def estimate(self, task_config: FolderConfig) -> TaskEstimate:
+        """抽样遍历目录并试压缩样本，推算归档大小和耗时"""
+        exclude_patterns = set(task_config.exclude or [])
+        total, count, samples = sample_tree(task_config.path, exclude_patterns)
+
+        # 快照不压缩，且只复制变化的文件：有上一次快照时以其复制量作为预估
+        if task_config.mode == 'snapshot':
+            previous = find_previous_snapshot(self.backup_root / self._backup_name(task_config))
+            copied = read_snapshot_info(previous).get('bytes_copied', total) if previous else total
+            return TaskEstimate(
+                task_key=self.task_key(task_config),
+                source_bytes=total,
+                archive_bytes=copied,
+                seconds=copied / DEFAULT_THROUGHPUT,
+                method='history' if previous else 'sample'
+            )
+
+        probe = trial_compress(samples)
+
+        # 分片任务由多个进程并行压缩
+        workers = 1
+        if task_config.shards and (task_config.shards.count > 1 or task_config.shards.by == 'size'):
+            workers = task_config.shards.workers or task_config.shards.count
+            if task_config.shards.by == 'size' and task_config.shards.max_size:
+                workers = min(os.cpu_count() or 1, max(1, total // task_config.shards.max_size))
+            workers = max(1, min(workers, os.cpu_count() or 1))
+
+        return TaskEstimate(
+            task_key=self.task_key(task_config),
+            source_bytes=total,
+            archive_bytes=int(total * probe.ratio),
+            seconds=total / probe.throughput / workers,
+            method='sample'
+        )
+
     def _create_backup_archive(self, source_path: Path, archive_path: Path,
-                             exclude_patterns: Set[str]) -> None:
+                             exclude_patterns: Set[str],
+                             prefetch: Optional[PrefetchConfig] = None) -> Path:
         try:
-            with tarfile.open(archive_path, "w:gz") as tar:
-                parent_path = source_path.parent
-                for root, dirs, files in os.walk(source_path):
-                    relative_root = Path(root).relative_to(parent_path)
-
-                    # 过滤目录，排除匹配的目录
-                    dirs[:] = [
-                        d for d in dirs
-                        if not any(fnmatch.fnmatch(str(Path(root) / d), pattern)
-                                   for pattern in exclude_patterns)
-                    ]
-
-                    # 添加文件
-                    for file in files:
-                        file_path = Path(root) / file
-                        relative_path = Path(file_path).relative_to(parent_path)
-
-                        # 如果文件不匹配排除的模式，则加入归档
-                        if not any(fnmatch.fnmatch(str(relative_path), pattern)
-                                   for pattern in exclude_patterns):
-                            tar.add(file_path, arcname=str(relative_path))
-                            self.logger.debug(f"Added file to archive: {relative_path}")
-
-            self._verify_archive(archive_path)
+            # 在重命名之前校验临时文件，只发布校验通过的归档
+            with self._open_output(archive_path, verify=self._verify_archive) as out:
+                self._write_archive(source_path, out, exclude_patterns, prefetch)
+            return self._output_path(archive_path)
 
         except Exception as e:
-            if archive_path.exists():
-                archive_path.unlink()
             raise Exception(f"Failed to create backup archive: {str(e)}")
 
+    def _create_snapshot(self, task_config: FolderConfig, snapshot_path: Path,
+                         exclude_patterns: Set[str]) -> Path:
+        """写入硬链接快照目录，未变化的文件链接到上一次快照"""
+        try:
+            previous = find_previous_snapshot(snapshot_path.parent.parent)
+            if previous is not None:
+                self.logger.info("Linking unchanged files against snapshot: %s", previous)
+
+            progress = self._progress(f"Snapshotting {task_config.path}")
+            with self._atomic_output(snapshot_path) as partial_path:
+                writer = SnapshotWriter(partial_path, previous, task_config.snapshot_hash, progress)
+                stats = writer.add_tree(task_config.path, exclude_patterns)
+                writer.finish(task_config.path)
+            progress.finish()
+
+            self.logger.info(
+                "Snapshot: %d files, %d copied (%.1f MiB), %d hard-linked (%.1f MiB)",
+                stats.files, stats.copied, stats.bytes_copied / (1024 * 1024),
+                stats.linked, stats.bytes_linked / (1024 * 1024)
+            )
+            return snapshot_path
+
+        except Exception as e:
+            raise Exception(f"Failed to create snapshot: {str(e)}")
+
+    def _create_sharded_archives(self, task_config: FolderConfig, manifest_path: Path,
+                                 exclude_patterns: Set[str]) -> None:
+        """把文件夹拆分为多个分片归档，由进程池并行压缩，最后写入清单"""
+        try:
+            shards = plan_shards(task_config.path, exclude_patterns, task_config.shards)
+            base_name = manifest_path.name[:-len(MANIFEST_SUFFIX)]
+            shard_names = [
+                self._output_path(Path(f"{base_name}.part{i:03d}.tar.gz")).name
+                for i in range(len(shards))
+            ]
+            self.logger.info(
+                "Split %s into %d shards by %s", task_config.path, len(shards), task_config.shards.by
+            )
+
+            # 退出时按进入的逆序重命名：每个分片的 .sha256 先于分片出现，
+            # 所有分片完成后才出现清单（明文，带自己的 .sha256）
+            with ExitStack() as stack:
+                manifest_out = stack.enter_context(self._open_output(manifest_path, encrypt=False))
+                shard_paths, sidecar_paths = [], []
+                for name in shard_names:
+                    shard_paths.append(stack.enter_context(self._atomic_output(manifest_path.parent / name)))
+                    sidecar_paths.append(stack.enter_context(
+                        self._atomic_output(checksum_path(manifest_path.parent / name))
+                    ))
+                progress = self._progress(f"Archiving {task_config.path}")
+                results = archive_shards(shard_paths, shards, task_config.shards.workers,
+                                         self.logger, self.encryption_key, progress,
+                                         task_config.prefetch)
+                progress.finish()
+                for name, sidecar, result in zip(shard_names, sidecar_paths, results):
+                    write_checksum(sidecar, name, result['sha256'])
+                write_manifest(manifest_out, task_config.path, task_config.shards,
+                               shard_names, results)
+
+        except Exception as e:
+            raise Exception(f"Failed to create sharded archives: {str(e)}")
+
+    def _write_archive(self, source_path: Path, out: BinaryIO, exclude_patterns: Set[str],
+                       prefetch: Optional[PrefetchConfig] = None) -> None:
+        progress = self._progress(f"Archiving {source_path}")
+        with tarfile.open(fileobj=out, mode="w:gz", format=tarfile.PAX_FORMAT) as tar:
+            archiver = TreeArchiver(tar, progress, make_prefetcher(prefetch))
+            stats = archiver.add_tree(source_path, exclude_patterns)
+        progress.finish()
+
+        if stats.bytes_skipped:
+            self.logger.info(
+                "Skipped %.1f MiB: %d sparse files (%.1f MiB holes), %d hard links (%.1f MiB)",
+                stats.bytes_skipped / (1024 * 1024),
+                stats.sparse_files, stats.sparse_bytes_skipped / (1024 * 1024),
+                stats.hardlinks, stats.hardlink_bytes_skipped / (1024 * 1024)
+            )
+
     def _verify_archive(self, archive_path: Path) -> None:
         try:
-            with tarfile.open(archive_path, "r:gz") as tar:
-                tar.getmembers()
+            with self._open_input(archive_path) as f:
+                with tarfile.open(fileobj=f, mode="r|gz") as tar:
+                    for _ in tar:
+                        pass
         except Exception as e:
             raise Exception(f"Archive verification failed: {str(e)}")
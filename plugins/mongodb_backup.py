@@ -1,23 +1,32 @@
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Optional
-import subprocess
+import io
+import shutil
 import tarfile
+import tempfile
 
+from core.archiver import extract_all
 from core.backup_base import BackupPlugin
 from core.config import DatabaseConfig
+from core.estimator import TaskEstimate
+from core.pipeline import ProgressWriter, copy_chunks, feed_command, stream_command
 from utils.docker_helper import DockerHelper
 
+ARCHIVE_SUFFIX = '.archive.gz'
+# 旧版本的备份：mongodump --out 目录打成的 tar.gz，恢复时先解包再用 --dir 导入
+LEGACY_SUFFIX = '.tar.gz'
+
 class MongoDBBackup(BackupPlugin):
-    def __init__(self, logger, backup_root: Path):
-        super().__init__(logger, backup_root)
+    def __init__(self, logger, backup_root: Path, settings=None):
+        super().__init__(logger, backup_root, settings)
         self.docker_helper = DockerHelper()
 
     def get_type(self) -> str:
         return "mongodb"
 
     def backup(self, task_config: DatabaseConfig) -> bool:
-        self.logger.info(f"Starting MongoDB backup: {task_config.database}")
+        self.logger.info("Starting MongoDB backup: %s", task_config.database)
 
         try:
             backup_path = self._prepare_backup_path(task_config)
@@ -25,26 +34,122 @@ class MongoDBBackup(BackupPlugin):
                 success = self._docker_backup(task_config, backup_path)
             else:
                 success = self._local_backup(task_config, backup_path)
-            
+
             if success:
-                self.logger.info(f"MongoDB backup completed: {backup_path}")
+                self.logger.info("MongoDB backup completed: %s", backup_path)
             return success
 
         except Exception as e:
-            self.logger.error(f"MongoDB backup failed: {str(e)}")
+            self.logger.error("MongoDB backup failed: %s", e)
             return False
 
-    def _build_mongodump_cmd(self, task_config: DatabaseConfig, output_path: Path) -> list:
-        """构建 mongodump 命令"""
+    def restore(self, task_config: DatabaseConfig, source: Path, target: Optional[str] = None) -> bool:
+        """把 archive 流式交给 mongorestore，target 为目标数据库名"""
+        database = target or task_config.database
+        try:
+            archive = self._select_backup(source, (ARCHIVE_SUFFIX, LEGACY_SUFFIX))
+            if archive.name.endswith(LEGACY_SUFFIX):
+                self._restore_legacy(task_config, archive, database)
+                self.logger.info("MongoDB restore completed: %s", database)
+                return True
+            self.logger.info("Restoring MongoDB archive %s into database %s", archive, database)
+
+            progress = self._progress(f"Restoring {archive.name}")
+            # archive 本身是 mongodump 的 gzip 格式，这里只解密，由 mongorestore 解压
+            chunks = self._restore_chunks(self._read_backup(archive, decompress=False), progress)
+            cmd = self._build_mongorestore_cmd(task_config, database)
+            if task_config.docker.enabled:
+                container = self.docker_helper.get_container(task_config.docker.container)
+                self.docker_helper.exec_feed(container, cmd, chunks)
+            else:
+                feed_command(cmd, chunks)
+            progress.finish()
+
+            self.logger.info("MongoDB restore completed: %s", database)
+            return True
+
+        except Exception as e:
+            self.logger.error("MongoDB restore failed: %s", e)
+            return False
+
+    def _restore_legacy(self, task_config: DatabaseConfig, archive: Path, database: str) -> None:
+        """恢复旧版本的 tar.gz 备份：解包到临时目录，再让 mongorestore 读取 dump 目录
+
+        本地备份的 tar.gz 中是 temp/<db>/*.bson；容器备份保存的是 get_archive 的 tar，
+        其中还包着一层容器内打出的 tar.gz。旧备份没有加密。
+        """
+        self.logger.info("Restoring legacy MongoDB dump %s into database %s", archive, database)
+        with tempfile.TemporaryDirectory(prefix='mongorestore-') as temp:
+            temp_dir = Path(temp)
+            with tarfile.open(str(archive)) as tar:
+                members = tar.getmembers()
+                if len(members) == 1 and members[0].isfile() and members[0].name.endswith(LEGACY_SUFFIX):
+                    with tarfile.open(fileobj=tar.extractfile(members[0]), mode='r|gz') as inner:
+                        extract_all(inner, temp_dir / 'dump')
+                else:
+                    extract_all(tar, temp_dir / 'dump')
+
+            bson = next((temp_dir / 'dump').rglob('*.bson'), None)
+            if bson is None:
+                raise FileNotFoundError(f"No mongodump output found in {archive}")
+            # --dir 指向包含 <db> 目录的上一级，命名空间过滤与 archive 格式一致
+            dump_root = bson.parent.parent
+
+            if not task_config.docker.enabled:
+                stream_command(self._build_mongorestore_cmd(task_config, database, str(dump_root)),
+                               io.BytesIO())
+                return
+
+            container = self.docker_helper.get_container(task_config.docker.container)
+            container_dir = f"/tmp/{temp_dir.name}"
+            bundle = temp_dir / 'dump.tar'
+            with tarfile.open(str(bundle), 'w') as tar:
+                tar.add(str(dump_root), arcname=temp_dir.name)
+            with open(bundle, 'rb') as f:
+                if not container.put_archive('/tmp', f):
+                    raise RuntimeError("put_archive was rejected by the Docker daemon")
+            try:
+                cmd = self._build_mongorestore_cmd(task_config, database, container_dir)
+                copy_chunks(self.docker_helper.exec_stream(container, cmd), io.BytesIO())
+            finally:
+                copy_chunks(self.docker_helper.exec_stream(container, ['rm', '-rf', container_dir]),
+                            io.BytesIO())
+
+    def _build_mongorestore_cmd(self, task_config: DatabaseConfig, database: str,
+                                dump_dir: Optional[str] = None) -> list:
+        """构建 mongorestore 命令，恢复到其他库时改写命名空间
+
+        默认从 stdin 读取 archive；dump_dir 为旧版本备份解包出的 dump 目录。
+        """
+        cmd = [
+            'mongorestore',
+            '--host', task_config.host,
+            '--port', str(task_config.port),
+        ]
+        cmd.extend(['--dir', dump_dir] if dump_dir else ['--archive', '--gzip'])
+        cmd.extend(['--nsInclude', f"{task_config.database}.*"])
+        if database != task_config.database:
+            cmd.extend(['--nsFrom', f"{task_config.database}.*", '--nsTo', f"{database}.*"])
+
+        if task_config.auth and task_config.auth.username:
+            cmd.extend(['--username', task_config.auth.username])
+            cmd.extend(['--password', task_config.auth.password])
+
+        return cmd
+
+    def _build_mongodump_cmd(self, task_config: DatabaseConfig) -> list:
+        """构建 mongodump 命令，以 gzip 压缩的 archive 格式输出到 stdout"""
         cmd = [
             'mongodump',
             '--host', task_config.host,
             '--port', str(task_config.port),
             '--db', task_config.database,
-            '--out', str(output_path)
+            '--archive',
+            '--gzip'
         ]
 
-        if task_config.auth:
+        # 没有用户名和密码时不传认证参数
+        if task_config.auth and task_config.auth.username:
             cmd.extend(['--username', task_config.auth.username])
             cmd.extend(['--password', task_config.auth.password])
 
@@ -54,65 +159,68 @@ class MongoDBBackup(BackupPlugin):
 
         return cmd
 
+    def estimate(self, task_config: DatabaseConfig) -> TaskEstimate:
+        """查询 dataSize，按上一次运行的压缩率和速度推算
+
+        本地没有 mongosh 或 mongo shell 时退回上一次备份的大小。
+        """
+        if not task_config.docker.enabled and not (shutil.which('mongosh') or shutil.which('mongo')):
+            self.logger.warning("MongoDB shell not found, estimating %s from the previous backup",
+                                task_config.database)
+            return super().estimate(task_config)
+        return self._estimate_from_size(task_config, self._query_data_size(task_config))
+
+    def _query_data_size(self, task_config: DatabaseConfig) -> int:
+        """用 mongosh（或旧版 mongo shell）查询数据库的 dataSize"""
+        args = ['--quiet', '--host', task_config.host, '--port', str(task_config.port)]
+        if task_config.auth and task_config.auth.username:
+            args.extend(['--username', task_config.auth.username])
+            args.extend(['--password', task_config.auth.password])
+        args.extend([task_config.database, '--eval', 'print(db.stats().dataSize)'])
+        cmd = [
+            'sh', '-c',
+            'if command -v mongosh >/dev/null 2>&1; then exec mongosh "$@"; else exec mongo "$@"; fi',
+            'mongo-shell'
+        ] + args
+
+        output = io.BytesIO()
+        if task_config.docker.enabled:
+            container = self.docker_helper.get_container(task_config.docker.container)
+            copy_chunks(self.docker_helper.exec_stream(container, cmd), output)
+        else:
+            stream_command(cmd, output)
+        return int(float(output.getvalue().decode().strip().splitlines()[-1]))
+
+    def _archive_path(self, task_config: DatabaseConfig, backup_path: Path) -> Path:
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return backup_path / f"{task_config.database}-{timestamp}{ARCHIVE_SUFFIX}"
+
     def _docker_backup(self, task_config: DatabaseConfig, backup_path: Path) -> bool:
         try:
             container = self.docker_helper.get_container(task_config.docker.container)
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            
-            container_temp = f"/tmp/mongodb_backup_{timestamp}"
-            result = container.exec_run(f"mkdir -p {container_temp}")
-            if result[0] != 0:
-                raise Exception("Failed to create temp directory in container")
-
-            # 构建 mongodump 命令
-            cmd = self._build_mongodump_cmd(task_config, Path(container_temp))
-            
-            # 如果没有用户名和密码，删除相关参数
-            if not task_config.auth.username:
-                cmd = [arg for arg in cmd if arg not in ['-u', '--username', '-p', '--password']]
-            
-            result = container.exec_run(' '.join(cmd))
-            if result[0] != 0:
-                raise Exception(f"mongodump failed in container: {result[1]}")
-
-            archive_name = f"{task_config.database}-{timestamp}.tar.gz"
-            tar_cmd = f"tar -czf /tmp/{archive_name} -C {container_temp} ."
-            result = container.exec_run(tar_cmd)
-            if result[0] != 0:
-                raise Exception(f"Tar failed in container: {result[1]}")
-
-            with open(backup_path / archive_name, 'wb') as f:
-                bits, _ = container.get_archive(f"/tmp/{archive_name}")
-                for chunk in bits:
-                    f.write(chunk)
-
-            container.exec_run(f"rm -rf {container_temp} /tmp/{archive_name}")
+
+            # archive 直接从容器流回宿主机写入，不在容器内落临时文件
+            chunks = self.docker_helper.exec_stream(container, self._build_mongodump_cmd(task_config))
+            progress = self._progress(f"Dumping {task_config.database}")
+            with self._open_output(self._archive_path(task_config, backup_path)) as out:
+                copy_chunks(chunks, ProgressWriter(out, progress))
+            progress.finish()
+
             return True
 
         except Exception as e:
-            self.logger.error(f"Docker backup failed: {str(e)}")
+            self.logger.error("Docker backup failed: %s", e)
             return False
 
     def _local_backup(self, task_config: DatabaseConfig, backup_path: Path) -> bool:
-        temp_path = backup_path / 'temp'
-        self.create_folder(temp_path)
-
         try:
-            cmd = self._build_mongodump_cmd(task_config, temp_path)
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"mongodump failed: {result.stderr}")
-
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            archive_name = f"{task_config.database}-{timestamp}.tar.gz"
-            archive_path = backup_path / archive_name
+            progress = self._progress(f"Dumping {task_config.database}")
+            with self._open_output(self._archive_path(task_config, backup_path)) as out:
+                stream_command(self._build_mongodump_cmd(task_config), ProgressWriter(out, progress))
+            progress.finish()
 
-            with tarfile.open(archive_path, "w:gz") as tar:
-                tar.add(temp_path, arcname=temp_path.name)
-
-            subprocess.run(['rm', '-rf', str(temp_path)])
             return True
 
         except Exception as e:
-            self.logger.error(f"Local backup failed: {str(e)}")
-            return False
\ No newline at end of file
+            self.logger.error("Local backup failed: %s", e)
+            return False
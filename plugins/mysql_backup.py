@@ -1,23 +1,31 @@
+from contextlib import ExitStack
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional
-import subprocess
+from typing import BinaryIO, Callable, Dict, Iterator, Optional, Tuple
 import gzip
+import io
+import os
+import shutil
 
 from core.backup_base import BackupPlugin
 from core.config import DatabaseConfig
+from core.crypto import ENCRYPTED_SUFFIX
+from core.delta import (DELTA_SUFFIX, FULL_SUFFIX, DumpWriter, index_path_for,
+                        iter_dump, list_dumps, open_index)
+from core.estimator import TaskEstimate
+from core.pipeline import ProgressWriter, copy_chunks, feed_command, stream_command
 from utils.docker_helper import DockerHelper
 
 class MySQLBackup(BackupPlugin):
-    def __init__(self, logger, backup_root: Path):
-        super().__init__(logger, backup_root)
+    def __init__(self, logger, backup_root: Path, settings=None):
+        super().__init__(logger, backup_root, settings)
         self.docker_helper = DockerHelper()
 
     def get_type(self) -> str:
         return "mysql"
 
     def backup(self, task_config: DatabaseConfig) -> bool:
-        self.logger.info(f"Starting MySQL backup: {task_config.database}")
+        self.logger.info("Starting MySQL backup: %s", task_config.database)
 
         try:
             backup_path = self._prepare_backup_path(task_config)
@@ -27,75 +35,208 @@ class MySQLBackup(BackupPlugin):
                 success = self._local_backup(task_config, backup_path)
 
             if success:
-                self.logger.info(f"MySQL backup completed: {backup_path}")
+                self.logger.info("MySQL backup completed: %s", backup_path)
             return success
 
         except Exception as e:
-            self.logger.error(f"MySQL backup failed: {str(e)}")
+            self.logger.error("MySQL backup failed: %s", e)
             return False
 
-    def _docker_backup(self, task_config: DatabaseConfig, backup_path: Path) -> bool:
+    def restore(self, task_config: DatabaseConfig, source: Path, target: Optional[str] = None) -> bool:
+        """把导出（增量导出沿链重建）流式导入 mysql，target 为目标数据库名"""
+        database = target or task_config.database
         try:
+            dump = self._select_backup(source, (FULL_SUFFIX, DELTA_SUFFIX))
+            self.logger.info("Restoring MySQL dump %s into database %s", dump, database)
+
+            progress = self._progress(f"Restoring {dump.name}")
+            chunks = self._restore_chunks(self._dump_chunks(dump, database), progress)
+            cmd = [
+                'mysql',
+                '-h', task_config.host,
+                '-P', str(task_config.port),
+                '-u', task_config.auth.username
+            ]
+            if task_config.docker.enabled:
+                container = self.docker_helper.get_container(task_config.docker.container)
+                self.docker_helper.exec_feed(
+                    container, cmd, chunks, environment={"MYSQL_PWD": task_config.auth.password}
+                )
+            else:
+                feed_command(cmd, chunks, env=dict(os.environ, MYSQL_PWD=task_config.auth.password))
+            progress.finish()
+
+            self.logger.info("MySQL restore completed: %s", database)
+            return True
+
+        except Exception as e:
+            self.logger.error("MySQL restore failed: %s", e)
+            return False
+
+    def _dump_chunks(self, dump: Path, database: str) -> Iterator[bytes]:
+        """mysqldump 导出单库时不含 USE 语句，这里先创建并切换到目标库"""
+        name = database.replace('`', '``')
+        yield f"CREATE DATABASE IF NOT EXISTS `{name}`;\nUSE `{name}`;\n".encode()
+        for chunk in iter_dump(dump, self.encryption_key):
+            yield chunk
+
+    def _build_mysqldump_cmd(self, task_config: DatabaseConfig) -> list:
+        """构建 mysqldump 命令，密码通过 MYSQL_PWD 环境变量传递"""
+        cmd = [
+            'mysqldump',
+            '-h', task_config.host,
+            '-P', str(task_config.port),
+            '-u', task_config.auth.username,
+        ]
+        if task_config.delta and task_config.delta.enabled:
+            # 行级增量要求导出稳定：每行一条 INSERT、按主键排序、不写导出时间。
+            # 代价是 SQL 体积变大、恢复时逐条执行变慢，README 中有说明
+            cmd.extend(['--skip-extended-insert', '--order-by-primary', '--skip-dump-date'])
+        cmd.append(task_config.database)
+        return cmd
+
+    def estimate(self, task_config: DatabaseConfig) -> TaskEstimate:
+        """从 information_schema 查询数据量，按上一次运行的压缩率和速度推算
+
+        本地没有 mysql 客户端时退回上一次备份的大小。
+        """
+        if not task_config.docker.enabled and shutil.which('mysql') is None:
+            self.logger.warning("mysql client not found, estimating %s from the previous backup",
+                                task_config.database)
+            return super().estimate(task_config)
+        return self._estimate_from_size(task_config, self._query_data_size(task_config))
+
+    def _query_data_size(self, task_config: DatabaseConfig) -> int:
+        """从 information_schema 查询数据库的数据大小"""
+        database = task_config.database.replace("'", "''")
+        cmd = [
+            'mysql',
+            '-h', task_config.host,
+            '-P', str(task_config.port),
+            '-u', task_config.auth.username,
+            '-N', '-B',
+            '-e', (
+                "SELECT COALESCE(SUM(data_length), 0) FROM information_schema.tables "
+                f"WHERE table_schema = '{database}'"
+            )
+        ]
+        output = io.BytesIO()
+        self._stream(task_config, cmd, output)
+        return int(output.getvalue().decode().strip() or 0)
+
+    def _stream(self, task_config: DatabaseConfig, cmd: list, sink: BinaryIO) -> None:
+        """在容器内或本地运行 MySQL 客户端命令，stdout 写入 sink"""
+        if task_config.docker.enabled:
             container = self.docker_helper.get_container(task_config.docker.container)
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            temp_file = f"/tmp/{task_config.database}-{timestamp}.sql.gz"
-            output_file = backup_path / f"{task_config.database}-{timestamp}.sql.gz"
-
-            # 使用环境变量传递密码
-            mysqldump_cmd = (
-                f"mysqldump -h {task_config.host} "
-                f"-P {task_config.port} "
-                f"-u {task_config.auth.username} "
-                f"{task_config.database} | gzip > {temp_file}"
+            copy_chunks(
+                self.docker_helper.exec_stream(
+                    container, cmd, environment={"MYSQL_PWD": task_config.auth.password}
+                ),
+                sink
             )
-            
-            result = container.exec_run(
-                cmd=['sh', '-c', mysqldump_cmd],
+        else:
+            env = dict(os.environ, MYSQL_PWD=task_config.auth.password)
+            stream_command(cmd, sink, env=env)
+
+    def _docker_backup(self, task_config: DatabaseConfig, backup_path: Path) -> bool:
+        try:
+            container = self.docker_helper.get_container(task_config.docker.container)
+
+            # mysqldump 输出直接流回宿主机，压缩（和加密）在写入时一次完成
+            chunks = self.docker_helper.exec_stream(
+                container,
+                self._build_mysqldump_cmd(task_config),
                 environment={"MYSQL_PWD": task_config.auth.password}
             )
-            
-            if result.exit_code != 0:
-                raise Exception(f"mysqldump failed in container: {result.output}")
+            self._write_dump(task_config, backup_path, lambda sink: copy_chunks(chunks, sink))
 
-            with open(output_file, 'wb') as f:
-                bits, _ = container.get_archive(temp_file)
-                for chunk in bits:
-                    f.write(chunk)
-
-            container.exec_run(f"rm -f {temp_file}")
             return True
 
         except Exception as e:
-            self.logger.error(f"Docker backup failed: {str(e)}")
+            self.logger.error("Docker backup failed: %s", e)
             return False
 
     def _local_backup(self, task_config: DatabaseConfig, backup_path: Path) -> bool:
         try:
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            output_file = backup_path / f"{task_config.database}-{timestamp}.sql.gz"
-
-            with gzip.open(output_file, 'wb') as f:
-                mysqldump_process = subprocess.Popen(
-                    [
-                        'mysqldump',
-                        '-h', task_config.host,
-                        '-P', str(task_config.port),
-                        '-u', task_config.auth.username,
-                        f"-p{task_config.auth.password}",
-                        task_config.database
-                    ],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-                stdout, stderr = mysqldump_process.communicate()
-                
-                if mysqldump_process.returncode != 0:
-                    raise Exception(f"mysqldump failed: {stderr.decode()}")
-                
-                f.write(stdout)
+            env = dict(os.environ, MYSQL_PWD=task_config.auth.password)
+            self._write_dump(
+                task_config, backup_path,
+                lambda sink: stream_command(self._build_mysqldump_cmd(task_config), sink, env=env)
+            )
 
             return True
 
         except Exception as e:
-            self.logger.error(f"Local backup failed: {str(e)}")
-            return False
\ No newline at end of file
+            self.logger.error("Local backup failed: %s", e)
+            return False
+
+    def _write_dump(self, task_config: DatabaseConfig, backup_path: Path,
+                    produce: Callable[[BinaryIO], None]) -> None:
+        """把 produce 产生的导出写入备份目录；启用增量时以上一次导出为参考编码"""
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        delta = task_config.delta if task_config.delta and task_config.delta.enabled else None
+        progress = self._progress(f"Dumping {task_config.database}")
+        if delta is None:
+            with self._open_output(backup_path / f"{task_config.database}-{timestamp}{FULL_SUFFIX}") as out:
+                with gzip.GzipFile(fileobj=out, mode='wb') as f:
+                    produce(ProgressWriter(f, progress))
+            progress.finish()
+            return
+
+        reference = self._delta_reference(task_config)
+        with ExitStack() as stack:
+            if reference is None:
+                output_file = backup_path / f"{task_config.database}-{timestamp}{FULL_SUFFIX}"
+                header = dict(version=1, depth=0, reference=None)
+                reference_name, reference_digests = None, None
+            else:
+                reference_name, depth, reference_index = reference
+                output_file = backup_path / f"{task_config.database}-{timestamp}{DELTA_SUFFIX}"
+                header = dict(version=1, depth=depth + 1, reference=reference_name)
+                # 参考的行哈希在编码过程中顺序读取
+                _, reference_digests = stack.enter_context(open_index(reference_index, self.encryption_key))
+
+            # 行哈希索引先于导出完成重命名；只有导出存在时索引才会被当作参考
+            out = stack.enter_context(self._open_output(output_file))
+            index_out = stack.enter_context(self._open_output(index_path_for(output_file)))
+            with gzip.GzipFile(fileobj=out, mode='wb') as f:
+                writer = DumpWriter(f, index_out, header, reference_name, reference_digests)
+                produce(ProgressWriter(writer, progress))
+                writer.close()
+        progress.finish()
+
+        if reference_name is not None:
+            self.logger.info(
+                "Delta dump against %s: %d lines copied, %d literal bytes",
+                reference_name, writer.copied_lines, writer.literal_bytes
+            )
+
+    def _delta_reference(self, task_config: DatabaseConfig) -> Optional[Tuple[str, int, Path]]:
+        """返回增量编码的参考：(相对任务目录的路径, 链深度, 行哈希索引路径)；需要完整导出时返回 None"""
+        task_dir = self.backup_root / self._backup_name(task_config)
+        dumps = list_dumps(task_dir)
+        if not dumps:
+            return None
+
+        # 参考总是最近一次导出，保证每条增量链按时间连续，保留策略可据此推断依赖
+        latest = dumps[-1]
+        index_path = index_path_for(latest)
+        candidates = [index_path, index_path.with_name(index_path.name + ENCRYPTED_SUFFIX)]
+        index_path = next((p for p in candidates if p.exists()), None)
+        if index_path is None:
+            self.logger.info("No line index for %s, writing a full dump", latest.name)
+            return None
+
+        # 先完整读一遍索引（不保留内容），损坏的索引在开始导出之前发现
+        try:
+            with open_index(index_path, self.encryption_key) as (header, digests):
+                for _ in digests:
+                    pass
+        except Exception as e:
+            self.logger.warning("Unreadable line index %s, writing a full dump: %s", index_path, e)
+            return None
+
+        depth = int(header.get('depth', 0))
+        if depth + 1 >= task_config.delta.full_every:
+            return None
+        return latest.relative_to(task_dir).as_posix(), depth, index_path
@@ -1,43 +1,162 @@
 from datetime import datetime
 from pathlib import Path
+from typing import Optional, Set
+import os
+import tarfile
 
+from core.archiver import TreeArchiver, iter_tree
 from core.backup_base import BackupPlugin
 from core.config import VolumeConfig
+from core.crypto import ENCRYPTED_SUFFIX
+from core.estimator import DEFAULT_THROUGHPUT, TaskEstimate, sample_tree, trial_compress
+from core.pipeline import ProgressWriter, copy_chunks
 from utils.docker_helper import DockerHelper
 
+# 归档内的顶层目录，与辅助容器中卷的挂载路径 /volume 对应
+ARC_ROOT = 'volume'
+
+def _raise(error: OSError) -> None:
+    raise error
+
 class VolumeBackup(BackupPlugin):
-    def __init__(self, logger, backup_root: Path):
-        super().__init__(logger, backup_root)
+    def __init__(self, logger, backup_root: Path, settings=None):
+        super().__init__(logger, backup_root, settings)
         self.docker_helper = DockerHelper()
 
     def get_type(self) -> str:
         return "volume"
 
+    def estimate(self, task_config: VolumeConfig) -> TaskEstimate:
+        """挂载点在宿主机可读时抽样遍历并试压缩，否则取 docker df 的磁盘占用（不压缩）"""
+        mountpoint = self._host_mountpoint(task_config.name)
+        if mountpoint is not None:
+            total, _, samples = sample_tree(mountpoint, set(task_config.exclude or []), ARC_ROOT)
+            probe = trial_compress(samples)
+            return TaskEstimate(
+                task_key=self.task_key(task_config),
+                source_bytes=total,
+                archive_bytes=int(total * probe.ratio),
+                seconds=total / probe.throughput,
+                method='sample'
+            )
+
+        size = self._volume_size(task_config.name)
+        return TaskEstimate(
+            task_key=self.task_key(task_config),
+            source_bytes=size,
+            archive_bytes=size,  # 经辅助容器的卷归档不压缩
+            seconds=size / DEFAULT_THROUGHPUT,
+            method='disk'
+        )
+
+    def _host_mountpoint(self, volume_name: str) -> Optional[Path]:
+        """返回卷在宿主机上的挂载点；不存在或当前用户不可读时返回 None"""
+        mountpoint = self.docker_helper.client.api.inspect_volume(volume_name).get('Mountpoint')
+        if mountpoint and os.path.isdir(mountpoint) and os.access(mountpoint, os.R_OK | os.X_OK):
+            return Path(mountpoint)
+        return None
+
+    def _volume_size(self, volume_name: str) -> int:
+        for volume in self.docker_helper.client.api.df().get('Volumes') or []:
+            if volume.get('Name') == volume_name:
+                return max(0, (volume.get('UsageData') or {}).get('Size', 0))
+        raise ValueError(f"Volume not found: {volume_name}")
+
     def backup(self, task_config: VolumeConfig) -> bool:
-        self.logger.info(f"Starting volume backup: {task_config.name}")
+        self.logger.info("Starting volume backup: %s", task_config.name)
 
         try:
             backup_path = self._prepare_backup_path(task_config)
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            archive_name = f"{task_config.name}-{timestamp}.tar"
-            output_file = backup_path / archive_name
-
-            container = self.docker_helper.client.containers.run(
-                "registry.cn-hangzhou.aliyuncs.com/cqtech/busybox:latest",
-                f"tar cvf /backup/{archive_name} /volume",
-                volumes={
-                    task_config.name: {"bind": "/volume", "mode": "ro"},
-                    str(backup_path): {"bind": "/backup", "mode": "rw"}
-                },
-                remove=True
-            )
+            base_name = f"{task_config.name}-{timestamp}"
+
+            exclude_patterns = set(task_config.exclude or [])
+            mountpoint = self._host_mountpoint(task_config.name)
+            output_file = None
+            if mountpoint is not None:
+                try:
+                    output_file = self._archive_mountpoint(
+                        task_config, mountpoint, exclude_patterns, backup_path / f"{base_name}.tar.gz"
+                    )
+                except PermissionError as e:
+                    # 未完成的临时文件已由 _open_output 删除，整卷改由辅助容器重新读取
+                    self.logger.warning(
+                        "Cannot read volume from the host, using a helper container instead: %s", e
+                    )
+            if output_file is None:
+                output_file = self._archive_via_container(task_config, backup_path / f"{base_name}.tar")
+
+            self.logger.info("Volume backup completed: %s", output_file)
+            return True
+
+        except Exception as e:
+            self.logger.error("Volume backup failed: %s", e)
+            return False
+
+    def _archive_mountpoint(self, task_config: VolumeConfig, mountpoint: Path,
+                            exclude_patterns: Set[str], output_file: Path) -> Path:
+        """直接在宿主机上读取挂载点，写入与文件夹备份相同的压缩归档
+
+        归档内路径以 volume/ 开头，与辅助容器 get_archive 的结构一致，恢复方式相同。
+        遇到不可读的文件或目录时抛出 PermissionError，由调用方改用辅助容器。
+        """
+        self.logger.info("Reading volume %s from host path %s", task_config.name, mountpoint)
+        entries = iter_tree(mountpoint, exclude_patterns, ARC_ROOT, include_dirs=True, onerror=_raise)
+        progress = self._progress(f"Archiving volume {task_config.name}")
+        with self._open_output(output_file, verify=self._verify_archive) as out:
+            with tarfile.open(fileobj=out, mode="w:gz", format=tarfile.PAX_FORMAT) as tar:
+                TreeArchiver(tar, progress).add_files(entries)
+        progress.finish()
+        return self._output_path(output_file)
+
+    def _archive_via_container(self, task_config: VolumeConfig, output_file: Path) -> Path:
+        """挂载点不可读时的后备方式：辅助容器只挂载卷不运行，卷内容通过 get_archive 以 tar 流读取"""
+        if task_config.exclude:
+            self.logger.warning("Exclude patterns are ignored when reading volume %s "
+                                "through a helper container", task_config.name)
+        container = self.docker_helper.create_volume_container(task_config.name)
+        try:
+            bits, _ = container.get_archive("/" + ARC_ROOT)
+            progress = self._progress(f"Archiving volume {task_config.name}")
+            with self._open_output(output_file, verify=self._verify_archive) as out:
+                copy_chunks(bits, ProgressWriter(out, progress))
+            progress.finish()
+        finally:
+            container.remove(force=True)
+        return self._output_path(output_file)
+
+    def _verify_archive(self, archive_path: Path) -> None:
+        """发布前完整读一遍归档；宿主机归档为 tar.gz，辅助容器归档为不压缩的 tar"""
+        try:
+            with self._open_input(archive_path) as f:
+                with tarfile.open(fileobj=f, mode="r|*") as tar:
+                    for _ in tar:
+                        pass
+        except Exception as e:
+            raise Exception(f"Archive verification failed: {str(e)}")
+
+    def restore(self, task_config: VolumeConfig, source: Path, target: Optional[str] = None) -> bool:
+        """通过挂载目标卷的辅助容器 put_archive 流式恢复，target 为目标卷名"""
+        volume_name = target or task_config.name
+        try:
+            archive = self._select_backup(source, ('.tar', '.tar.gz'))
+            self.logger.info("Restoring volume backup %s into volume %s", archive, volume_name)
+
+            progress = self._progress(f"Restoring {archive.name}")
+            decompress = archive.name.endswith(('.gz', '.gz' + ENCRYPTED_SUFFIX))
+            chunks = self._restore_chunks(self._read_backup(archive, decompress), progress)
+            # 归档内路径以 volume/ 开头，解包到根目录即写入卷的挂载点
+            container = self.docker_helper.create_volume_container(volume_name, read_only=False)
+            try:
+                if not container.put_archive("/", chunks):
+                    raise RuntimeError("put_archive was rejected by the Docker daemon")
+            finally:
+                container.remove(force=True)
+            progress.finish()
 
-            if output_file.exists():
-                self.logger.info(f"Volume backup completed: {output_file}")
-                return True
-            else:
-                raise Exception(f"Backup file not created: {output_file}")
+            self.logger.info("Volume restore completed: %s", volume_name)
+            return True
 
         except Exception as e:
-            self.logger.error(f"Volume backup failed: {str(e)}")
+            self.logger.error("Volume restore failed: %s", e)
             return False
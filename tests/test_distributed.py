@@ -0,0 +1,155 @@
+import logging
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from core.config import CoordinatorConfig, DistributedTask
+from core.distributed import DONE, RUNNING, Coordinator, WorkerAgent
+from core.events import EventBus
+from core.journal import TaskHistory
+
+LOGGER = logging.getLogger('test_distributed')
+
+class StubPlugin:
+    """只记录执行节点的插件，run_task 调用 on_run"""
+
+    def __init__(self, on_run):
+        self.on_run = on_run
+
+    def task_key(self, task):
+        return task
+
+    def run_task(self, task, *expected):
+        return self.on_run(task)
+
+def stub_system(backup_root: Path, on_run):
+    return SimpleNamespace(
+        logger=LOGGER,
+        config=SimpleNamespace(backup_root=backup_root),
+        events=EventBus(),
+        plugins={'folder': StubPlugin(on_run)},
+        collect_tasks=lambda: [('folder', 'folder_a')],
+        expected=lambda key: (None, None),
+        cleanup_partials=lambda run_lock: None,
+        cleanup_expired=lambda run_lock: None,
+    )
+
+class PartitionedAgent(WorkerAgent):
+    """领到任务后与协调节点断开：所有请求阻塞到测试结束"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.partitioned = threading.Event()
+        self.released = threading.Event()
+
+    def _call(self, path, payload, retry=True):
+        if self.partitioned.is_set():
+            self.released.wait()
+            raise OSError("partition ended")
+        return super()._call(path, payload, retry)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class LeaseExpiryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.port = free_port()
+        config = CoordinatorConfig(
+            listen=f'127.0.0.1:{self.port}',
+            state_dir=self.root / 'coordinator',
+            tasks=[DistributedTask(key='folder_a')],
+            lease_seconds=1,
+            worker_wait_seconds=30,
+        )
+        history = TaskHistory(self.root / 'history.json', LOGGER)
+        self.coordinator = Coordinator(config, LOGGER, history)
+        self.result = {}
+        self.server = threading.Thread(
+            target=lambda: self.result.setdefault('ok', self.coordinator.serve(poll_interval=0.1)),
+            daemon=True
+        )
+        self.server.start()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _start(self, agent):
+        thread = threading.Thread(target=self._run_agent, args=(agent,), daemon=True)
+        thread.start()
+        return thread
+
+    def _run_agent(self, agent):
+        try:
+            agent.run()
+        except Exception:
+            pass
+
+    def _wait(self, predicate, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.05)
+
+    def test_lost_worker_task_is_reassigned(self):
+        url = f'http://127.0.0.1:{self.port}'
+        ran_on = []
+
+        def stalled(task):
+            ran_on.append('w1')
+            w1.partitioned.set()
+            w1.released.wait()
+            return True
+
+        w1 = PartitionedAgent(stub_system(self.root / 'w1', stalled), url, 'w1',
+                              poll_interval=0.1, retry_seconds=5)
+        (self.root / 'w1').mkdir()
+        self._start(w1)
+        task = self.coordinator.tasks['folder_a']
+        self._wait(lambda: task.state == RUNNING and task.worker == 'w1')
+
+        def healthy(task):
+            ran_on.append('w2')
+            return True
+
+        (self.root / 'w2').mkdir()
+        w2 = WorkerAgent(stub_system(self.root / 'w2', healthy), url, 'w2',
+                         poll_interval=0.1, retry_seconds=5)
+        w2_thread = self._start(w2)
+        try:
+            self.server.join(timeout=15)
+            w2_thread.join(timeout=5)
+        finally:
+            w1.released.set()
+
+        self.assertFalse(self.server.is_alive())
+        self.assertTrue(self.result['ok'])
+        self.assertEqual(task.state, DONE)
+        self.assertEqual(task.worker, 'w2')
+        self.assertEqual(task.attempts, 2)
+        self.assertEqual(task.leased_by, ['w1', 'w2'])
+        self.assertEqual(ran_on, ['w1', 'w2'])
+
+    def test_result_from_worker_without_lease_is_ignored(self):
+        self.coordinator.register({'name': 'w1', 'concurrency': 1, 'tasks': {'folder_a': None}})
+        self.coordinator.register({'name': 'w2', 'concurrency': 1, 'tasks': {'folder_a': None}})
+        self.assertEqual(self.coordinator.report({'name': 'w3', 'id': 'folder_a', 'success': True}),
+                         {'error': 'unregistered'})
+        self.assertEqual(self.coordinator.report({'name': 'w2', 'id': 'folder_a', 'success': True}),
+                         {'accepted': False})
+        self.assertNotEqual(self.coordinator.tasks['folder_a'].state, DONE)
+        # 让后台的协调节点退出
+        self.coordinator.lease({'name': 'w1', 'slots': 1})
+        self.coordinator.report({'name': 'w1', 'id': 'folder_a', 'success': True})
+        self.server.join(timeout=15)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,13 @@
 import docker
 import re
-from typing import Optional
+import socket
+import struct
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# 卷备份使用的辅助容器镜像
+HELPER_IMAGE = "registry.cn-hangzhou.aliyuncs.com/cqtech/busybox:latest"
 
 class DockerHelper:
     def __init__(self):
@@ -27,3 +34,82 @@ class DockerHelper:
         """在容器中执行命令"""
         result = container.exec_run(command, demux=True)
         return result
+
+    def exec_stream(self, container, cmd: List[str], environment: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+        """在容器中执行命令并流式返回 stdout，命令失败时抛出 RuntimeError"""
+        api = self.client.api
+        exec_id = api.exec_create(container.id, cmd, stdout=True, stderr=True, environment=environment)
+        stderr_chunks = []
+        for stdout, stderr in api.exec_start(exec_id, stream=True, demux=True):
+            if stderr:
+                stderr_chunks.append(stderr)
+            if stdout:
+                yield stdout
+
+        exit_code = api.exec_inspect(exec_id).get('ExitCode')
+        if exit_code != 0:
+            stderr = b''.join(stderr_chunks).decode(errors='replace').strip()
+            raise RuntimeError(f"{cmd[0]} failed in container {container.name} (exit {exit_code}): {stderr}")
+
+    def exec_feed(self, container, cmd: List[str], chunks: Iterable[bytes],
+                  environment: Optional[Dict[str, str]] = None) -> int:
+        """在容器中执行命令并把 chunks 流式写入其 stdin，返回写入的字节数；命令失败时抛出 RuntimeError"""
+        api = self.client.api
+        exec_id = api.exec_create(container.id, cmd, stdin=True, stdout=True, stderr=True,
+                                  environment=environment)
+        sock = api.exec_start(exec_id, socket=True)
+        raw = getattr(sock, '_sock', sock)
+
+        # 输出在后台读取，避免命令输出写满缓冲区后阻塞 stdin
+        output = []
+        reader = threading.Thread(target=lambda: output.append(
+            b''.join(iter(lambda: raw.recv(65536), b''))
+        ))
+        reader.daemon = True
+        reader.start()
+
+        total = 0
+        try:
+            try:
+                for chunk in chunks:
+                    raw.sendall(chunk)
+                    total += len(chunk)
+            except BrokenPipeError:
+                pass  # 命令提前退出，下面按退出码报告
+            raw.shutdown(socket.SHUT_WR)
+            reader.join()
+        finally:
+            sock.close()
+
+        inspect = api.exec_inspect(exec_id)
+        while inspect.get('Running'):
+            time.sleep(0.1)
+            inspect = api.exec_inspect(exec_id)
+        exit_code = inspect.get('ExitCode')
+        if exit_code != 0:
+            message = _demux(b''.join(output)).decode(errors='replace').strip()
+            raise RuntimeError(f"{cmd[0]} failed in container {container.name} (exit {exit_code}): {message}")
+        return total
+
+    def create_volume_container(self, volume_name: str, read_only: bool = True):
+        """创建（不启动）挂载了卷的辅助容器，用于 get_archive/put_archive"""
+        mode = "ro" if read_only else "rw"
+        kwargs = dict(
+            command="true",
+            volumes={volume_name: {"bind": "/volume", "mode": mode}}
+        )
+        try:
+            return self.client.containers.create(HELPER_IMAGE, **kwargs)
+        except docker.errors.ImageNotFound:
+            self.client.images.pull(HELPER_IMAGE)
+            return self.client.containers.create(HELPER_IMAGE, **kwargs)
+
+def _demux(data: bytes) -> bytes:
+    """合并 docker 多路复用输出（8 字节帧头 + 数据）中的 stdout 和 stderr"""
+    payload = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size = struct.unpack('>I', data[offset + 4:offset + 8])[0]
+        payload.append(data[offset + 8:offset + 8 + size])
+        offset += 8 + size
+    return b''.join(payload)